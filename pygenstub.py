@@ -25,18 +25,18 @@ https://pygenstub.readthedocs.io/
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import ast
-import inspect
+import hashlib
+import json
 import logging
+import os
 import re
 import sys
-import textwrap
-from argparse import ArgumentParser
-from bisect import bisect
+import time
+import tokenize
+from bisect import bisect, bisect_left
 from collections import OrderedDict
 from io import StringIO
 
-from docutils.core import publish_doctree
-
 
 __version__ = "1.2.4"  # sig: str
 
@@ -46,11 +46,29 @@ PY3 = sys.version_info >= (3, 0)
 if not PY3:
     import __builtin__ as builtins
     from codecs import open
+
+    def _intern(string):
+        """Get the string itself, since only byte strings can be interned in Python 2.
+
+        :sig: (str) -> str
+        :param string: String to intern.
+        :return: Same string.
+        """
+        return string
+
+
 else:
     import builtins
+    from sys import intern as _intern
 
 
 # sigalias: Document = docutils.nodes.document
+# sigalias: StubResult = Tuple[str, Optional[str], Optional[str]]
+# sigalias: FileState = Dict[str, Any]
+# sigalias: Token = Tuple[int, str, Tuple[int, int], Tuple[int, int], str]
+# sigalias: TypeToken = Tuple[str, str, int, int]
+# sigalias: ModuleIndex = Tuple[Tuple[str, float], Optional[Dict[str, str]]]
+# sigalias: BuildEnvironment = sphinx.environment.BuildEnvironment
 
 
 BUILTIN_TYPES = {k for k, t in builtins.__dict__.items() if isinstance(t, type)}
@@ -62,17 +80,448 @@ SIG_ALIAS = "# sigalias:"  # sig: str
 
 DECORATORS = {"property", "staticmethod", "classmethod"}  # sig: Set[str]
 
+# names that were added to the typing module after Python 3.5, with their versions
+TYPING_ADDITIONS = {
+    "AsyncContextManager": (3, 6),
+    "ChainMap": (3, 6),
+    "ClassVar": (3, 6),
+    "Collection": (3, 6),
+    "Counter": (3, 6),
+    "Deque": (3, 6),
+    "NoReturn": (3, 6),
+    "OrderedDict": (3, 7),
+    "Final": (3, 8),
+    "Literal": (3, 8),
+    "Protocol": (3, 8),
+    "SupportsIndex": (3, 8),
+    "TypedDict": (3, 8),
+    "Annotated": (3, 9),
+    "Concatenate": (3, 10),
+    "ParamSpec": (3, 10),
+    "TypeAlias": (3, 10),
+    "TypeGuard": (3, 10),
+    "LiteralString": (3, 11),
+    "Never": (3, 11),
+    "NotRequired": (3, 11),
+    "Required": (3, 11),
+    "Self": (3, 11),
+    "TypeVarTuple": (3, 11),
+    "Unpack": (3, 11),
+    "ReadOnly": (3, 13),
+    "TypeIs": (3, 13),
+}  # sig: Dict[str, Tuple[int, int]]
+
+# modules that are searched for the names that are not defined in the source
+KNOWN_MODULES = ("typing", "collections.abc")  # sig: Tuple[str, ...]
+
+CACHE_SIZE = 1024  # sig: int
+
 LINE_LENGTH_LIMIT = 79
 INDENT = 4 * " "
 
 EDIT_WARNING = "THIS FILE IS AUTOMATICALLY GENERATED, DO NOT EDIT MANUALLY."
 
-_RE_QUALIFIED_TYPES = re.compile(r"\w+(?:\.\w+)*")
-_RE_COMMENT_IN_STRING = re.compile(r"""['"]\s*%(text)s\s*.*['"]""" % {"text": SIG_COMMENT})
+ENGINES = ("ast", "tokens")  # sig: Tuple[str, str]
+
+# statements that can have their bodies on the same line
+_COMPOUND_KEYWORDS = {
+    "if",
+    "elif",
+    "else",
+    "for",
+    "while",
+    "with",
+    "try",
+    "except",
+    "finally",
+    "async",
+    "match",
+    "case",
+}
+
+SOURCE_SUFFIX = ".py"
+STUB_SUFFIX = ".pyi"
+
+WATCH_INTERVAL = 1.0  # sig: float
+WATCH_DELAY = 0.2  # sig: float
+
+PROFILE_STAGES = ("parsing", "docutils", "visiting", "generation")  # sig: Tuple[str, ...]
+PROFILE_LIMIT = 10  # sig: int
+
+# string and bytes literals, with their prefixes and escape sequences
+_STRING = r"""[bBrRuU]{0,2}(?:'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")"""
+
+_RE_TYPE_TOKEN = re.compile(
+    r"""(\s*)([^\W\d]\w*(?:\.[^\W\d]\w*)*(?![\w'"])|%s"""
+    r"""|\.\.\.|-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?[jJ]?|->|[\[\](),|])""" % _STRING,
+    re.UNICODE | re.DOTALL,
+)
+_RE_TYPE_NAME = re.compile(r"[^\W\d]\w*(?:\.[^\W\d]\w*)*$", re.UNICODE)
+_RE_SUBSCRIPTED_TYPE = re.compile(
+    r"([^\W\d]\w*(?:\.[^\W\d]\w*)*)\[(.*)\]$", re.UNICODE | re.DOTALL
+)
+
+# names in an argument that can't be parsed, except for keyword argument names
+_RE_OPAQUE_NAME = re.compile(
+    r"(?<![\w.])[^\W\d]\w*(?:\.[^\W\d]\w*)*(?![\w.]|\s*=(?!=))", re.UNICODE
+)
+_RE_STRING = re.compile(_STRING, re.DOTALL)
+
+# subscripted types and lists that contain only names, lists, and subscripts
+_RE_PLAIN_TYPE = re.compile(
+    r"([^\W\d]\w*(?:\.[^\W\d]\w*)*)?\s*\[([\w\s.,\[\]]*)\]$", re.UNICODE
+)
+
+# names of the types that take values instead of types as arguments
+_LITERAL_TYPE = "Literal"
+_ANNOTATED_TYPE = "Annotated"
+
+# characters that can't occur in type syntax, only in values like annotation metadata
+_RE_NON_TYPE_CHAR = re.compile(r"""[^\w\s.,'"\[\]|-]""", re.UNICODE)
+
+_TYPE_OPERATORS = frozenset(["->", "[", "]", "(", ")", ",", "|"])
+
+_RE_FIELD_MARKER = re.compile(r":(?![: ])([^:\\]|\\.)*(?<! ):( +|$)")
+_RE_PUNCTUATION_LINE = re.compile(r"""^[!-/:-@\[-`{-~][\s!-/:-@\[-`{-~]*$""")
+_RE_SPECIAL_WHITESPACE = re.compile("[\v\f]")
+
+# classes get stubs even if they don't have any signatures
+_STUB_MARKERS = r"%(f)s|%(c)s|%(a)s|^[ \t]*class\b" % {
+    "f": re.escape(":" + SIG_FIELD + ":"),
+    "c": re.escape(SIG_COMMENT),
+    "a": re.escape(SIG_ALIAS),
+}
+_RE_STUB_MARKERS = re.compile(_STUB_MARKERS, re.MULTILINE)
+_RE_STUB_MARKERS_BYTES = re.compile(_STUB_MARKERS.encode("ascii"), re.MULTILINE)
+
+# top level classes and type aliases, which other modules can import from a stub
+_RE_MODULE_SYMBOL = re.compile(
+    r"^(?:class[ \t]+|[ \t]*%s[ \t]*)([^\W\d]\w*)" % re.escape(SIG_ALIAS),
+    re.MULTILINE | re.UNICODE,
+)
+_RE_WORD = re.compile(r"[^\W\d]\w*", re.UNICODE)
+
+# type alias comments on lines of their own, with their names and definitions
+_RE_ALIAS_LINE = re.compile(
+    r"^[ \t]*%s[ \t]*([^\W\d]\w*)[ \t]*=[ \t]*(.*?)[ \t]*$" % re.escape(SIG_ALIAS),
+    re.MULTILINE | re.UNICODE,
+)
+
+# lines that might start a node which contributes to the stub
+_RE_DECLARATION_LINE = re.compile(r"\b(?:def|class|from)\b|%s" % re.escape(SIG_COMMENT))
+
+_DECLARATION_NODES = (
+    ast.FunctionDef,
+    getattr(ast, "AsyncFunctionDef", ast.FunctionDef),
+    ast.ClassDef,
+    ast.ImportFrom,
+    ast.Assign,
+)
 
 
 _logger = logging.getLogger(__name__)
 
+_timer = getattr(time, "perf_counter", time.time)
+
+_MISSING = object()  # sig: object
+
+
+class LRUCache:
+    """A bounded cache that discards the least recently used items first."""
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        """Initialize this cache.
+
+        :sig: (Optional[int]) -> None
+        :param maxsize: Maximum number of items, ``None`` for no limit, ``0`` to disable.
+        """
+        self.maxsize = maxsize  # sig: Optional[int]
+        self.hits = 0  # sig: int
+        self.misses = 0  # sig: int
+        self._items = OrderedDict()  # sig: OrderedDict[Hashable, Any]
+
+    def __len__(self):
+        """Get the number of items in this cache.
+
+        :sig: () -> int
+        :return: Number of items.
+        """
+        return len(self._items)
+
+    def fetch(self, key, compute):
+        """Get the value for a key, computing and storing it if it's not in this cache.
+
+        :sig: (Hashable, Callable[[Hashable], Any]) -> Any
+        :param key: Key to get the value for.
+        :param compute: Function to compute the value from the key.
+        :return: Cached or computed value.
+        """
+        # a default value is cheaper than raising KeyError for every miss
+        value = self._items.pop(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            value = compute(key)
+            if self.maxsize == 0:
+                return value
+            if (self.maxsize is not None) and (len(self._items) >= self.maxsize):
+                self._items.popitem(last=False)
+        else:
+            self.hits += 1
+        self._items[key] = value
+        return value
+
+    def resize(self, maxsize):
+        """Change the maximum number of items in this cache.
+
+        :sig: (Optional[int]) -> None
+        :param maxsize: Maximum number of items, ``None`` for no limit, ``0`` to disable.
+        """
+        self.maxsize = maxsize
+        if maxsize is not None:
+            while len(self._items) > maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        """Remove all items from this cache and reset the statistics.
+
+        :sig: () -> None
+        """
+        self._items.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+docstring_cache = LRUCache()  # sig: LRUCache
+signature_cache = LRUCache()  # sig: LRUCache
+type_cache = LRUCache()  # sig: LRUCache
+
+
+def set_cache_size(maxsize):
+    """Change the maximum number of items in the docstring, signature, and type caches.
+
+    :sig: (Optional[int]) -> None
+    :param maxsize: Maximum number of items, ``None`` for no limit, ``0`` to disable.
+    """
+    docstring_cache.resize(maxsize)
+    signature_cache.resize(maxsize)
+    type_cache.resize(maxsize)
+
+
+def clear_caches():
+    """Remove all items from the docstring, signature, and type caches.
+
+    :sig: () -> None
+    """
+    docstring_cache.clear()
+    signature_cache.clear()
+    type_cache.clear()
+
+
+class Profile:
+    """Timing statistics about generating stubs.
+
+    The wall time of every stage is collected separately for every file.
+    The time of processing a docstring, including the docutils time,
+    is also recorded under the qualified name of its function or class.
+    """
+
+    def __init__(self):
+        """Initialize this profile.
+
+        :sig: () -> None
+        """
+        self.files = OrderedDict()  # sig: OrderedDict[str, Dict[str, float]]
+        self.docstrings = []  # sig: List[Tuple[float, str, str]]
+        self._path = "<string>"  # sig: str
+        self._times = None  # sig: Optional[Dict[str, float]]
+        self._nested = 0.0  # sig: float
+
+    def start_file(self, path):
+        """Start collecting the times for a file.
+
+        :sig: (str) -> None
+        :param path: Path of the file.
+        """
+        self._path = path
+        self._times = self.files.setdefault(path, dict.fromkeys(PROFILE_STAGES, 0.0))
+
+    def add_time(self, stage, seconds):
+        """Add time to a stage of the current file.
+
+        :sig: (str, float) -> None
+        :param stage: Name of the stage.
+        :param seconds: Time to add.
+        """
+        if self._times is None:
+            self.start_file(self._path)
+        self._times[stage] += seconds
+        if stage in {"parsing", "docutils"}:
+            self._nested += seconds
+
+    def add_processing_time(self, seconds):
+        """Add the time of processing a source, excluding code generation.
+
+        Parsing and docutils times are included in the processing time;
+        the rest of it is counted as visiting time.
+
+        :sig: (float) -> None
+        :param seconds: Time to add.
+        """
+        self.add_time("visiting", seconds - self._nested)
+        self._nested = 0.0
+
+    def add_docstring(self, qualname, seconds):
+        """Add the time of processing a docstring.
+
+        :sig: (str, float) -> None
+        :param qualname: Qualified name of the function or class of the docstring.
+        :param seconds: Time of processing the docstring.
+        """
+        self.docstrings.append((seconds, self._path, qualname))
+
+    def iter_timed(self, stage, items):
+        """Pass through the items of an iterator, adding the time of producing them to a stage.
+
+        :sig: (str, Iterator[str]) -> Iterator[str]
+        :param stage: Name of the stage.
+        :param items: Items to pass through.
+        :return: Same items.
+        """
+        while True:
+            start = _timer()
+            item = next(items, None)
+            self.add_time(stage, _timer() - start)
+            if item is None:
+                return
+            yield item
+
+    def get_slowest_docstrings(self, limit=PROFILE_LIMIT):
+        """Get the docstrings that took the longest time to process.
+
+        :sig: (int) -> List[Tuple[float, str, str]]
+        :param limit: Number of docstrings to get.
+        :return: Time, file path, and qualified name of every docstring, slowest first.
+        """
+        return sorted(self.docstrings, key=lambda d: d[0], reverse=True)[:limit]
+
+    def report(self, limit=PROFILE_LIMIT):
+        """Generate a report of the collected statistics.
+
+        :sig: (int) -> str
+        :param limit: Number of slowest docstrings to include.
+        :return: Report text.
+        """
+        totals = dict.fromkeys(PROFILE_STAGES, 0.0)
+        path_width = max([len(p) for p in self.files] + [len("file")])
+        line_format = "%-" + str(path_width) + "s" + " %11s" * len(PROFILE_STAGES)
+
+        lines = [line_format % (("file",) + PROFILE_STAGES)]
+        files = sorted(self.files.items(), key=lambda f: sum(f[1].values()), reverse=True)
+        for path, times in files:
+            row = ["%.2fms" % (times[stage] * 1000) for stage in PROFILE_STAGES]
+            lines.append(line_format % tuple([path] + row))
+            for stage in PROFILE_STAGES:
+                totals[stage] += times[stage]
+        row = ["%.2fms" % (totals[stage] * 1000) for stage in PROFILE_STAGES]
+        lines.append(line_format % tuple(["total"] + row))
+
+        docstrings = self.get_slowest_docstrings(limit)
+        if len(docstrings) > 0:
+            lines.append("")
+            lines.append("slowest docstrings:")
+            for seconds, path, qualname in docstrings:
+                lines.append("%10.2fms  %s:%s" % (seconds * 1000, path, qualname))
+        return "\n".join(lines)
+
+
+_profile = None  # sig: Optional[Profile]
+
+
+def start_profile():
+    """Start collecting timing statistics.
+
+    :sig: () -> Profile
+    :return: Profile to collect the statistics in.
+    """
+    global _profile
+    _profile = Profile()
+    return _profile
+
+
+def stop_profile():
+    """Stop collecting timing statistics.
+
+    :sig: () -> Optional[Profile]
+    :return: Profile that contains the collected statistics.
+    """
+    global _profile
+    profile, _profile = _profile, None
+    return profile
+
+
+class DocstringParser:
+    """A reusable docutils setup for parsing docstrings.
+
+    Building the option parser, the settings, and the components of docutils
+    takes much longer than parsing a typical docstring, so this is done once
+    and the same objects are used for every docstring.
+    """
+
+    def __init__(self):
+        """Initialize this docstring parser.
+
+        :sig: () -> None
+        """
+        # docutils takes long to import, so it's imported only when needed
+        from docutils.frontend import OptionParser
+        from docutils.parsers.rst import Parser
+        from docutils.readers.standalone import Reader
+        from docutils.utils import new_document
+        from docutils.writers.null import Writer
+
+        self._new_document = new_document
+        self.reader = Reader()  # sig: docutils.readers.standalone.Reader
+        self.parser = Parser()  # sig: docutils.parsers.rst.Parser
+        self.writer = Writer()  # sig: docutils.writers.null.Writer
+
+        option_parser = OptionParser(
+            components=(self.parser, self.reader, self.writer),
+            defaults={"report_level": 5, "traceback": True},
+            read_config_files=True,
+        )
+        self.settings = option_parser.get_default_values()  # sig: optparse.Values
+
+    def parse(self, text):
+        """Parse a text into a document tree.
+
+        The result is the same as that of ``docutils.core.publish_doctree``.
+
+        :sig: (str) -> Document
+        :param text: Text to parse.
+        :return: Root node of the document tree.
+        """
+        document = self._new_document("<string>", self.settings)
+        self.parser.parse(text, document)
+        document.current_source = document.current_line = None
+        document.transformer.populate_from_components((self.reader, self.parser, self.writer))
+        document.transformer.apply_transforms()
+        return document
+
+
+_docstring_parser = None  # sig: Optional[DocstringParser]
+
+
+def get_docstring_parser():
+    """Get the docstring parser that is shared in this process.
+
+    :sig: () -> DocstringParser
+    :return: Shared docstring parser.
+    """
+    global _docstring_parser
+    if _docstring_parser is None:
+        _docstring_parser = DocstringParser()
+    return _docstring_parser
+
 
 def get_fields(node, fields_tag="field_list"):
     """Get the field names and their values from a node.
@@ -95,15 +544,129 @@ def get_fields(node, fields_tag="field_list"):
     return {f["field_name"]: f["field_body"] for f in fields}
 
 
+def scan_fields(docstring):
+    """Get the top level field names and their values from a docstring.
+
+    This is a lightweight alternative to parsing the docstring with docutils
+    and calling :func:`get_fields` on the result. It only handles docstrings
+    where the top level field list can be located without a full parse.
+    For any other docstring it gives up and returns ``None``.
+
+    :sig: (str) -> Optional[Dict[str, str]]
+    :param docstring: Docstring to get the fields from.
+    :return: Names and values of fields, or ``None`` if the docstring can't be classified.
+    """
+    # prepare the lines the same way as the docutils state machine
+    lines = [
+        s.expandtabs(8).rstrip()
+        for s in _RE_SPECIAL_WHITESPACE.sub(" ", docstring).splitlines()
+    ]
+    n_lines = len(lines)
+
+    fields = {}
+    n_field_lists = 0
+    in_field_list = False
+    started = False
+    prev_blank = True
+
+    line_no = 0
+    while line_no < n_lines:
+        line = lines[line_no]
+        if not line:
+            prev_blank = True
+            line_no += 1
+            continue
+
+        if line.endswith("::"):
+            # literal blocks can be quoted using unindented punctuation
+            return None
+
+        if line[0] == " ":
+            # indented block that is not part of a field body
+            in_field_list = False
+            started = True
+            prev_blank = False
+            line_no += 1
+            continue
+
+        if line[0] == ":":
+            match = _RE_FIELD_MARKER.match(line)
+            if (match is None) or ("\\" in match.group()):
+                return None
+            if not in_field_list:
+                if (not started) or (not prev_blank):
+                    # could be bibliographic fields or part of a paragraph
+                    return None
+                n_field_lists += 1
+                in_field_list = True
+
+            body_start = line_no + 1
+            body_end = body_start
+            while (body_end < n_lines) and (
+                (not lines[body_end]) or (lines[body_end][0] == " ")
+            ):
+                body_end += 1
+            body = lines[body_start:body_end]
+            indents = [len(s) - len(s.lstrip()) for s in body if s]
+            if len(indents) > 0:
+                indent = min(indents)
+                body = [s[indent:] for s in body]
+
+            name = match.group()[1:]
+            name = name[: name.rfind(":")]
+            marker_end = match.end()
+            fields[name.strip()] = "\n".join([line[marker_end:]] + body).strip()
+
+            prev_blank = not lines[body_end - 1]
+            line_no = body_end
+            continue
+
+        if line.startswith(("..", "__")) or _RE_PUNCTUATION_LINE.match(line):
+            # explicit markup, section titles, tables, transitions, etc.
+            return None
+
+        in_field_list = False
+        started = True
+        prev_blank = False
+        line_no += 1
+
+    if n_field_lists > 1:
+        # let docutils decide what to do with multiple field lists
+        return None
+    return fields
+
+
 def extract_signature(docstring):
     """Extract the signature from a docstring.
 
+    The docstring is parsed using docutils only if :func:`scan_fields`
+    can't find the fields by itself.
+
+    Results are cached in :data:`docstring_cache`.
+
+    :sig: (str) -> Optional[str]
+    :param docstring: Docstring to extract the signature from.
+    :return: Extracted signature, or ``None`` if there's no signature.
+    """
+    if (":" + SIG_FIELD + ":") not in docstring:
+        return None
+    return docstring_cache.fetch(docstring, _extract_signature)
+
+
+def _extract_signature(docstring):
+    """Extract the signature from a docstring, without using the cache.
+
     :sig: (str) -> Optional[str]
     :param docstring: Docstring to extract the signature from.
     :return: Extracted signature, or ``None`` if there's no signature.
     """
-    root = publish_doctree(docstring, settings_overrides={"report_level": 5})
-    fields = get_fields(root)
+    fields = scan_fields(docstring)
+    if fields is None:
+        start = _timer()
+        root = get_docstring_parser().parse(docstring)
+        fields = get_fields(root)
+        if _profile is not None:
+            _profile.add_time("docutils", _timer() - start)
     return fields.get(SIG_FIELD)
 
 
@@ -120,6 +683,419 @@ def get_signature(node):
     return extract_signature(docstring)
 
 
+class TypeExpression(tuple):
+    """An immutable node in the tree of a parsed type expression.
+
+    A named type like ``Dict[str, int]`` has the name ``Dict`` and
+    the arguments ``str`` and ``int``. A list of types, like the parameter
+    types of a ``Callable``, has no name and its items are its arguments.
+    A union with the ``|`` operator has no name and its operands are
+    its arguments. A forward reference like ``"Node"`` has no name and
+    the referenced type is its only argument. Ellipses, literals,
+    and the empty tuple have no name and no arguments.
+
+    The names that are required by the expression and the namespaces
+    of its qualified names are collected when the node is created.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, text, name=None, args=()):
+        """Create a type expression.
+
+        :sig: (str, Optional[str], Sequence[TypeExpression]) -> TypeExpression
+        :param text: Source text of the expression.
+        :param name: Name of the type, ``None`` if it's not a named type.
+        :param args: Arguments of the type, or items of the list.
+        :return: Created type expression.
+        """
+        args = tuple(args)
+        if name is None:
+            requires = namespaces = _NO_NAMES
+        else:
+            requires = frozenset([name])
+            namespaces = frozenset([name.rpartition(".")[0]]) if "." in name else _NO_NAMES
+        if len(args) > 0:
+            requires = requires.union(*[a[3] for a in args])
+            namespaces = namespaces.union(*[a[4] for a in args])
+        return tuple.__new__(cls, (_intern(text), name, args, requires, namespaces))
+
+    @property
+    def text(self):
+        """Source text of this expression.
+
+        :sig: () -> str
+        """
+        return self[0]
+
+    @property
+    def name(self):
+        """Name of this type, ``None`` if it's not a named type.
+
+        :sig: () -> Optional[str]
+        """
+        return self[1]
+
+    @property
+    def args(self):
+        """Arguments of this type, or items of this list.
+
+        :sig: () -> Tuple[TypeExpression, ...]
+        """
+        return self[2]
+
+    @property
+    def requires(self):
+        """Names that are required by this expression.
+
+        :sig: () -> FrozenSet[str]
+        """
+        return self[3]
+
+    @property
+    def namespaces(self):
+        """Namespaces of the qualified names in this expression.
+
+        :sig: () -> FrozenSet[str]
+        """
+        return self[4]
+
+    def __repr__(self):
+        """Get the representation of this type expression.
+
+        :sig: () -> str
+        :return: Representation showing the source text.
+        """
+        return "TypeExpression(%r)" % self.text
+
+
+_NO_NAMES = frozenset()  # sig: FrozenSet[str]
+
+
+def tokenize_type(text):
+    """Split a type expression or a signature into tokens.
+
+    The kind of a token is ``"name"`` for a possibly qualified name,
+    ``"literal"`` for an ellipsis, a string or a bytes value, or a number,
+    and the token itself for the operators.
+
+    :sig: (str) -> List[TypeToken]
+    :param text: Text to tokenize.
+    :return: Kind, value, start and end offsets of every token.
+    :raise ValueError: When the text contains invalid characters.
+    """
+    tokens = []
+    pos = 0
+    for space, value in _RE_TYPE_TOKEN.findall(text):
+        start = pos + len(space)
+        pos = start + len(value)
+        if value in _TYPE_OPERATORS:
+            kind = value
+        elif value[-1] in "'\"":
+            kind = "literal"
+        elif (value[0] == "_") or value[0].isalpha():
+            kind = "name"
+        else:
+            kind = "literal"
+        tokens.append((kind, value, start, pos))
+    # skipped characters would leave a gap between the tokens
+    if pos != len(text.rstrip()):
+        raise ValueError("Invalid type expression: " + text)
+    return tokens
+
+
+def get_values_start(name):
+    """Get the position of the first argument of a type that is a value instead of a type.
+
+    All arguments of ``Literal`` are values, and the arguments of ``Annotated``
+    after the first one are metadata values.
+
+    :sig: (str) -> Optional[int]
+    :param name: Name of the subscripted type.
+    :return: Position of the first value, ``None`` if all arguments are types.
+    """
+    base = name.rpartition(".")[2]
+    if base == _LITERAL_TYPE:
+        return 0
+    if base == _ANNOTATED_TYPE:
+        return 1
+    return None
+
+
+def _parse_type_tokens(text, tokens, i, literal=False):
+    """Parse the type expression that starts at a token.
+
+    Operands of the ``|`` operator are collected into a union.
+
+    :sig: (str, List[TypeToken], int, bool) -> Tuple[TypeExpression, int]
+    :param text: Tokenized text.
+    :param tokens: Tokens of the text.
+    :param i: Index of the first token of the expression.
+    :param literal: Whether strings are values instead of forward references.
+    :return: Parsed expression, and the index of the token after it.
+    :raise ValueError: When the tokens don't form a valid type expression.
+    """
+    first = i
+    operand, i = _parse_type_operand(text, tokens, i, literal)
+    if (i == len(tokens)) or (tokens[i][0] != "|"):
+        return operand, i
+    operands = [operand]
+    while (i < len(tokens)) and (tokens[i][0] == "|"):
+        operand, i = _parse_type_operand(text, tokens, i + 1, literal)
+        operands.append(operand)
+    start, end = tokens[first][2], tokens[i - 1][3]
+    return TypeExpression(text[start:end], args=operands), i
+
+
+def _parse_type_operand(text, tokens, i, literal=False):
+    """Parse the type expression that starts at a token, up to a ``|`` operator.
+
+    :sig: (str, List[TypeToken], int, bool) -> Tuple[TypeExpression, int]
+    :param text: Tokenized text.
+    :param tokens: Tokens of the text.
+    :param i: Index of the first token of the expression.
+    :param literal: Whether strings are values instead of forward references.
+    :return: Parsed expression, and the index of the token after it.
+    :raise ValueError: When the tokens don't form a valid type expression.
+    """
+    if i == len(tokens):
+        raise ValueError("Invalid type expression: " + text)
+    kind, value, start, _ = tokens[i]
+    if kind == "literal":
+        if value[-1] in "'\"":
+            return _parse_string_tokens(text, tokens, i, literal)
+        return TypeExpression(value), i + 1
+    if kind == "name":
+        if (i + 1 == len(tokens)) or (tokens[i + 1][0] != "["):
+            return TypeExpression(value, name=value), i + 1
+        args, i = _parse_type_list(text, tokens, i + 2, "]", get_values_start(value))
+        if len(args) == 0:
+            raise ValueError("Invalid type expression: " + text)
+        end = tokens[i - 1][3]
+        return TypeExpression(text[start:end], name=value, args=args), i
+    if kind == "[":
+        args, i = _parse_type_list(text, tokens, i + 1, "]")
+        end = tokens[i - 1][3]
+        return TypeExpression(text[start:end], args=args), i
+    if (kind == "(") and (i + 1 < len(tokens)) and (tokens[i + 1][0] == ")"):
+        # the empty tuple, as in Tuple[()]
+        end = tokens[i + 1][3]
+        return TypeExpression(text[start:end]), i + 2
+    raise ValueError("Invalid type expression: " + text)
+
+
+def _parse_string_tokens(text, tokens, i, literal):
+    """Parse adjacent string tokens as a value or as a forward reference.
+
+    Adjacent strings are concatenated, as in Python code. A forward reference
+    is parsed as a type expression.
+
+    :sig: (str, List[TypeToken], int, bool) -> Tuple[TypeExpression, int]
+    :param text: Tokenized text.
+    :param tokens: Tokens of the text.
+    :param i: Index of the first string token.
+    :param literal: Whether the strings are a value instead of a forward reference.
+    :return: Parsed expression, and the index of the token after the strings.
+    :raise ValueError: When the strings don't form a valid value or forward reference.
+    """
+    start = tokens[i][2]
+    is_bytes = set()
+    while (i < len(tokens)) and (tokens[i][1][-1] in "'\""):
+        value = tokens[i][1]
+        is_bytes.add("b" in value[: value.index(value[-1])].lower())
+        i += 1
+    end = tokens[i - 1][3]
+    value = text[start:end]
+    # strings and bytes can't be concatenated, and bytes can't be references
+    if (len(is_bytes) > 1) or ((not literal) and (True in is_bytes)):
+        raise ValueError("Invalid type expression: " + text)
+    if literal:
+        return TypeExpression(value), i
+    try:
+        reference = ast.literal_eval("(%s)" % value)
+    except SyntaxError:
+        raise ValueError("Invalid type expression: " + text)
+    return TypeExpression(value, args=[parse_type(reference)]), i
+
+
+def _parse_type_list(text, tokens, i, closing, values_start=None):
+    """Parse a comma separated list of type expressions up to a closing token.
+
+    :sig: (str, List[TypeToken], int, str, Optional[int]) -> Tuple[List[TypeExpression], int]
+    :param text: Tokenized text.
+    :param tokens: Tokens of the text.
+    :param i: Index of the first token after the opening token.
+    :param closing: Kind of the token that ends the list.
+    :param values_start: Position of the first item that is a value instead of a type.
+    :return: Parsed expressions, and the index of the token after the closing token.
+    :raise ValueError: When the tokens don't form a valid list.
+    """
+    items = []
+    while (i < len(tokens)) and (tokens[i][0] != closing):
+        literal = (values_start is not None) and (len(items) >= values_start)
+        item, i = _parse_type_tokens(text, tokens, i, literal)
+        items.append(item)
+        if (i < len(tokens)) and (tokens[i][0] == ","):
+            i += 1
+        elif (i == len(tokens)) or (tokens[i][0] != closing):
+            raise ValueError("Invalid type expression: " + text)
+    if i == len(tokens):
+        raise ValueError("Invalid type expression: " + text)
+    return items, i + 1
+
+
+def parse_type(expression):
+    """Parse a type expression into a tree.
+
+    Results are cached in :data:`type_cache`, so the same expression
+    is parsed only once, even when it's used in different signatures.
+
+    :sig: (str) -> TypeExpression
+    :param expression: Type expression to parse.
+    :return: Parsed type expression.
+    :raise ValueError: When the expression is not valid.
+    """
+    return type_cache.fetch(expression.strip(), _parse_type)
+
+
+def _parse_type(expression):
+    """Parse a type expression into a tree, without using the cache.
+
+    :sig: (str) -> TypeExpression
+    :param expression: Type expression to parse.
+    :return: Parsed type expression.
+    :raise ValueError: When the expression is not valid.
+    """
+    parsed = _parse_plain_type(expression)
+    if parsed is not None:
+        return parsed
+    try:
+        parsed = _parse_type_text(expression)
+    except ValueError:
+        parsed = _parse_opaque_type(expression)
+        if parsed is None:
+            raise
+    return parsed
+
+
+def _parse_plain_type(expression):
+    """Parse a type expression that consists of names, lists, and subscripts only.
+
+    Most types in signatures are like this, and they can be parsed
+    by splitting the text instead of tokenizing it.
+
+    :sig: (str) -> Optional[TypeExpression]
+    :param expression: Type expression to parse, without surrounding whitespace.
+    :return: Parsed type expression, ``None`` if it's not a valid plain expression.
+    """
+    if _RE_TYPE_NAME.match(expression):
+        return TypeExpression(expression, name=expression)
+    match = _RE_PLAIN_TYPE.match(expression)
+    if match is None:
+        return None
+    name, arguments = match.groups()
+    if (name is None) and (arguments.strip() == ""):
+        return TypeExpression(expression)
+
+    # only consider the top level commas, ignore the ones in []
+    args = []
+    pending = []
+    depth = 0
+    for part in arguments.split(","):
+        pending.append(part)
+        depth += part.count("[") - part.count("]")
+        if depth < 0:
+            return None
+        if depth == 0:
+            arg = ",".join(pending).strip()
+            if arg == "":
+                return None
+            args.append(parse_type(arg))
+            pending = []
+    if depth != 0:
+        return None
+    return TypeExpression(expression, name=name, args=args)
+
+
+def _parse_type_text(expression, literal=False):
+    """Parse a type expression into a tree by tokenizing it.
+
+    :sig: (str, bool) -> TypeExpression
+    :param expression: Type expression to parse, without surrounding whitespace.
+    :param literal: Whether strings are values instead of forward references.
+    :return: Parsed type expression.
+    :raise ValueError: When the expression is not valid.
+    """
+    tokens = tokenize_type(expression)
+    parsed, i = _parse_type_tokens(expression, tokens, 0, literal)
+    if i != len(tokens):
+        raise ValueError("Invalid type expression: " + expression)
+    return parsed
+
+
+def _parse_opaque_type(expression):
+    """Parse a subscripted type with arguments that are not types.
+
+    This is for values like the metadata in ``Annotated[int, Field(gt=0)]``.
+    Arguments that can't be parsed are kept as they are if they contain
+    characters that can't occur in type syntax. They require the names
+    in them, except for the keyword argument names.
+
+    :sig: (str) -> Optional[TypeExpression]
+    :param expression: Type expression to parse.
+    :return: Parsed type expression, ``None`` if the expression is not valid.
+    """
+    match = _RE_SUBSCRIPTED_TYPE.match(expression)
+    if match is None:
+        return None
+    name, arguments = match.groups()
+
+    # only consider the top level commas, ignore the ones in brackets and strings
+    items = []
+    start = 0
+    depth = 0
+    quote = None
+    escaped = False
+    for i, char in enumerate(arguments):
+        if quote is not None:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char in "[(":
+            depth += 1
+        elif char in "])":
+            depth -= 1
+            if depth < 0:
+                return None
+        elif (char == ",") and (depth == 0):
+            items.append(arguments[start:i])
+            start = i + 1
+    if (depth != 0) or (quote is not None):
+        return None
+    items.append(arguments[start:])
+
+    values_start = get_values_start(name)
+    args = []
+    for item in items:
+        try:
+            if (values_start is not None) and (len(args) >= values_start):
+                args.append(_parse_type_text(item.strip(), literal=True))
+            else:
+                args.append(parse_type(item))
+        except ValueError:
+            code = _RE_STRING.sub("", item)
+            if _RE_NON_TYPE_CHAR.search(code) is None:
+                return None
+            names = [TypeExpression(n, name=n) for n in _RE_OPAQUE_NAME.findall(code)]
+            args.append(TypeExpression(item.strip(), args=names))
+    return TypeExpression(expression, name=name, args=args)
+
+
 def split_parameter_types(parameters):
     """Split a parameter types declaration into individual types.
 
@@ -133,24 +1109,34 @@ def split_parameter_types(parameters):
     if parameters == "":
         return []
 
-    # only consider the top level commas, ignore the ones in []
-    commas = []
-    bracket_depth = 0
-    for i, char in enumerate(parameters):
-        if (char == ",") and (bracket_depth == 0):
-            commas.append(i)
-        elif char == "[":
-            bracket_depth += 1
-        elif char == "]":
-            bracket_depth -= 1
+    if ("'" in parameters) or ('"' in parameters):
+        # literals can contain commas and brackets, so follow the tokens
+        types = []
+        start = 0
+        depth = 0
+        for kind, _, token_start, token_end in tokenize_type(parameters):
+            if kind == "[":
+                depth += 1
+            elif kind == "]":
+                depth -= 1
+            elif (kind == ",") and (depth == 0):
+                types.append(parameters[start:token_start].strip())
+                start = token_end
+        types.append(parameters[start:].strip())
+        return types
 
+    # only consider the top level commas, ignore the ones in []
     types = []
-    last_i = 0
-    for i in commas:
-        types.append(parameters[last_i:i].strip())
-        last_i = i + 1
-    else:
-        types.append(parameters[last_i:].strip())
+    pending = []
+    depth = 0
+    for part in parameters.split(","):
+        pending.append(part)
+        depth += part.count("[") - part.count("]")
+        if depth == 0:
+            types.append(",".join(pending).strip())
+            pending = []
+    if len(pending) > 0:
+        types.append(",".join(pending).strip())
     return types
 
 
@@ -158,33 +1144,64 @@ def parse_signature(signature):
     """Parse a signature into its input and return parameter types.
 
     This will also collect the types that are required by any of the input
-    and return types.
+    and return types, and the namespaces of the qualified ones. Results are
+    cached in :data:`signature_cache`, so they are immutable.
 
-    :sig: (str) -> Tuple[List[str], str, Set[str]]
+    :sig: (str) -> Tuple[Optional[Tuple[str, ...]], str, FrozenSet[str], FrozenSet[str]]
     :param signature: Signature to parse.
-    :return: Input parameter types, return type, and all required types.
+    :return: Input parameter types, return type, all required types, and their namespaces.
+    :raise ValueError: When the signature is not valid.
     """
-    if " -> " not in signature:
-        # signature comment: no parameters, treat variable type as return type
-        param_types, return_type = None, signature.strip()
-    else:
-        lhs, return_type = [s.strip() for s in signature.split(" -> ")]
-        csv = lhs[1:-1].strip()  # remove the parentheses around the parameter type list
-        param_types = split_parameter_types(csv)
-    requires = set(_RE_QUALIFIED_TYPES.findall(signature))
-    return param_types, return_type, requires
+    return signature_cache.fetch(signature, _parse_signature)
+
+
+def _parse_signature(signature):
+    """Parse a signature into its input and return parameter types, without using the cache.
 
+    :sig: (str) -> Tuple[Optional[Tuple[str, ...]], str, FrozenSet[str], FrozenSet[str]]
+    :param signature: Signature to parse.
+    :return: Input parameter types, return type, all required types, and their namespaces.
+    :raise ValueError: When the signature is not valid.
+    """
+    if "->" not in signature:
+        # signature comment: no parameters, treat variable type as return type
+        return_type = parse_type(signature)
+        return None, return_type.text, return_type.requires, return_type.namespaces
+
+    lhs, _, rhs = signature.partition("->")
+    lhs = lhs.strip()
+    if (not lhs.startswith("(")) or (not lhs.endswith(")")):
+        raise ValueError("Invalid signature: " + signature)
+    csv = lhs[1:-1].strip()  # remove the parentheses around the parameter type list
+    param_types = []
+    return_type = parse_type(rhs)
+    requires = return_type.requires
+    namespaces = return_type.namespaces
+    for param in split_parameter_types(csv):
+        param_type = parse_type(param)
+        param_types.append(param_type.text)
+        requires = requires | param_type.requires
+        namespaces = namespaces | param_type.namespaces
+    return tuple(param_types), return_type.text, requires, namespaces
+
+
+class StubNode(object):
+    """A node in a stub tree.
+
+    Since there can be many nodes in a tree, their attributes are stored
+    in slots. The variable and child containers are created when the first
+    item is added; until then, they are the shared empty tuple.
+    """
 
-class StubNode:
-    """A node in a stub tree."""
+    __slots__ = ("variables", "children", "parent")
 
     def __init__(self):
         """Initialize this stub node.
 
         :sig: () -> None
         """
-        self.variables = []  # sig: List[VariableNode]
-        self.children = []  # sig: List[Union[FunctionNode, ClassNode]]
+        self.variables = ()  # sig: Sequence[VariableNode]
+        self.children = ()  # sig: Sequence[Union[FunctionNode, ClassNode]]
         self.parent = None  # sig: Optional[StubNode]
 
     def add_variable(self, node):
@@ -193,6 +1210,8 @@ class StubNode:
         :sig: (VariableNode) -> None
         :param node: Variable node to add.
         """
+        if len(self.variables) == 0:
+            self.variables = []
         self.variables.append(node)
         node.parent = self
 
@@ -202,35 +1221,50 @@ class StubNode:
         :sig: (Union[FunctionNode, ClassNode]) -> None
         :param node: Function or class node to add.
         """
+        if len(self.children) == 0:
+            self.children = []
         self.children.append(node)
         node.parent = self
 
     def get_code(self):
         """Get the stub code for this node.
 
+        :sig: () -> List[str]
+        :return: Lines of stub code for this node.
+        """
+        return list(self.iter_code())
+
+    def iter_code(self, indent=""):
+        """Generate the stub code for this node.
+
         The stub code for a node consists of the type annotations of its variables,
         followed by the prototypes of its functions/methods and classes.
+        The lines are produced while traversing the nodes, with the indentation
+        prepended, so no intermediate lists are built for the children.
 
-        :sig: () -> List[str]
+        :sig: (str) -> Iterator[str]
+        :param indent: Indentation to prepend to the lines.
         :return: Lines of stub code for this node.
         """
-        stub = []
         for child in self.variables:
-            stub.extend(child.get_code())
+            for line in child.iter_code(indent):
+                yield line
         if (
             (len(self.variables) > 0)
             and (len(self.children) > 0)
             and (not isinstance(self, ClassNode))
         ):
-            stub.append("")
+            yield ""
         for child in self.children:
-            stub.extend(child.get_code())
-        return stub
+            for line in child.iter_code(indent):
+                yield line
 
 
 class VariableNode(StubNode):
     """A node representing an assignment in a stub tree."""
 
+    __slots__ = ("name", "type_")
+
     def __init__(self, name, type_):
         """Initialize this variable node.
 
@@ -242,21 +1276,24 @@ class VariableNode(StubNode):
             StubNode.__init__(self)
         else:
             super().__init__()
-        self.name = name  # sig: str
-        self.type_ = type_  # sig: str
+        self.name = _intern(name)  # sig: str
+        self.type_ = _intern(type_)  # sig: str
 
-    def get_code(self):
-        """Get the type annotation for this variable.
+    def iter_code(self, indent=""):
+        """Generate the type annotation for this variable.
 
-        :sig: () -> List[str]
+        :sig: (str) -> Iterator[str]
+        :param indent: Indentation to prepend to the lines.
         :return: Lines of stub code for this variable.
         """
-        return ["%(n)s = ...  # type: %(t)s" % {"n": self.name, "t": self.type_}]
+        yield "%(i)s%(n)s = ...  # type: %(t)s" % {"i": indent, "n": self.name, "t": self.type_}
 
 
 class FunctionNode(StubNode):
     """A node representing a function in a stub tree."""
 
+    __slots__ = ("name", "parameters", "rtype", "decorators", "_async")
+
     def __init__(self, name, parameters, rtype, decorators=None):
         """Initialize this function node.
 
@@ -273,24 +1310,24 @@ class FunctionNode(StubNode):
             StubNode.__init__(self)
         else:
             super().__init__()
-        self.name = name  # sig: str
-        self.parameters = parameters  # sig: Sequence[Tuple[str, str, bool]]
-        self.rtype = rtype  # sig: str
-        self.decorators = decorators if decorators is not None else []  # sig: Sequence[str]
+        self.name = _intern(name)  # sig: str
+        params = tuple((_intern(n), _intern(t), d) for n, t, d in parameters)
+        self.parameters = params  # sig: Sequence[Tuple[str, str, bool]]
+        self.rtype = _intern(rtype)  # sig: str
+        self.decorators = tuple(_intern(d) for d in (decorators or ()))  # sig: Sequence[str]
 
         self._async = False  # sig: bool
 
-    def get_code(self):
-        """Get the stub code for this function.
+    def iter_code(self, indent=""):
+        """Generate the stub code for this function.
 
-        :sig: () -> List[str]
+        :sig: (str) -> Iterator[str]
+        :param indent: Indentation to prepend to the lines.
         :return: Lines of stub code for this function.
         """
-        stub = []
-
         for deco in self.decorators:
             if (deco in DECORATORS) or deco.endswith(".setter"):
-                stub.append("@" + deco)
+                yield indent + "@" + deco
 
         parameters = []
         for name, type_, has_default in self.parameters:
@@ -308,25 +1345,26 @@ class FunctionNode(StubNode):
             "r": self.rtype,
         }
 
+        # the line length limit doesn't take the indentation into account
         prototype = "%(a)sdef %(n)s(%(p)s) -> %(r)s: ..." % slots
         if len(prototype) <= LINE_LENGTH_LIMIT:
-            stub.append(prototype)
+            yield indent + prototype
         elif len(INDENT + slots["p"]) <= LINE_LENGTH_LIMIT:
-            stub.append("%(a)sdef %(n)s(" % slots)
-            stub.append(INDENT + slots["p"])
-            stub.append(") -> %(r)s: ..." % slots)
+            yield indent + "%(a)sdef %(n)s(" % slots
+            yield indent + INDENT + slots["p"]
+            yield indent + ") -> %(r)s: ..." % slots
         else:
-            stub.append("%(a)sdef %(n)s(" % slots)
+            yield indent + "%(a)sdef %(n)s(" % slots
             for param in parameters:
-                stub.append(INDENT + param + ",")
-            stub.append(") -> %(r)s: ..." % slots)
-
-        return stub
+                yield indent + INDENT + param + ","
+            yield indent + ") -> %(r)s: ..." % slots
 
 
 class ClassNode(StubNode):
     """A node representing a class in a stub tree."""
 
+    __slots__ = ("name", "bases", "signature")
+
     def __init__(self, name, bases, signature=None):
         """Initialize this class node.
 
@@ -339,82 +1377,411 @@ class ClassNode(StubNode):
             StubNode.__init__(self)
         else:
             super().__init__()
-        self.name = name  # sig: str
-        self.bases = bases  # sig: Sequence[str]
+        self.name = _intern(name)  # sig: str
+        self.bases = tuple(_intern(b) for b in bases)  # sig: Sequence[str]
         self.signature = signature  # sig: Optional[str]
 
-    def get_code(self):
-        """Get the stub code for this class.
+    def iter_code(self, indent=""):
+        """Generate the stub code for this class.
 
-        :sig: () -> List[str]
+        :sig: (str) -> Iterator[str]
+        :param indent: Indentation to prepend to the lines.
         :return: Lines of stub code for this class.
         """
-        stub = []
         bases = ("(" + ", ".join(self.bases) + ")") if len(self.bases) > 0 else ""
-        slots = {"n": self.name, "b": bases}
+        slots = {"i": indent, "n": self.name, "b": bases}
         if len(self.children) == 0:
-            stub.append("class %(n)s%(b)s: ..." % slots)
+            yield "%(i)sclass %(n)s%(b)s: ..." % slots
         else:
-            stub.append("class %(n)s%(b)s:" % slots)
-            super_code = super().get_code() if PY3 else StubNode.get_code(self)
-            for line in super_code:
-                stub.append(INDENT + line)
-        return stub
+            yield "%(i)sclass %(n)s%(b)s:" % slots
+            for line in StubNode.iter_code(self, indent + INDENT):
+                yield line
 
 
-def get_aliases(lines):
-    """Get the type aliases in the source.
+class CommentIndex:
+    """An index of the signature comments in a source code.
 
-    :sig: (Sequence[str]) -> Dict[str, str]
-    :param lines: Lines of the source code.
-    :return: Aliases and their their definitions.
+    The comments are collected from the comment tokens of the source,
+    so text in strings that looks like a comment is not mistaken
+    for a signature. Alias comments have to be on lines of their own.
     """
-    aliases = {}
-    for line in lines:
-        line = line.strip()
-        if len(line) > 0 and line.startswith(SIG_ALIAS):
-            _, content = line.split(SIG_ALIAS)
-            alias, signature = [t.strip() for t in content.split("=")]
-            aliases[alias] = signature
-    return aliases
-
-
-class StubGenerator(ast.NodeVisitor):
-    """A transformer that generates stub declarations from a source code."""
 
     def __init__(self, source):
-        """Initialize this stub generator.
+        """Initialize this index.
 
         :sig: (str) -> None
-        :param source: Source code to generate the stub for.
+        :param source: Source code to collect the comments from.
         """
-        self.root = StubNode()  # sig: StubNode
-
-        self.imported_names = OrderedDict()  # sig: OrderedDict[str, str]
-        self.defined_types = set()  # sig: Set[str]
-        self.required_types = set()  # sig: Set[str]
+        self.signatures = {}  # sig: Dict[int, str]
         self.aliases = OrderedDict()  # sig: OrderedDict[str, str]
 
-        self._parents = [self.root]  # sig: List[StubNode]
-        self._code_lines = source.splitlines()  # sig: List[str]
-
-        self.collect_aliases()
+        last_marker = max(source.rfind(SIG_COMMENT), source.rfind(SIG_ALIAS))
+        if last_marker < 0:
+            return
 
-        ast_tree = ast.parse(source)
-        self.visit(ast_tree)
+        # no need to tokenize the source after the last marker
+        last_line = source.count("\n", 0, last_marker) + 1
+        for token in tokenize.generate_tokens(StringIO(source).readline):
+            if token[2][0] > last_line:
+                break
+            if token[0] == tokenize.COMMENT:
+                self.add_comment(token)
 
-    def collect_aliases(self):
-        """Collect the type aliases in the source.
+    def add_comment(self, token):
+        """Add a comment to this index if it's a signature or an alias comment.
 
-        :sig: () -> None
+        :sig: (Token) -> None
+        :param token: Comment token to add.
         """
-        self.aliases = get_aliases(self._code_lines)
-        for alias, signature in self.aliases.items():
-            _, _, requires = parse_signature(signature)
-            self.required_types |= requires
-            self.defined_types |= {alias}
+        text, (line_no, column), line = token[1], token[2], token[4]
+        if text.startswith(SIG_ALIAS) and (line[:column].strip() == ""):
+            _, content = text.split(SIG_ALIAS)
+            alias, signature = [t.strip() for t in content.split("=")]
+            self.aliases[alias] = signature
+        elif SIG_COMMENT in text:
+            _, signature = text.split(SIG_COMMENT)
+            self.signatures[line_no] = signature.strip()
 
-    def visit_ImportFrom(self, node):
+    def find_signature(self, first_line, last_line):
+        """Find the signature comment of a statement.
+
+        The comment can be on the first or on the last line of the statement.
+
+        :sig: (int, int) -> Optional[str]
+        :param first_line: Number of the first line of the statement.
+        :param last_line: Number of the last line of the statement.
+        :return: Signature in the comment, ``None`` if there is no signature comment.
+        """
+        signature = self.signatures.get(first_line)
+        if signature is None:
+            signature = self.signatures.get(last_line)
+        return signature
+
+
+def get_aliases(lines):
+    """Get the type aliases in the source.
+
+    :sig: (Sequence[str]) -> Dict[str, str]
+    :param lines: Lines of the source code.
+    :return: Aliases and their their definitions.
+    """
+    return CommentIndex("\n".join(lines) + "\n").aliases
+
+
+class StubObserver:
+    """A receiver of events about generating stubs.
+
+    This base class ignores all events. Subclasses can override the methods
+    for the events they're interested in, for example to feed the timings
+    and sizes into a metrics system. Times are in seconds, and sizes
+    are in characters, except for the sizes of source files in bytes.
+    """
+
+    def file_started(self, path, size):
+        """Handle the start of processing a source file.
+
+        :sig: (str, int) -> None
+        :param path: Path of the source file.
+        :param size: Size of the source file.
+        """
+
+    def file_finished(self, path, seconds, size):
+        """Handle the end of processing a source file.
+
+        :sig: (str, float, int) -> None
+        :param path: Path of the source file.
+        :param seconds: Time of processing the file, including writing the stub.
+        :param size: Size of the generated stub, ``0`` if the stub is empty.
+        """
+
+    def docstring_parsed(self, qualname, seconds, size):
+        """Handle the extraction of the signature from a docstring.
+
+        :sig: (str, float, int) -> None
+        :param qualname: Qualified name of the function or class of the docstring.
+        :param seconds: Time of processing the docstring.
+        :param size: Size of the docstring.
+        """
+
+    def cache_hit(self, key, seconds, size):
+        """Handle finding a stub in the stub cache.
+
+        :sig: (str, float, int) -> None
+        :param key: Key of the cache entry.
+        :param seconds: Time of looking up the stub.
+        :param size: Size of the stub.
+        """
+
+    def cache_miss(self, key, seconds, size):
+        """Handle not finding a stub in the stub cache.
+
+        :sig: (str, float, int) -> None
+        :param key: Key of the cache entry.
+        :param seconds: Time of looking up, generating and storing the stub.
+        :param size: Size of the generated stub.
+        """
+
+    def unknown_type(self, name):
+        """Handle a type that is neither defined nor imported in the source.
+
+        :sig: (str) -> None
+        :param name: Name of the type.
+        """
+
+    def stub_written(self, path, seconds, size):
+        """Handle writing a stub file.
+
+        :sig: (str, float, int) -> None
+        :param path: Path of the stub file.
+        :param seconds: Time of writing the file, including producing the stub lines.
+        :param size: Size of the written stub.
+        """
+
+
+class TypeResolver:
+    """An index of the names that a stub can use without defining them.
+
+    The builtin types and the names in the :data:`KNOWN_MODULES`
+    are collected once, so resolving a name is a single lookup.
+    Names from the typing module that are not available in the target
+    Python version are excluded.
+    """
+
+    def __init__(self, target_version=None):
+        """Initialize this type resolver.
+
+        :sig: (Optional[Tuple[int, int]]) -> None
+        :param target_version: Python version of the stubs, the running version if not given.
+        """
+        if target_version is None:
+            target_version = tuple(sys.version_info[:2])
+        self.target_version = target_version  # sig: Tuple[int, int]
+        self.builtins = frozenset(BUILTIN_TYPES)  # sig: FrozenSet[str]
+        self._modules = {}  # sig: Dict[str, str]
+        self._registered = {}  # sig: Dict[str, str]
+        for module_ in KNOWN_MODULES:
+            self.register_module(module_)
+
+        # only keep track of the modules that were registered later
+        self._registered.clear()
+
+    def register_module(self, module_, names=None):
+        """Make the names in a module known to this resolver.
+
+        Names that are already known keep their module, so the earlier
+        registrations take precedence.
+
+        :sig: (str, Optional[Iterable[str]]) -> None
+        :param module_: Name of the module.
+        :param names: Names to register, the public names of the module if not given.
+        """
+        if names is None:
+            names = self.get_module_names(module_)
+        for name in names:
+            if name not in self._modules:
+                self._modules[name] = module_
+                self._registered[name] = module_
+
+    def copy(self):
+        """Get a copy of this resolver.
+
+        Registering names in the copy doesn't change this resolver.
+
+        :sig: () -> TypeResolver
+        :return: Resolver that knows the same names as this resolver.
+        """
+        import copy
+
+        resolver = copy.copy(self)
+        resolver._modules = dict(self._modules)
+        resolver._registered = dict(self._registered)
+        return resolver
+
+    def get_module_names(self, module_):
+        """Get the public names of a module.
+
+        :sig: (str) -> List[str]
+        :param module_: Name of the module.
+        :return: Public names, excluding the ones that are newer than the target version.
+        """
+        import importlib
+
+        try:
+            imported = importlib.import_module(module_)
+        except ImportError:
+            _logger.warning("%s module not installed", module_)
+            return []
+        names = getattr(imported, "__all__", None)
+        if names is None:
+            names = [n for n in dir(imported) if not n.startswith("_")]
+        if module_ == "typing":
+            # the names that are not listed as additions are available for all versions
+            additions = TYPING_ADDITIONS
+            target = self.target_version
+            names = [n for n in names if (n not in additions) or (additions[n] <= target)]
+        return names
+
+    def get_module(self, name):
+        """Get the module that a name should be imported from.
+
+        :sig: (str) -> Optional[str]
+        :param name: Name to resolve.
+        :return: Name of the module, ``None`` if the name is not known.
+        """
+        return self._modules.get(name)
+
+    def get_registered_names(self, source):
+        """Get the registered names that a source code might use.
+
+        The names from the known modules are not included. A stub can only
+        depend on the registration of the names that appear in its source.
+
+        :sig: (str) -> Dict[str, str]
+        :param source: Source code to search for the names.
+        :return: Module of every registered name that occurs in the source.
+        """
+        if len(self._registered) == 0:
+            return {}
+        words = set(_RE_WORD.findall(source))
+        return {n: m for n, m in self._registered.items() if n in words}
+
+    def get_changed_names(self, other):
+        """Get the registered names that resolve differently in another resolver.
+
+        :sig: (TypeResolver) -> Set[str]
+        :param other: Resolver to compare with.
+        :return: Names that are registered in only one of the resolvers,
+            or that are registered for different modules.
+        """
+        names = set(self._registered) | set(other._registered)
+        return {n for n in names if self._registered.get(n) != other._registered.get(n)}
+
+
+_type_resolver = None  # sig: Optional[TypeResolver]
+
+
+def get_type_resolver():
+    """Get the type resolver that is shared in this process.
+
+    :sig: () -> TypeResolver
+    :return: Shared type resolver.
+    """
+    global _type_resolver
+    if _type_resolver is None:
+        _type_resolver = TypeResolver()
+    return _type_resolver
+
+
+class StubGenerator(ast.NodeVisitor):
+    """A transformer that generates stub declarations from a source code."""
+
+    def __init__(self, source, observer=None, resolver=None):
+        """Initialize this stub generator.
+
+        :sig: (str, Optional[StubObserver], Optional[TypeResolver]) -> None
+        :param source: Source code to generate the stub for.
+        :param observer: Receiver of the events about generating the stub.
+        :param resolver: Resolver for the types that are not defined in the source,
+            the shared resolver if not given.
+        """
+        self.root = StubNode()  # sig: StubNode
+        self.observer = observer  # sig: Optional[StubObserver]
+        if resolver is None:
+            resolver = get_type_resolver()
+        self.resolver = resolver  # sig: TypeResolver
+
+        self.imported_names = OrderedDict()  # sig: OrderedDict[str, str]
+        self.defined_types = set()  # sig: Set[str]
+        self.required_types = set()  # sig: Set[str]
+        self.required_namespaces = set()  # sig: Set[str]
+        self.aliases = OrderedDict()  # sig: OrderedDict[str, str]
+
+        self.comments = CommentIndex("")  # sig: CommentIndex
+
+        self._parents = [self.root]  # sig: List[StubNode]
+        self._code_lines = []  # sig: List[str]
+        self._declaration_lines = []  # sig: List[int]
+
+        self.process(source)
+
+    def process(self, source):
+        """Process the source code.
+
+        :sig: (str) -> None
+        :param source: Source code to generate the stub for.
+        """
+        start = _timer()
+        ast_tree = ast.parse(source)
+        if _profile is not None:
+            _profile.add_time("parsing", _timer() - start)
+        self.process_tree(ast_tree, source)
+
+    def process_tree(self, ast_tree, source):
+        """Process the syntax tree of the source code.
+
+        :sig: (ast.Module, str) -> None
+        :param ast_tree: Syntax tree of the source code.
+        :param source: Source code to generate the stub for.
+        """
+        self._code_lines = source.splitlines()
+        self._declaration_lines = []
+        for i, line in enumerate(self._code_lines, start=1):
+            if _RE_DECLARATION_LINE.search(line):
+                self._declaration_lines.append(i)
+
+        self.comments = CommentIndex(source)
+
+        self.collect_aliases()
+        self.visit_body(ast_tree)
+
+    def collect_aliases(self):
+        """Collect the type aliases in the source.
+
+        :sig: () -> None
+        """
+        self.aliases = self.comments.aliases
+        for alias, signature in self.aliases.items():
+            _, _, requires, namespaces = parse_signature(signature)
+            self.required_types |= requires
+            self.required_namespaces |= namespaces
+            self.defined_types |= {alias}
+
+    def visit_body(self, node):
+        """Visit the statements in the body of a node that can affect the stub.
+
+        Only declarations, i.e. functions, classes, "from" imports, and
+        assignments are processed. Statements that don't span any line
+        where a declaration might start are skipped without being visited,
+        and expressions are never visited.
+
+        :sig: (ast.AST) -> None
+        :param node: Node to visit the body of.
+        """
+        if sys.version_info < (3, 8):
+            # statement ranges are not known before Python 3.8
+            self.generic_visit(node)
+            return
+
+        lines = self._declaration_lines
+        for _, value in ast.iter_fields(node):
+            if not isinstance(value, list):
+                continue
+            for child in value:
+                if not isinstance(child, ast.AST):
+                    continue
+                if not hasattr(child, "end_lineno"):
+                    # nodes like match cases have no positions but can have bodies
+                    self.visit_body(child)
+                    continue
+                i = bisect_left(lines, child.lineno)
+                if (i == len(lines)) or (lines[i] > child.end_lineno):
+                    continue
+                if isinstance(child, _DECLARATION_NODES):
+                    self.visit(child)
+                else:
+                    self.visit_body(child)
+
+    def visit_ImportFrom(self, node):
         """Process a "from x import y" node.
 
         :sig: (ast.ImportFrom) -> None
@@ -431,13 +1798,12 @@ class StubGenerator(ast.NodeVisitor):
         :sig: (ast.Assign) -> None
         :param node: Node to process.
         """
-        line = self._code_lines[node.lineno - 1]
-        if SIG_COMMENT in line:
-            line = _RE_COMMENT_IN_STRING.sub("", line)
-        if SIG_COMMENT in line:
-            _, signature = line.split(SIG_COMMENT)
-            _, return_type, requires = parse_signature(signature)
+        last_line = getattr(node, "end_lineno", node.lineno)
+        signature = self.comments.find_signature(node.lineno, last_line)
+        if signature is not None:
+            _, return_type, requires, namespaces = parse_signature(signature)
             self.required_types |= requires
+            self.required_namespaces |= namespaces
 
             parent = self._parents[-1]
             for var in node.targets:
@@ -448,14 +1814,41 @@ class StubGenerator(ast.NodeVisitor):
                     stub_node = VariableNode(var.attr, return_type)
                     parent.parent.add_variable(stub_node)
 
+    def get_node_signature(self, node):
+        """Get the signature of a function or a class node.
+
+        When profiling or observing, the time of processing the docstring
+        is reported under the qualified name of the node.
+
+        :sig: (Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef]) -> Optional[str]
+        :param node: Node to get the signature from.
+        :return: Value of signature field in docstring, or ``None`` if there's no signature.
+        """
+        if (_profile is None) and (self.observer is None):
+            return get_signature(node)
+        start = _timer()
+        docstring = ast.get_docstring(node)
+        if docstring is None:
+            return None
+        signature = extract_signature(docstring)
+        seconds = _timer() - start
+        qualname = ".".join([p.name for p in self._parents[1:]] + [node.name])
+        if _profile is not None:
+            _profile.add_docstring(qualname, seconds)
+        if self.observer is not None:
+            self.observer.docstring_parsed(qualname, seconds, len(docstring))
+        return signature
+
     def get_function_node(self, node):
-        """Process a function node.
+        """Create the stub node for a function node.
+
+        The function body is not processed.
 
-        :sig: (Union[ast.FunctionDef, ast.AsyncFunctionDef]) -> FunctionNode
+        :sig: (Union[ast.FunctionDef, ast.AsyncFunctionDef]) -> Optional[FunctionNode]
         :param node: Node to process.
-        :return: Generated function node in stub tree.
+        :return: Generated function node in stub tree, ``None`` if there's no signature.
         """
-        signature = get_signature(node)
+        signature = self.get_node_signature(node)
 
         if signature is None:
             parent = self._parents[-1]
@@ -464,11 +1857,12 @@ class StubGenerator(ast.NodeVisitor):
 
         if signature is not None:
             _logger.debug("parsing signature for %s", node.name)
-            param_types, rtype, requires = parse_signature(signature)
+            param_types, rtype, requires, namespaces = parse_signature(signature)
             _logger.debug("parameter types: %s", param_types)
             _logger.debug("return type: %s", rtype)
             _logger.debug("required types: %s", requires)
             self.required_types |= requires
+            self.required_namespaces |= namespaces
 
             decorators = []
             for d in node.decorator_list:
@@ -481,6 +1875,9 @@ class StubGenerator(ast.NodeVisitor):
 
             param_names = [arg.arg if PY3 else arg.id for arg in node.args.args]
 
+            # the parsed types are shared through the cache, work on a copy
+            param_types = list(param_types)
+
             # TODO: only in classes
             if (len(param_names) > 0) and (param_names[0] == "self"):
                 param_types.insert(0, "")
@@ -489,7 +1886,7 @@ class StubGenerator(ast.NodeVisitor):
             if (
                 (len(param_names) > 0)
                 and (param_names[0] == "cls")
-                and ("classmethod" in decorators)
+                and (("classmethod" in decorators) or (node.name == "__new__"))
             ):
                 param_types.insert(0, "")
 
@@ -531,11 +1928,8 @@ class StubGenerator(ast.NodeVisitor):
             stub_node = FunctionNode(
                 node.name, parameters=params, rtype=rtype, decorators=decorators
             )
+            stub_node._async = not isinstance(node, ast.FunctionDef)
             self._parents[-1].add_child(stub_node)
-
-            self._parents.append(stub_node)
-            self.generic_visit(node)
-            del self._parents[-1]
             return stub_node
 
     def visit_FunctionDef(self, node):
@@ -544,9 +1938,11 @@ class StubGenerator(ast.NodeVisitor):
         :sig: (ast.FunctionDef) -> None
         :param node: Node to process.
         """
-        node = self.get_function_node(node)
-        if node is not None:
-            node._async = False
+        stub_node = self.get_function_node(node)
+        if stub_node is not None:
+            self._parents.append(stub_node)
+            self.visit_body(node)
+            del self._parents[-1]
 
     def visit_AsyncFunctionDef(self, node):
         """Process an async function node.
@@ -554,15 +1950,16 @@ class StubGenerator(ast.NodeVisitor):
         :sig: (ast.AsyncFunctionDef) -> None
         :param node: Node to process.
         """
-        node = self.get_function_node(node)
-        if node is not None:
-            node._async = True
+        self.visit_FunctionDef(node)
 
-    def visit_ClassDef(self, node):
-        """Process a class node.
+    def get_class_node(self, node):
+        """Create the stub node for a class node.
 
-        :sig: (ast.ClassDef) -> None
+        The class body is not processed.
+
+        :sig: (ast.ClassDef) -> ClassNode
         :param node: Node to process.
+        :return: Generated class node in stub tree.
         """
         self.defined_types.add(node.name)
 
@@ -576,15 +1973,25 @@ class StubGenerator(ast.NodeVisitor):
                 else:
                     base_parts.append(n.attr)
                 n = n.value
-            bases.append(".".join(base_parts[::-1]))
-        self.required_types |= set(bases)
+            base = parse_type(".".join(base_parts[::-1]))
+            self.required_types |= base.requires
+            self.required_namespaces |= base.namespaces
+            bases.append(base.text)
 
-        signature = get_signature(node)
+        signature = self.get_node_signature(node)
         stub_node = ClassNode(node.name, bases=bases, signature=signature)
         self._parents[-1].add_child(stub_node)
+        return stub_node
+
+    def visit_ClassDef(self, node):
+        """Process a class node.
 
+        :sig: (ast.ClassDef) -> None
+        :param node: Node to process.
+        """
+        stub_node = self.get_class_node(node)
         self._parents.append(stub_node)
-        self.generic_visit(node)
+        self.visit_body(node)
         del self._parents[-1]
 
     @staticmethod
@@ -609,7 +2016,19 @@ class StubGenerator(ast.NodeVisitor):
         :sig: () -> str
         :return: Generated stub code.
         """
-        needed_types = self.required_types - BUILTIN_TYPES
+        return "".join(self.iter_stub())
+
+    def iter_stub(self):
+        """Generate the stub code for this source line by line.
+
+        The lines are produced as the stub tree is traversed, so the whole
+        stub is never held in memory. All errors are raised before
+        the first line is produced.
+
+        :sig: () -> Iterator[str]
+        :return: Lines of the stub code, including the line ends.
+        """
+        needed_types = self.required_types - self.resolver.builtins
 
         needed_types -= self.defined_types
         _logger.debug("defined types: %s", self.defined_types)
@@ -617,11 +2036,9 @@ class StubGenerator(ast.NodeVisitor):
         module_vars = {v.name for v in self.root.variables}
         _logger.debug("module variables: %s", module_vars)
 
-        qualified_types = {n for n in needed_types if "." in n}
-        qualified_namespaces = {".".join(n.split(".")[:-1]) for n in qualified_types}
-
-        needed_namespaces = qualified_namespaces - module_vars
-        needed_types -= qualified_types
+        # the namespaces of the qualified types are imported instead of the types
+        needed_types -= {n for n in needed_types if "." in n}
+        needed_namespaces = self.required_namespaces - module_vars
         _logger.debug("needed namespaces: %s", needed_namespaces)
 
         imported_names = set(self.imported_names)
@@ -630,58 +2047,60 @@ class StubGenerator(ast.NodeVisitor):
         needed_namespaces -= imported_names
         _logger.debug("used imported types: %s", imported_types)
 
-        try:
-            typing_mod = __import__("typing")
-            typing_types = {n for n in needed_types if hasattr(typing_mod, n)}
-            needed_types -= typing_types
-            _logger.debug("types from typing module: %s", typing_types)
-        except ImportError:
-            typing_types = set()
-            _logger.warn("typing module not installed")
+        known_types = {}
+        for name in needed_types:
+            module_ = self.resolver.get_module(name)
+            if module_ is not None:
+                known_types.setdefault(module_, set()).add(name)
+        for module_, names in known_types.items():
+            needed_types -= names
+            _logger.debug("types from %s module: %s", module_, names)
 
         if len(needed_types) > 0:
+            if self.observer is not None:
+                for name in sorted(needed_types):
+                    self.observer.unknown_type(name)
             raise ValueError("Unknown types: " + ", ".join(needed_types))
 
-        out = StringIO()
         started = False
 
-        if len(typing_types) > 0:
-            line = self.generate_import("typing", typing_types)
-            out.write(line + "\n")
+        if len(known_types) > 0:
+            for module_ in sorted(known_types):
+                yield self.generate_import(module_, known_types[module_]) + "\n"
             started = True
 
         if len(imported_types) > 0:
             if started:
-                out.write("\n")
+                yield "\n"
             # preserve the import order in the source file
             for name in self.imported_names:
                 if name in imported_types:
-                    line = self.generate_import(self.imported_names[name], {name})
-                    out.write(line + "\n")
+                    yield self.generate_import(self.imported_names[name], {name}) + "\n"
             started = True
 
         if len(needed_namespaces) > 0:
             if started:
-                out.write("\n")
+                yield "\n"
             for module_ in sorted(needed_namespaces):
-                out.write("import " + module_ + "\n")
+                yield "import " + module_ + "\n"
             started = True
 
         if len(self.aliases) > 0:
             if started:
-                out.write("\n")
+                yield "\n"
             for alias, signature in self.aliases.items():
-                out.write("%s = %s\n" % (alias, signature))
+                yield "%s = %s\n" % (alias, signature)
             started = True
 
         if started:
-            out.write("\n")
-        stub_lines = self.root.get_code()
-        n_lines = len(stub_lines)
-        for line_no in range(n_lines):
-            prev_line = stub_lines[line_no - 1] if line_no > 0 else None
-            line = stub_lines[line_no]
-            next_line = stub_lines[line_no + 1] if line_no < (n_lines - 1) else None
+            yield "\n"
+
+        # only one line of lookahead is needed for the spacing
+        stub_lines = self.root.iter_code()
+        prev_line = None
+        line = next(stub_lines, None)
+        while line is not None:
+            next_line = next(stub_lines, None)
             if (
                 line.startswith("class ")
                 and (prev_line is not None)
@@ -690,154 +2109,1893 @@ class StubGenerator(ast.NodeVisitor):
                     or (next_line and next_line.startswith(" "))
                 )
             ):
-                out.write("\n")
+                yield "\n"
             if (
                 line.startswith("def ")
                 and (prev_line is not None)
                 and (prev_line.startswith((" ", "class ")))
             ):
-                out.write("\n")
-            out.write(line + "\n")
-            line_no += 1
-        return out.getvalue()
+                yield "\n"
+            yield line + "\n"
+            prev_line, line = line, next_line
 
 
-def get_stub(source):
-    """Get the stub code for a source code.
+def may_have_stub(source):
+    """Check whether a source code might produce a non-empty stub.
 
-    :sig: (str) -> str
-    :param source: Source code to generate the stub for.
-    :return: Generated stub code.
+    This is a quick text search for signature markers and class definitions
+    that doesn't parse the source. A source for which this check fails
+    will certainly have an empty stub.
+
+    :sig: (Union[str, bytes]) -> bool
+    :param source: Source code to check, either as text or as encoded bytes.
+    :return: Whether the source contains anything that could go into a stub.
     """
-    generator = StubGenerator(source)
-    stub = generator.generate_stub()
-    return stub
+    pattern = _RE_STUB_MARKERS_BYTES if isinstance(source, bytes) else _RE_STUB_MARKERS
+    return pattern.search(source) is not None
 
 
-def process_docstring(app, what, name, obj, options, lines):
-    """Modify the docstring before generating documentation.
+class UnsupportedSourceError(ValueError):
+    """A source code construct that the token engine can't process."""
 
-    This will insert type declarations for parameters and return type
-    into the docstring, and remove the signature field so that it will
-    be excluded from the generated document.
+
+class TokenStubGenerator(StubGenerator):
+    """A stub generator that works on the token stream of a source code.
+
+    Instead of parsing the whole source into a syntax tree, only
+    the statements that can contribute to the stub are parsed:
+    function and class headers along with their decorators and docstrings,
+    "from" imports, and assignments with signature comments. Everything
+    else is skipped at the token level, so the memory usage doesn't grow
+    with the size of the source.
+
+    The other statements are not checked for syntax errors. Declarations
+    in statements that share a line with other statements, like
+    ``if x: from y import z``, are not supported.
     """
-    aliases = getattr(app, "_sigaliases", None)
-    if aliases is None:
-        if what == "module":
-            aliases = get_aliases(inspect.getsource(obj).splitlines())
-            app._sigaliases = aliases
 
-    sig_marker = ":" + SIG_FIELD + ":"
-    is_class = what in ("class", "exception")
+    def process(self, source):
+        """Process the source code.
 
-    signature = extract_signature("\n".join(lines))
-    if signature is None:
-        if not is_class:
-            return
+        :sig: (str) -> None
+        :param source: Source code to generate the stub for.
+        :raise UnsupportedSourceError: When the source contains an unsupported construct.
+        """
+        self._blocks = []  # sig: List[str]
+        self._header = None  # sig: Optional[Tuple[int, int, int]]
+        self._decorator_line = None  # sig: Optional[int]
+
+        read_line = StringIO(source).readline
+        lines = self._code_lines
+
+        def read_code_line():
+            line = read_line()
+            lines.append(line)
+            return line
+
+        tokens = []
+        for token in self.generate_tokens(read_code_line):
+            type_ = token[0]
+            if type_ == tokenize.COMMENT:
+                self.comments.add_comment(token)
+            elif type_ == tokenize.INDENT:
+                self.start_block()
+            elif type_ == tokenize.DEDENT:
+                self.end_block()
+            elif type_ == tokenize.NEWLINE:
+                self.process_line(tokens, token[2][0])
+                tokens = []
+            elif type_ not in {tokenize.NL, tokenize.ENDMARKER}:
+                tokens.append(token)
 
-        init_method = getattr(obj, "__init__")
-        init_doc = init_method.__doc__
-        init_lines = init_doc.splitlines()[1:]
-        if len(init_lines) > 1:
-            init_doc = textwrap.dedent("\n".join(init_lines[1:]))
-            init_lines = init_doc.splitlines()
-        if sig_marker not in init_doc:
-            return
+        self.collect_aliases()
 
-        sig_started = False
-        for line in init_lines:
-            if line.lstrip().startswith(sig_marker):
-                sig_started = True
-            if sig_started:
-                lines.append(line)
-        signature = extract_signature("\n".join(lines))
+    @staticmethod
+    def generate_tokens(read_line):
+        """Generate the tokens of a source code.
 
-    if is_class:
-        obj = init_method
+        Tokenizer errors are reported as syntax errors, like the ast engine does.
 
-    param_types, rtype, _ = parse_signature(signature)
-    param_names = [p for p in inspect.signature(obj).parameters]
+        :sig: (Callable[[], str]) -> Iterator[Token]
+        :param read_line: Function to read the next line of the source code.
+        :return: Tokens of the source code.
+        :raise SyntaxError: When the source code can't be tokenized.
+        """
+        try:
+            for token in tokenize.generate_tokens(read_line):
+                yield token
+        except tokenize.TokenError as e:
+            message, (line, column) = e.args
+            raise SyntaxError(message, ("<unknown>", line, column + 1, None))
 
-    if is_class and (param_names[0] == "self"):
-        del param_names[0]
+    def start_block(self):
+        """Start an indented block.
 
-    # if something goes wrong, don't insert parameter types
-    if len(param_names) == len(param_types):
-        for name, type_ in zip(param_names, param_types):
-            find = ":param %(name)s:" % {"name": name}
-            alias = aliases.get(type_)
-            if alias is not None:
-                type_ = "*%(type)s* :sup:`%(alias)s`" % {"type": type_, "alias": alias}
-            for i, line in enumerate(lines):
-                if line.startswith(find):
-                    lines.insert(i, ":type %(name)s: %(type)s" % {"name": name, "type": type_})
-                    break
+        :sig: () -> None
+        """
+        if self._header is not None:
+            # the block kind will be known after checking the docstring
+            kind = "pending"
+        elif (len(self._blocks) > 0) and (self._blocks[-1] == "skip"):
+            kind = "skip"
+        else:
+            kind = "plain"
+        self._blocks.append(kind)
 
-    if not is_class:
-        for i, line in enumerate(lines):
-            if line.startswith((":return:", ":returns:")):
-                lines.insert(i, ":rtype: " + rtype)
-                break
+    def end_block(self):
+        """End an indented block.
 
-    # remove the signature field
-    sig_start = 0
-    while sig_start < len(lines):
-        if lines[sig_start].startswith(sig_marker):
-            break
-        sig_start += 1
-    sig_end = sig_start + 1
-    while sig_end < len(lines):
-        if (not lines[sig_end]) or (lines[sig_end][0] != " "):
-            break
-        sig_end += 1
-    for i in reversed(range(sig_start, sig_end)):
-        del lines[i]
+        :sig: () -> None
+        """
+        kind = self._blocks.pop()
+        if kind == "scope":
+            del self._parents[-1]
 
+    def parse_statement(self, first_line, last_line, extra=""):
+        """Parse a statement in the source.
 
-def setup(app):
-    """Register the Sphinx extension.
+        :sig: (int, int, str) -> ast.stmt
+        :param first_line: Number of the first line of the statement.
+        :param last_line: Number of the last line of the statement.
+        :param extra: Additional code to append to the statement.
+        :return: Parsed statement node, with line numbers as in the source.
+        """
+        start, end = first_line - 1, last_line
+        code = "".join(self._code_lines[start:end])
+        if not code.endswith("\n"):
+            code += "\n"
+        code += extra
+        indented = code[0] in " \t"
+        if indented:
+            code = "if 1:\n" + code
+        start = _timer()
+        tree = ast.parse(code)
+        if _profile is not None:
+            _profile.add_time("parsing", _timer() - start)
+        node = tree.body[0].body[0] if indented else tree.body[0]
+        ast.increment_lineno(node, first_line - (2 if indented else 1))
+        return node
+
+    def process_header(self, docstring_line=None):
+        """Process the pending function or class header.
+
+        :sig: (Optional[int]) -> None
+        :param docstring_line: Number of the line where the docstring ends, if any.
+        """
+        first_line, header_line, last_line = self._header
+        self._header = None
 
-    :sig: (sphinx.application.Sphinx) -> Dict[str, str]
-    :param app: Sphinx application to register this extension with.
-    :return: Information about this extension.
-    """
-    app.connect("autodoc-process-docstring", process_docstring)
-    return {"version": __version__}
+        if docstring_line is not None:
+            node = self.parse_statement(first_line, docstring_line)
+        else:
+            line = self._code_lines[header_line - 1]
+            indent = line[: len(line) - len(line.lstrip())]
+            node = self.parse_statement(first_line, last_line, indent + " pass\n")
 
+        if isinstance(node, ast.ClassDef):
+            stub_node = self.get_class_node(node)
+        else:
+            stub_node = self.get_function_node(node)
 
-def main(argv=None):
-    """Entry point of the command-line utility.
+        if stub_node is None:
+            self._blocks[-1] = "skip"
+        else:
+            self._blocks[-1] = "scope"
+            self._parents.append(stub_node)
 
-    :sig: (Optional[List[str]]) -> None
-    :param argv: Command line arguments.
-    """
-    argv = argv if argv is not None else sys.argv
-    parser = ArgumentParser(prog="pygenstub")
-    parser.add_argument("--version", action="version", version="%(prog)s " + __version__)
+    def process_line(self, tokens, last_line):
+        """Process a logical line.
 
-    parser.add_argument("source", help="source file")
-    parser.add_argument("--debug", action="store_true", help="enable debug messages")
-    arguments = parser.parse_args(argv[1:])
+        :sig: (List[Token], int) -> None
+        :param tokens: Tokens in the line, excluding comments.
+        :param last_line: Number of the physical line where the logical line ends.
+        :raise UnsupportedSourceError: When the line contains an unsupported construct.
+        """
+        if len(tokens) == 0:
+            return
 
-    # set debug mode
-    if arguments.debug:
-        logging.basicConfig(level=logging.DEBUG)
-        _logger.debug("running in debug mode")
+        first_line = tokens[0][2][0]
+        keyword = tokens[0][1]
+        if (keyword == "async") and (len(tokens) > 1):
+            keyword = tokens[1][1]
+        has_body = (keyword in _COMPOUND_KEYWORDS) or (keyword in {"def", "class"})
+
+        # find where the statements and the bodies on the same line start
+        starts = []
+        depth = 0
+        for i, token in enumerate(tokens):
+            text = token[1]
+            if token[0] != tokenize.OP:
+                continue
+            if text in "([{":
+                depth += 1
+            elif text in ")]}":
+                depth -= 1
+            elif (depth == 0) and (text == ";"):
+                starts.append(i + 1)
+            elif (depth == 0) and (text == ":") and has_body:
+                starts.append(i + 1)
+                has_body = False
+        if (len(starts) > 0) and (starts[-1] == len(tokens)):
+            # a trailing colon opens an indented block
+            del starts[-1]
+
+        if self._header is not None:
+            if all((t[0] == tokenize.STRING) or (t[1] in {"(", ")"}) for t in tokens):
+                self.process_header(docstring_line=last_line)
+                return
+            if (tokens[0][0] == tokenize.STRING) and (len(starts) > 0):
+                raise UnsupportedSourceError(
+                    "Docstring followed by statements on line %d" % first_line
+                )
+            self.process_header()
 
-    with open(arguments.source, mode="r", encoding="utf-8") as f_in:
-        code = f_in.read()
+        if (len(self._blocks) > 0) and (self._blocks[-1] == "skip"):
+            return
 
-    try:
-        stub = get_stub(code)
-    except RuntimeError as e:
-        print(e, file=sys.stderr)
-        sys.exit(1)
+        if keyword == "@":
+            if self._decorator_line is None:
+                self._decorator_line = first_line
+            return
 
-    if stub != "":
-        destination = arguments.source + "i"
-        with open(destination, mode="w", encoding="utf-8") as f_out:
-            f_out.write("# " + EDIT_WARNING + "\n\n")
-            f_out.write(stub)
+        if keyword in {"def", "class"}:
+            header_line = first_line
+            if self._decorator_line is not None:
+                first_line, self._decorator_line = self._decorator_line, None
+            if len(starts) == 0:
+                self._header = (first_line, header_line, last_line)
+            else:
+                self.visit(self.parse_statement(first_line, last_line))
+            return
+
+        signature = self.comments.find_signature(first_line, last_line)
+        if len(starts) > 0:
+            imports = [i for i in starts if tokens[i][1] == "from"]
+            if (signature is not None) or (keyword == "from") or (len(imports) > 0):
+                raise UnsupportedSourceError(
+                    "Declaration in a multi-statement line on line %d" % first_line
+                )
+            return
+
+        if (keyword == "from") or (signature is not None):
+            node = self.parse_statement(first_line, last_line)
+            if isinstance(node, (ast.ImportFrom, ast.Assign)):
+                self.visit(node)
+
+
+def iter_stub(source, engine="ast", observer=None, resolver=None):
+    """Get the stub code for a source code line by line.
+
+    The source is processed right away, but the lines of the stub are
+    produced while traversing the stub tree, so they can be written to
+    a text stream without building the whole stub in memory, for example
+    using ``out.writelines(iter_stub(source))``.
+
+    Sources without any signature markers or class definitions
+    are not parsed at all.
+
+    :sig: (str, str, Optional[StubObserver], Optional[TypeResolver]) -> Iterator[str]
+    :param source: Source code to generate the stub for.
+    :param engine: Stub generation engine, ``"ast"`` or ``"tokens"``.
+    :param observer: Receiver of the events about generating the stub.
+    :param resolver: Resolver for the types that are not defined in the source,
+        the shared resolver if not given.
+    :return: Lines of the stub code, including the line ends.
+    :raise UnsupportedSourceError: When the source can't be processed using the token engine.
+    """
+    if engine not in ENGINES:
+        raise ValueError("Unknown engine: " + engine)
+    if not may_have_stub(source):
+        return iter([])
+    start = _timer()
+    try:
+        generator_class = StubGenerator if engine == "ast" else TokenStubGenerator
+        generator = generator_class(source, observer=observer, resolver=resolver)
+    finally:
+        if _profile is not None:
+            _profile.add_processing_time(_timer() - start)
+    lines = generator.iter_stub()
+    return lines if _profile is None else _profile.iter_timed("generation", lines)
+
+
+def get_stub(source, engine="ast", observer=None, resolver=None):
+    """Get the stub code for a source code.
+
+    Sources without any signature markers or class definitions
+    are not parsed at all.
+
+    :sig: (str, str, Optional[StubObserver], Optional[TypeResolver]) -> str
+    :param source: Source code to generate the stub for.
+    :param engine: Stub generation engine, ``"ast"`` or ``"tokens"``.
+    :param observer: Receiver of the events about generating the stub.
+    :param resolver: Resolver for the types that are not defined in the source,
+        the shared resolver if not given.
+    :return: Generated stub code.
+    :raise UnsupportedSourceError: When the source can't be processed using the token engine.
+    """
+    return "".join(iter_stub(source, engine=engine, observer=observer, resolver=resolver))
+
+
+def walk_directory(path):
+    """Walk a directory tree in sorted order, skipping hidden directories.
+
+    :sig: (str) -> Iterator[Tuple[str, List[str]]]
+    :param path: Path of the directory.
+    :return: Path and sorted file names of every directory in the tree.
+    """
+    for dir_path, dir_names, file_names in os.walk(path):
+        dir_names[:] = sorted(
+            d for d in dir_names if (not d.startswith(".")) and (d != "__pycache__")
+        )
+        yield dir_path, sorted(file_names)
+
+
+def find_sources(paths, output_dir=None):
+    """Find the source files and the paths of their stub files.
+
+    Directories will be searched recursively for source files, skipping
+    hidden directories. If an output directory is given, the stub files
+    will be placed under it. The stub of a source file that was found
+    in a directory will be at the same path relative to the output directory
+    as the source relative to the parent of the directory.
+
+    :sig: (Sequence[str], Optional[str]) -> List[Tuple[str, str]]
+    :param paths: Paths of source files and directories.
+    :param output_dir: Directory to place the stub files under.
+    :return: Paths of source files and stub files.
+    """
+    sources = OrderedDict()
+    for path in paths:
+        if not os.path.isdir(path):
+            if output_dir is None:
+                stub_path = path + "i"
+            else:
+                stub_path = os.path.join(output_dir, os.path.basename(path) + "i")
+            sources.setdefault(path, stub_path)
+            continue
+
+        base_dir = os.path.dirname(os.path.abspath(path))
+        for dir_path, file_names in walk_directory(path):
+            for file_name in file_names:
+                if not file_name.endswith(SOURCE_SUFFIX):
+                    continue
+                source_path = os.path.join(dir_path, file_name)
+                if output_dir is None:
+                    stub_path = source_path + "i"
+                else:
+                    relative_path = os.path.relpath(os.path.abspath(source_path), base_dir)
+                    stub_path = os.path.join(output_dir, relative_path + "i")
+                sources.setdefault(source_path, stub_path)
+    return list(sources.items())
+
+
+def make_dirs(path):
+    """Create a directory and its parents unless it exists.
+
+    :sig: (str) -> None
+    :param path: Path of the directory to create.
+    """
+    if (path == "") or os.path.isdir(path):
+        return
+    try:
+        os.makedirs(path)
+    except OSError:
+        # another process might have created it in the meantime
+        if not os.path.isdir(path):
+            raise
+
+
+def generate_stub_file(
+    source_path, stub_path, cache=None, engine="ast", observer=None, resolver=None
+):
+    """Generate the stub file for a source file.
+
+    The stub file will not be written if the stub is empty. If the token
+    engine can't process the source, the ast engine will be used instead.
+
+    :sig: (str, str, Optional[StubCache], str, Optional[StubObserver],
+           Optional[TypeResolver]) -> bool
+    :param source_path: Path of the source file.
+    :param stub_path: Path of the stub file to write.
+    :param cache: Cache to get the stub from, or to store it in.
+    :param engine: Stub generation engine, ``"ast"`` or ``"tokens"``.
+    :param observer: Receiver of the events about generating the stub.
+    :param resolver: Resolver for the types that are not defined in the source.
+    :return: Whether the stub file was written.
+    """
+    start = _timer()
+    with open(source_path, mode="rb") as f_in:
+        content = f_in.read()
+    if observer is not None:
+        observer.file_started(source_path, len(content))
+    if not may_have_stub(content):
+        _logger.debug("no signatures in %s", source_path)
+        if observer is not None:
+            observer.file_finished(source_path, _timer() - start, 0)
+        return False
+
+    if _profile is not None:
+        _profile.start_file(source_path)
+
+    code = content.decode("utf-8")
+    try:
+        lines = _iter_stub(code, cache, engine, observer, resolver)
+    except UnsupportedSourceError as e:
+        _logger.warning("%s: %s, falling back to the ast engine", source_path, e)
+        lines = _iter_stub(code, cache, "ast", observer, resolver)
+
+    # all errors are raised before the first line, so no partial file is left
+    line = next(lines, "")
+    size = len(line)
+    if line != "":
+        written = _timer()
+        make_dirs(os.path.dirname(stub_path))
+        with open(stub_path, mode="w", encoding="utf-8") as f_out:
+            f_out.write("# " + EDIT_WARNING + "\n\n")
+            f_out.write(line)
+            for line in lines:
+                f_out.write(line)
+                size += len(line)
+        if observer is not None:
+            observer.stub_written(stub_path, _timer() - written, size)
+
+    if observer is not None:
+        observer.file_finished(source_path, _timer() - start, size)
+    return size > 0
+
+
+def _iter_stub(source, cache, engine, observer, resolver):
+    """Get the stub code for a source code line by line, using the cache if given.
+
+    The stubs in the cache are not split into lines.
+
+    :sig: (str, Optional[StubCache], str, Optional[StubObserver],
+           Optional[TypeResolver]) -> Iterator[str]
+    :param source: Source code to generate the stub for.
+    :param cache: Cache to get the stub from, or to store it in.
+    :param engine: Stub generation engine, ``"ast"`` or ``"tokens"``.
+    :param observer: Receiver of the events about generating the stub.
+    :param resolver: Resolver for the types that are not defined in the source.
+    :return: Lines of the stub code, including the line ends.
+    """
+    if cache is None:
+        return iter_stub(source, engine=engine, observer=observer, resolver=resolver)
+    stub = cache.get_stub(source, engine=engine, observer=observer, resolver=resolver)
+    return iter([stub])
+
+
+def write_atomic(path, text):
+    """Write a text to a file so that readers never see a partially written file.
+
+    :sig: (str, str) -> None
+    :param path: Path of the file to write.
+    :param text: Text to write.
+    """
+    import tempfile
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".pygenstub-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f_out:
+            f_out.write(text.encode("utf-8"))
+        os.chmod(temp_path, 0o644)
+        replace = getattr(os, "replace", os.rename)
+        replace(temp_path, path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+
+def get_file_hash(path):
+    """Get the hash of the contents of a file.
+
+    :sig: (str) -> str
+    :param path: Path of the file.
+    :return: SHA-256 digest of the file contents, in hexadecimal.
+    """
+    digest = hashlib.sha256()
+    with open(path, mode="rb") as f_in:
+        digest.update(f_in.read())
+    return digest.hexdigest()
+
+
+def get_module_name(source_path):
+    """Get the name of the module in a source file.
+
+    The directories that contain an ``__init__.py`` file are considered
+    to be packages, and their names are included.
+
+    :sig: (str) -> str
+    :param source_path: Path of the source file.
+    :return: Dotted name of the module.
+    """
+    directory, file_name = os.path.split(os.path.abspath(source_path))
+    parts = [file_name[: -len(SOURCE_SUFFIX)]]
+    if parts[0] == "__init__":
+        parts = []
+    while os.path.exists(os.path.join(directory, "__init__" + SOURCE_SUFFIX)):
+        directory, package = os.path.split(directory)
+        parts.insert(0, package)
+    return ".".join(parts)
+
+
+def read_source(path):
+    """Read the source code in a file.
+
+    Line ends are translated to newlines, like in text mode.
+
+    :sig: (str) -> str
+    :param path: Path of the source file.
+    :return: Source code.
+    """
+    with open(path, mode="rb") as f_in:
+        source = f_in.read().decode("utf-8")
+    if "\r" in source:
+        source = source.replace("\r\n", "\n").replace("\r", "\n")
+    return source
+
+
+def collect_symbols(source):
+    """Collect the names that other modules can import from the stub of a source.
+
+    These are the top level classes and the type aliases. The source is
+    only searched for their declarations, it's not parsed.
+
+    :sig: (str) -> List[str]
+    :param source: Source code to collect the names from.
+    :return: Collected names.
+    """
+    return _RE_MODULE_SYMBOL.findall(source)
+
+
+def get_dependencies(source_path, resolver):
+    """Get the names that a source file shares with the other modules of a run.
+
+    The used names are the ones from the other modules that occur in the source.
+    The stub of the source can only change if any of them starts resolving
+    to a different module.
+
+    :sig: (str, TypeResolver) -> Dict[str, Any]
+    :param source_path: Path of the source file.
+    :param resolver: Resolver for the types that are not defined in the source.
+    :return: Names defined in the source, and the modules of the used names.
+    """
+    source = read_source(source_path)
+    module_ = get_module_name(source_path)
+    used = resolver.get_registered_names(source)
+    return {
+        "symbols": collect_symbols(source),
+        "uses": {n: m for n, m in used.items() if m != module_},
+    }
+
+
+def get_package_resolver(sources, manifest=None):
+    """Get a type resolver that also knows the names defined in the source files.
+
+    The resolver can be used for generating the stubs of all the source files,
+    so that the names that one module defines can be used in the signatures
+    of the others without being imported. Every source is read once
+    but not parsed, except the unchanged sources in the manifest, whose
+    names are taken from their records. If two modules define the same name,
+    the first one is used.
+
+    The resolver is a copy of the shared resolver, so the modules that are
+    registered on the shared resolver take precedence over the source files.
+
+    :sig: (List[Tuple[str, str]], Optional[Manifest]) -> TypeResolver
+    :param sources: Paths of source files and stub files.
+    :param manifest: Records of the source files.
+    :return: Type resolver with the names in the source files registered.
+    """
+    resolver = get_type_resolver().copy()
+    for source_path, _ in sources:
+        names = manifest.get_symbols(source_path) if manifest is not None else None
+        if names is None:
+            try:
+                names = collect_symbols(read_source(source_path))
+            except (EnvironmentError, UnicodeDecodeError):
+                # the error will be reported when generating the stub
+                continue
+        if len(names) > 0:
+            resolver.register_module(get_module_name(source_path), names)
+    return resolver
+
+
+class Manifest:
+    """A record of the source files that the stub files were generated from.
+
+    For every source file, the manifest keeps the modification time, the size,
+    and the hash of the file, the path of the stub file and whether it was
+    written, and the version of pygenstub that generated the stub. A source
+    file whose record matches its current state doesn't need a new stub.
+
+    The records also keep the names that the module defines for the other
+    modules, and the names that it uses from them along with their modules.
+    An unchanged source file still needs a new stub if any of the names
+    it uses is now defined in another module.
+    """
+
+    def __init__(self, path):
+        """Initialize this manifest.
+
+        The records will be loaded from the manifest file if it exists.
+
+        :sig: (str) -> None
+        :param path: Path of the manifest file.
+        """
+        self.path = path  # sig: str
+        self.entries = {}  # sig: Dict[str, FileState]
+
+        self._base_dir = os.path.dirname(os.path.abspath(path))  # sig: str
+
+        if os.path.exists(path):
+            try:
+                with open(path, mode="r", encoding="utf-8") as f_in:
+                    content = json.load(f_in)
+                self.entries = content["files"]
+            except (ValueError, KeyError, TypeError):
+                _logger.warning("ignoring invalid manifest file: %s", path)
+
+    def get_key(self, source_path):
+        """Get the key for the record of a source file.
+
+        :sig: (str) -> str
+        :param source_path: Path of the source file.
+        :return: Path of the source file, relative to the manifest.
+        """
+        return os.path.relpath(os.path.abspath(source_path), self._base_dir)
+
+    def check(self, source_path, stub_path):
+        """Check whether the stub file of a source file is up to date.
+
+        The hash of the source file is computed only if its modification time
+        or size doesn't match its record.
+
+        :sig: (str, str) -> Tuple[bool, FileState]
+        :param source_path: Path of the source file.
+        :param stub_path: Path of the stub file.
+        :return: Whether the stub is up to date, and the current state of the source file.
+        """
+        stat = os.stat(source_path)
+        state = {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "version": __version__,
+            "stub": stub_path,
+        }
+
+        entry = self.entries.get(self.get_key(source_path))
+        if (
+            (entry is None)
+            or (entry.get("version") != __version__)
+            or (entry.get("stub") != stub_path)
+            or (entry.get("written") and (not os.path.exists(stub_path)))
+        ):
+            state["hash"] = get_file_hash(source_path)
+            return False, state
+
+        state["written"] = entry.get("written")
+        for field in ("symbols", "uses"):
+            if field in entry:
+                state[field] = entry[field]
+        if (entry.get("mtime"), entry.get("size")) == (stat.st_mtime, stat.st_size):
+            state["hash"] = entry.get("hash")
+            return True, state
+
+        state["hash"] = get_file_hash(source_path)
+        return entry.get("hash") == state["hash"], state
+
+    def check_dependencies(self, source_path, resolver):
+        """Check whether the names that a source file uses still resolve the same way.
+
+        :sig: (str, TypeResolver) -> bool
+        :param source_path: Path of the source file.
+        :param resolver: Resolver for the types that are not defined in the sources.
+        :return: Whether all used names are still defined in the same modules.
+        """
+        entry = self.entries.get(self.get_key(source_path), {})
+        uses = entry.get("uses", {})
+        return all(resolver.get_module(n) == m for n, m in uses.items())
+
+    def get_symbols(self, source_path):
+        """Get the recorded names that a source file defines for other modules.
+
+        :sig: (str) -> Optional[List[str]]
+        :param source_path: Path of the source file.
+        :return: Recorded names, ``None`` if the file has changed since it was recorded.
+        """
+        entry = self.entries.get(self.get_key(source_path))
+        if (entry is None) or (entry.get("version") != __version__):
+            return None
+        try:
+            stat = os.stat(source_path)
+        except EnvironmentError:
+            return None
+        if (entry.get("mtime"), entry.get("size")) != (stat.st_mtime, stat.st_size):
+            return None
+        return entry.get("symbols")
+
+    def update(self, source_path, state):
+        """Record the state of a source file.
+
+        :sig: (str, FileState) -> None
+        :param source_path: Path of the source file.
+        :param state: State of the source file.
+        """
+        self.entries[self.get_key(source_path)] = state
+
+    def discard(self, source_path):
+        """Remove the record of a source file.
+
+        :sig: (str) -> None
+        :param source_path: Path of the source file.
+        """
+        self.entries.pop(self.get_key(source_path), None)
+
+    def save(self):
+        """Write the records to the manifest file.
+
+        :sig: () -> None
+        """
+        content = {"version": __version__, "files": self.entries}
+        write_atomic(self.path, json.dumps(content, indent=1, sort_keys=True) + "\n")
+
+
+class StubCache:
+    """A content addressed cache of generated stubs in a directory.
+
+    The stubs are stored under keys computed from the source code,
+    the version of pygenstub, and the settings that affect the stub.
+    The cache can be shared between different checkouts and concurrent
+    processes since entries are inserted atomically and never modified.
+    When the total size of the entries exceeds the limit, the least
+    recently used ones are removed.
+    """
+
+    def __init__(self, directory, max_size=None):
+        """Initialize this cache.
+
+        :sig: (str, Optional[int]) -> None
+        :param directory: Path of the cache directory.
+        :param max_size: Maximum total size of the entries in bytes, ``None`` for no limit.
+        """
+        self.directory = directory  # sig: str
+        self.max_size = max_size  # sig: Optional[int]
+        self.hits = 0  # sig: int
+        self.misses = 0  # sig: int
+
+        self._size = None  # sig: Optional[int]
+
+    def get_key(self, source, settings=None):
+        """Get the cache key for a source code.
+
+        :sig: (str, Optional[Dict[str, Any]]) -> str
+        :param source: Source code to generate the stub for.
+        :param settings: Settings that affect the generated stub.
+        :return: Cache key.
+        """
+        digest = hashlib.sha256()
+        digest.update(("pygenstub " + __version__ + "\0").encode("utf-8"))
+        digest.update((json.dumps(settings or {}, sort_keys=True) + "\0").encode("utf-8"))
+        digest.update(source.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get_path(self, key):
+        """Get the path of the entry file for a key.
+
+        :sig: (str) -> str
+        :param key: Cache key.
+        :return: Path of the entry file.
+        """
+        return os.path.join(self.directory, key[:2], key + STUB_SUFFIX)
+
+    def get(self, key):
+        """Get the stub stored under a key.
+
+        :sig: (str) -> Optional[str]
+        :param key: Cache key.
+        :return: Stored stub, or ``None`` if there's no entry for the key.
+        """
+        path = self.get_path(key)
+        try:
+            with open(path, mode="r", encoding="utf-8") as f_in:
+                stub = f_in.read()
+        except EnvironmentError:
+            self.misses += 1
+            return None
+
+        try:
+            # mark the entry as recently used
+            os.utime(path, None)
+        except EnvironmentError:
+            pass
+        self.hits += 1
+        return stub
+
+    def put(self, key, stub):
+        """Store a stub under a key.
+
+        :sig: (str, str) -> None
+        :param key: Cache key.
+        :param stub: Stub to store.
+        """
+        path = self.get_path(key)
+        make_dirs(os.path.dirname(path))
+        write_atomic(path, stub)
+
+        if self.max_size is not None:
+            if self._size is None:
+                self._size = self.stats()["size"]
+            else:
+                self._size += os.path.getsize(path)
+            if self._size > self.max_size:
+                self.evict()
+
+    def get_stub_key(self, source, resolver=None, **settings):
+        """Get the cache key for the stub of a source code.
+
+        The target Python version of the type resolver is part of the key,
+        since the names that can be resolved depend on it. If a type resolver
+        is given, the names registered in it that occur in the source are
+        also part of the key.
+
+        :sig: (str, Optional[TypeResolver]) -> str
+        :param source: Source code to generate the stub for.
+        :param resolver: Resolver for the types that are not defined in the source,
+            the shared resolver if not given.
+        :param settings: Keyword arguments for :func:`get_stub` that affect the stub.
+        :return: Cache key.
+        """
+        target_resolver = resolver if resolver is not None else get_type_resolver()
+        key_settings = dict(settings, target_version=list(target_resolver.target_version))
+        if resolver is not None:
+            names = resolver.get_registered_names(source)
+            if len(names) > 0:
+                key_settings["names"] = names
+        return self.get_key(source, key_settings)
+
+    def get_stub(self, source, observer=None, resolver=None, **settings):
+        """Get the stub code for a source code, using the cache.
+
+        This is a cached version of the :func:`get_stub` function.
+
+        :sig: (str, Optional[StubObserver], Optional[TypeResolver]) -> str
+        :param source: Source code to generate the stub for.
+        :param observer: Receiver of the events about getting the stub.
+        :param resolver: Resolver for the types that are not defined in the source.
+        :param settings: Keyword arguments for :func:`get_stub` that affect the stub.
+        :return: Generated stub code.
+        """
+        if not may_have_stub(source):
+            return ""
+        start = _timer()
+        key = self.get_stub_key(source, resolver=resolver, **settings)
+        stub = self.get(key)
+        if stub is not None:
+            if observer is not None:
+                observer.cache_hit(key, _timer() - start, len(stub))
+            return stub
+        stub = get_stub(source, observer=observer, resolver=resolver, **settings)
+        self.put(key, stub)
+        if observer is not None:
+            observer.cache_miss(key, _timer() - start, len(stub))
+        return stub
+
+    def _get_entries(self):
+        """Get the entry files in this cache.
+
+        :sig: () -> List[Tuple[float, int, str]]
+        :return: Modification time, size, and path of every entry file.
+        """
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for dir_name in os.listdir(self.directory):
+            dir_path = os.path.join(self.directory, dir_name)
+            if not os.path.isdir(dir_path):
+                continue
+            for file_name in os.listdir(dir_path):
+                if not file_name.endswith(STUB_SUFFIX):
+                    continue
+                path = os.path.join(dir_path, file_name)
+                try:
+                    stat = os.stat(path)
+                except EnvironmentError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """Remove the least recently used entries until the size limit is satisfied.
+
+        :sig: () -> None
+        """
+        entries = sorted(self._get_entries())
+        size = sum(e[1] for e in entries)
+        for _, entry_size, path in entries:
+            if (self.max_size is None) or (size <= self.max_size):
+                break
+            try:
+                os.unlink(path)
+            except EnvironmentError:
+                continue
+            size -= entry_size
+        self._size = size
+
+    def clear(self):
+        """Remove all entries from this cache.
+
+        :sig: () -> None
+        """
+        for _, _, path in self._get_entries():
+            try:
+                os.unlink(path)
+            except EnvironmentError:
+                pass
+        self._size = 0
+
+    def stats(self):
+        """Get statistics about this cache.
+
+        The number of hits and misses are the ones in this process.
+
+        :sig: () -> Dict[str, Optional[int]]
+        :return: Number of entries, total and maximum size, number of hits and misses.
+        """
+        entries = self._get_entries()
+        return {
+            "entries": len(entries),
+            "size": sum(e[1] for e in entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def _generate_stub_result(task):
+    """Generate the stub file for a source file and report the result.
+
+    :sig: (Tuple[str, str, Optional[StubCache], str, Optional[StubObserver],
+           Optional[TypeResolver]]) -> StubResult
+    :param task: Paths of the source file and the stub file, the stub cache, the engine,
+        the observer, and the type resolver.
+    :return: Path of source file, path of written stub file, and error message.
+    """
+    source_path, stub_path, cache, engine, observer, resolver = task
+    _logger.debug("generating stub for %s", source_path)
+    try:
+        written = generate_stub_file(
+            source_path,
+            stub_path,
+            cache=cache,
+            engine=engine,
+            observer=observer,
+            resolver=resolver,
+        )
+    except Exception as e:
+        _logger.debug("failed to generate stub for %s", source_path, exc_info=True)
+        return source_path, None, "%(t)s: %(e)s" % {"t": e.__class__.__name__, "e": e}
+    return source_path, stub_path if written else None, None
+
+
+def _init_worker(resolver=None):
+    """Prepare a worker process for generating stubs.
+
+    The type resolver is sent to the worker once, instead of with every task,
+    and it becomes the shared resolver of the worker process.
+
+    :sig: (Optional[TypeResolver]) -> None
+    :param resolver: Resolver for the types that are not defined in the sources.
+    """
+    global _type_resolver
+    get_docstring_parser()
+    if resolver is not None:
+        _type_resolver = resolver
+
+
+def generate_stubs(
+    paths,
+    output_dir=None,
+    jobs=1,
+    manifest_path=None,
+    force=False,
+    cache=None,
+    engine="ast",
+    observer=None,
+):
+    """Generate the stub files for a number of source files and directories.
+
+    If more than one job is requested, the files will be distributed over
+    a pool of worker processes. In either case, the results are produced
+    in the order of the source files. An error in one file doesn't stop
+    the processing of the others; it is reported in the result of that file
+    instead.
+
+    If a manifest file is given, the source files that haven't changed since
+    their stubs were generated will be skipped and will not be reported.
+    The manifest will be updated with the successfully processed files.
+
+    If a stub cache is given, the stubs for the processed files will be
+    taken from the cache where possible.
+
+    The names that are defined in any of the source files, i.e. the top level
+    classes and the type aliases, can be used in the signatures of the others
+    without being imported; the stubs will import them as needed.
+
+    An observer can only receive the events from a single process,
+    so it requires a single job.
+
+    :sig: (Sequence[str], Optional[str], int, Optional[str], bool,
+           Optional[StubCache], str, Optional[StubObserver]) -> Iterator[StubResult]
+    :param paths: Paths of source files and directories.
+    :param output_dir: Directory to place the stub files under.
+    :param jobs: Number of worker processes, ``0`` for the number of CPUs.
+    :param manifest_path: Path of the manifest file for incremental generation.
+    :param force: Whether to regenerate all stubs, ignoring the manifest.
+    :param cache: Cache to get the stubs from, or to store them in.
+    :param engine: Stub generation engine, ``"ast"`` or ``"tokens"``.
+    :param observer: Receiver of the events about generating the stubs.
+    :return: Path of source file, path of written stub file, and error message for each source.
+    :raise ValueError: When an observer is given for more than one job.
+    """
+    if (observer is not None) and (jobs != 1):
+        raise ValueError("Observers require a single job")
+    sources = find_sources(paths, output_dir=output_dir)
+    return _generate_stubs(sources, jobs, manifest_path, force, cache, engine, observer)
+
+
+def _generate_stubs(
+    sources, jobs, manifest_path, force, cache, engine, observer, resolver=None
+):
+    """Generate the stub files for a number of source files.
+
+    If no type resolver is given, one that knows the names defined
+    in the source files will be used. Unchanged sources in the manifest
+    will be regenerated if a name they use is now defined in another module.
+
+    :sig: (List[Tuple[str, str]], int, Optional[str], bool, Optional[StubCache],
+           str, Optional[StubObserver], Optional[TypeResolver]) -> Iterator[StubResult]
+    :param sources: Paths of source files and stub files.
+    :param jobs: Number of worker processes, ``0`` for the number of CPUs.
+    :param manifest_path: Path of the manifest file for incremental generation.
+    :param force: Whether to regenerate all stubs, ignoring the manifest.
+    :param cache: Cache to get the stubs from, or to store them in.
+    :param engine: Stub generation engine, ``"ast"`` or ``"tokens"``.
+    :param observer: Receiver of the events about generating the stubs.
+    :param resolver: Resolver for the types that are not defined in the sources.
+    :return: Path of source file, path of written stub file, and error message for each source.
+    """
+    manifest = Manifest(manifest_path) if manifest_path is not None else None
+    if resolver is None:
+        resolver = get_package_resolver(sources, manifest=manifest)
+    states = {}
+    if manifest is not None:
+        pending = []
+        for source_path, stub_path in sources:
+            try:
+                current, state = manifest.check(source_path, stub_path)
+            except EnvironmentError:
+                current, state = False, None
+            if current and (not manifest.check_dependencies(source_path, resolver)):
+                _logger.debug("names used by %s have moved", source_path)
+                current = False
+            if current and (not force):
+                _logger.debug("skipping unchanged source %s", source_path)
+                manifest.update(source_path, state)
+                continue
+            states[source_path] = state
+            pending.append((source_path, stub_path))
+        sources = pending
+
+    try:
+        results = _generate_stub_results(sources, jobs, cache, engine, observer, resolver)
+        for result in results:
+            if manifest is not None:
+                source_path, stub_path, error = result
+                state = states[source_path]
+                if (error is None) and (state is not None):
+                    try:
+                        state.update(get_dependencies(source_path, resolver))
+                    except (EnvironmentError, UnicodeDecodeError):
+                        state = None
+                if (error is not None) or (state is None):
+                    manifest.discard(source_path)
+                else:
+                    state["written"] = stub_path is not None
+                    manifest.update(source_path, state)
+            yield result
+    finally:
+        if manifest is not None:
+            manifest.save()
+
+
+def _generate_stub_results(sources, jobs, cache, engine, observer, resolver):
+    """Generate the stub files for a number of source files.
+
+    :sig: (List[Tuple[str, str]], int, Optional[StubCache], str,
+           Optional[StubObserver], Optional[TypeResolver]) -> Iterator[StubResult]
+    :param sources: Paths of source files and stub files.
+    :param jobs: Number of worker processes, ``0`` for the number of CPUs.
+    :param cache: Cache to get the stubs from, or to store them in.
+    :param engine: Stub generation engine, ``"ast"`` or ``"tokens"``.
+    :param observer: Receiver of the events about generating the stubs.
+    :param resolver: Resolver for the types that are not defined in the sources.
+    :return: Path of source file, path of written stub file, and error message for each source.
+    """
+    import multiprocessing
+
+    if jobs == 0:
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(sources))
+
+    if jobs <= 1:
+        for source, stub in sources:
+            yield _generate_stub_result((source, stub, cache, engine, observer, resolver))
+        return
+
+    # the workers use the resolver that was sent to them at the start
+    tasks = [(source, stub, cache, engine, observer, None) for source, stub in sources]
+    _logger.debug("starting %d worker processes", jobs)
+    pool = multiprocessing.Pool(processes=jobs, initializer=_init_worker, initargs=(resolver,))
+    try:
+        for result in pool.imap(_generate_stub_result, tasks):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class PollingMonitor:
+    """A file system monitor that checks for changes at regular intervals."""
+
+    def __init__(self, interval=WATCH_INTERVAL):
+        """Initialize this monitor.
+
+        :sig: (float) -> None
+        :param interval: Seconds to wait between checks.
+        """
+        self.interval = interval  # sig: float
+
+    def watch(self, directories):
+        """Start watching a number of directories.
+
+        Polling doesn't need to register the directories.
+
+        :sig: (Iterable[str]) -> None
+        :param directories: Paths of the directories.
+        """
+
+    def wait(self, timeout=None):
+        """Wait for changes in the watched directories.
+
+        :sig: (Optional[float]) -> bool
+        :param timeout: Seconds to wait, the polling interval if not given.
+        :return: Whether the directories might have changed during the wait.
+        """
+        if timeout is None:
+            time.sleep(self.interval)
+            return True
+        time.sleep(timeout)
+        return False
+
+    def close(self):
+        """Stop watching the directories.
+
+        :sig: () -> None
+        """
+
+
+class INotifyMonitor:
+    """A file system monitor that gets notified of changes by inotify."""
+
+    def __init__(self):
+        """Initialize this monitor.
+
+        :sig: () -> None
+        """
+        from inotify_simple import INotify, flags
+
+        self._inotify = INotify()
+        self._mask = (
+            flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO | flags.DELETE | flags.MODIFY
+        )
+        self._watched = set()  # sig: Set[str]
+
+    def watch(self, directories):
+        """Start watching a number of directories.
+
+        Directories that are already being watched will be skipped.
+
+        :sig: (Iterable[str]) -> None
+        :param directories: Paths of the directories.
+        """
+        for directory in directories:
+            if directory in self._watched:
+                continue
+            try:
+                self._inotify.add_watch(directory, self._mask)
+            except OSError:
+                # the directory might have been removed in the meantime
+                continue
+            self._watched.add(directory)
+
+    def wait(self, timeout=None):
+        """Wait for changes in the watched directories.
+
+        :sig: (Optional[float]) -> bool
+        :param timeout: Seconds to wait, no limit if not given.
+        :return: Whether any change was reported during the wait.
+        """
+        timeout_ms = int(timeout * 1000) if timeout is not None else None
+        return len(self._inotify.read(timeout=timeout_ms)) > 0
+
+    def close(self):
+        """Stop watching the directories.
+
+        :sig: () -> None
+        """
+        self._inotify.close()
+
+
+def get_monitor():
+    """Get a monitor for watching the source directories.
+
+    The inotify monitor will be used if the ``inotify_simple`` package
+    is installed, otherwise the directories will be polled.
+
+    :sig: () -> Union[INotifyMonitor, PollingMonitor]
+    :return: File system monitor.
+    """
+    try:
+        return INotifyMonitor()
+    except (ImportError, OSError):
+        _logger.debug("inotify not available, polling for changes")
+        return PollingMonitor()
+
+
+def get_watched_directories(paths):
+    """Get the directories that contain the source files in the given paths.
+
+    :sig: (Sequence[str]) -> List[str]
+    :param paths: Paths of source files and directories.
+    :return: Paths of the directories to watch.
+    """
+    directories = OrderedDict()
+    for path in paths:
+        if not os.path.isdir(path):
+            directories.setdefault(os.path.dirname(os.path.abspath(path)), None)
+            continue
+        for dir_path, _ in walk_directory(path):
+            directories.setdefault(os.path.abspath(dir_path), None)
+    return list(directories)
+
+
+def get_source_states(sources):
+    """Get the modification times and sizes of source files.
+
+    Source files that don't exist will be left out.
+
+    :sig: (List[Tuple[str, str]]) -> Dict[str, Tuple[float, int]]
+    :param sources: Paths of source files and stub files.
+    :return: Modification time and size of each source file.
+    """
+    states = {}
+    for source_path, _ in sources:
+        try:
+            stat = os.stat(source_path)
+        except EnvironmentError:
+            continue
+        states[source_path] = (stat.st_mtime, stat.st_size)
+    return states
+
+
+def find_dependents(sources, changed, names):
+    """Add the source files that use any of some names to the changed source files.
+
+    :sig: (List[Tuple[str, str]], List[Tuple[str, str]], Set[str]) -> List[Tuple[str, str]]
+    :param sources: Paths of source files and stub files.
+    :param changed: Paths of changed source files and their stub files.
+    :param names: Names to search for in the unchanged source files.
+    :return: Paths of changed and dependent source files, and their stub files.
+    """
+    changed_paths = {source_path for source_path, _ in changed}
+    result = []
+    for source_path, stub_path in sources:
+        if source_path not in changed_paths:
+            try:
+                words = set(_RE_WORD.findall(read_source(source_path)))
+            except (EnvironmentError, UnicodeDecodeError):
+                continue
+            if words.isdisjoint(names):
+                continue
+        result.append((source_path, stub_path))
+    return result
+
+
+def watch_stubs(
+    paths,
+    output_dir=None,
+    manifest_path=None,
+    cache=None,
+    monitor=None,
+    delay=WATCH_DELAY,
+    engine="ast",
+    observer=None,
+):
+    """Regenerate the stub files of source files whenever they change.
+
+    The stubs are generated in the current process so that the parser
+    and the signature caches stay warm between changes. When a change
+    is noticed, the generation waits until no changes happen for a while,
+    so that a burst of changes only causes a single regeneration.
+    The names defined in the source files are collected again
+    for every regeneration, and the unchanged sources that use a name
+    that is now defined in another module are also regenerated.
+
+    :sig: (Sequence[str], Optional[str], Optional[str], Optional[StubCache],
+           Optional[Union[INotifyMonitor, PollingMonitor]], float, str,
+           Optional[StubObserver]) -> Iterator[StubResult]
+    :param paths: Paths of source files and directories.
+    :param output_dir: Directory to place the stub files under.
+    :param manifest_path: Path of the manifest file to keep up-to-date.
+    :param cache: Cache to get the stubs from, or to store them in.
+    :param monitor: File system monitor to wait for changes with.
+    :param delay: Seconds without changes to wait for before regenerating.
+    :param engine: Stub generation engine, ``"ast"`` or ``"tokens"``.
+    :param observer: Receiver of the events about generating the stubs.
+    :return: Path of source file, path of written stub file, and error message for each change.
+    """
+    if monitor is None:
+        monitor = get_monitor()
+    get_docstring_parser()
+
+    sources = find_sources(paths, output_dir=output_dir)
+    states = get_source_states(sources)
+    previous = get_package_resolver(sources)
+    try:
+        while True:
+            monitor.watch(get_watched_directories(paths))
+            if not monitor.wait():
+                continue
+            sources = find_sources(paths, output_dir=output_dir)
+            current = get_source_states(sources)
+            if current == states:
+                continue
+
+            # let the burst of changes settle down
+            while True:
+                active = monitor.wait(delay)
+                sources = find_sources(paths, output_dir=output_dir)
+                settled = get_source_states(sources)
+                if (not active) and (settled == current):
+                    break
+                current = settled
+
+            changed = []
+            for source_path, stub_path in sources:
+                state = current.get(source_path)
+                if (state is not None) and (state != states.get(source_path)):
+                    changed.append((source_path, stub_path))
+            states = current
+
+            # the unchanged sources that use the names that have moved also change
+            resolver = get_package_resolver(sources)
+            moved = resolver.get_changed_names(previous)
+            previous = resolver
+            if len(moved) > 0:
+                changed = find_dependents(sources, changed, moved)
+
+            results = _generate_stubs(
+                changed, 1, manifest_path, True, cache, engine, observer, resolver
+            )
+            for result in results:
+                yield result
+    finally:
+        monitor.close()
+
+
+class SignatureIndex(StubGenerator):
+    """An index of the signatures in a source code by qualified name.
+
+    The signatures are collected from the function and class docstrings
+    in the same way as generating a stub, but no stub nodes are created
+    for the functions and the variables.
+    """
+
+    def __init__(self, source):
+        """Initialize this signature index.
+
+        :sig: (str) -> None
+        :param source: Source code to collect the signatures from.
+        """
+        self.signatures = {}  # sig: Dict[str, str]
+        super(SignatureIndex, self).__init__(source)
+
+    def get_qualname(self, node):
+        """Get the qualified name of a function or a class node.
+
+        :sig: (Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef]) -> str
+        :param node: Node to get the qualified name of.
+        :return: Names of the enclosing classes and the node, separated by dots.
+        """
+        return ".".join([p.name for p in self._parents[1:]] + [node.name])
+
+    def visit_Assign(self, node):
+        """Skip an assignment node.
+
+        :sig: (ast.Assign) -> None
+        :param node: Node to skip.
+        """
+
+    def get_function_node(self, node):
+        """Add the signature of a function node to the index.
+
+        The function body is not processed. The setters and deleters
+        of properties are skipped, and if a function is defined more
+        than once, the first definition is used.
+
+        :sig: (Union[ast.FunctionDef, ast.AsyncFunctionDef]) -> None
+        :param node: Node to process.
+        """
+        for decorator in node.decorator_list:
+            if isinstance(decorator, ast.Attribute) and (
+                decorator.attr in ("setter", "deleter")
+            ):
+                return
+        signature = self.get_node_signature(node)
+        if signature is not None:
+            self.signatures.setdefault(self.get_qualname(node), signature)
+
+    def get_class_node(self, node):
+        """Add the signature of a class node to the index.
+
+        The base classes are not resolved, since they can be any expression
+        in the source, like a subscripted type or a call.
+
+        :sig: (ast.ClassDef) -> ClassNode
+        :param node: Node to process.
+        :return: Class node that holds the methods while visiting the class body.
+        """
+        signature = self.get_node_signature(node)
+        if signature is not None:
+            self.signatures.setdefault(self.get_qualname(node), signature)
+        return ClassNode(node.name, bases=(), signature=signature)
+
+
+def get_module_index(module_name, indexes, collect):
+    """Get an index of the names in a module.
+
+    The index is built once and reused until the source file changes.
+
+    :sig: (str, Dict[str, ModuleIndex], Callable[[str], Dict]) -> Optional[Dict[str, str]]
+    :param module_name: Name of the module to get the index of.
+    :param indexes: Previously built indexes to reuse, by module name.
+    :param collect: Function to build the index from the source of the module.
+    :return: Index of the module,
+        or ``None`` if the source of the module can't be processed.
+    """
+    path = getattr(sys.modules.get(module_name), "__file__", None)
+    if path is None:
+        return None
+    if path.endswith((".pyc", ".pyo")):
+        path = path[:-1]
+    try:
+        key = (path, os.path.getmtime(path))
+    except EnvironmentError:
+        return None
+
+    entry = indexes.get(module_name)
+    if (entry is None) or (entry[0] != key):
+        try:
+            index = collect(read_source(path))
+        except (EnvironmentError, UnicodeDecodeError, SyntaxError, ValueError):
+            index = None
+        entry = (key, index)
+        indexes[module_name] = entry
+    return entry[1]
+
+
+def collect_signatures(source):
+    """Collect the signatures in a source code.
+
+    :sig: (str) -> Dict[str, str]
+    :param source: Source code to collect the signatures from.
+    :return: Signatures by qualified name.
+    """
+    return SignatureIndex(source).signatures
+
+
+def collect_aliases(source):
+    """Collect the type aliases in a source code.
+
+    The source is only searched for the alias comments, it's not tokenized.
+
+    :sig: (str) -> Dict[str, str]
+    :param source: Source code to collect the aliases from.
+    :return: Aliases and their definitions.
+    """
+    if SIG_ALIAS not in source:
+        return {}
+    return OrderedDict(_RE_ALIAS_LINE.findall(source))
+
+
+def get_signature_index(module_name, indexes):
+    """Get the index of the signatures in a module.
+
+    :sig: (str, Dict[str, ModuleIndex]) -> Optional[Dict[str, str]]
+    :param module_name: Name of the module to get the signatures of.
+    :param indexes: Previously built signature indexes to reuse, by module name.
+    :return: Signatures in the module by qualified name,
+        or ``None`` if the source of the module can't be processed.
+    """
+    return get_module_index(module_name, indexes, collect_signatures)
+
+
+def get_alias_index(module_name, indexes):
+    """Get the index of the type aliases in a module.
+
+    :sig: (str, Dict[str, ModuleIndex]) -> Optional[Dict[str, str]]
+    :param module_name: Name of the module to get the aliases of.
+    :param indexes: Previously built alias indexes to reuse, by module name.
+    :return: Aliases in the module and their definitions,
+        or ``None`` if the source of the module can't be processed.
+    """
+    return get_module_index(module_name, indexes, collect_aliases)
+
+
+def get_env_data(env):
+    """Get the data of the Sphinx extension in a build environment.
+
+    The data is pickled along with the environment, so the indexes
+    are reused in the incremental builds. The signature and alias indexes
+    are stored by module name, and the names of the documented modules
+    are stored by document name.
+
+    :sig: (BuildEnvironment) -> Dict[str, Dict[str, Any]]
+    :param env: Build environment to get the data from.
+    :return: Signature indexes, alias indexes, and documented modules.
+    """
+    data = getattr(env, "pygenstub_data", None)
+    if data is None:
+        data = {"signatures": {}, "aliases": {}, "modules": {}}
+        env.pygenstub_data = data
+    return data
+
+
+def purge_doc(app, env, docname):
+    """Remove the data of a document from the build environment.
+
+    The indexes of the modules are kept until the build environment
+    is updated, so they can be reused when the document is read again.
+
+    :sig: (sphinx.application.Sphinx, BuildEnvironment, str) -> None
+    :param app: Sphinx application that is building the documentation.
+    :param env: Build environment to remove the data from.
+    :param docname: Name of document to remove the data of.
+    """
+    get_env_data(env)["modules"].pop(docname, None)
+
+
+def merge_info(app, env, docnames, other):
+    """Merge the data from the build environment of a parallel reader.
+
+    :sig: (sphinx.application.Sphinx, BuildEnvironment, Set[str], BuildEnvironment) -> None
+    :param app: Sphinx application that is building the documentation.
+    :param env: Build environment to merge the data into.
+    :param docnames: Names of documents that the parallel reader has read.
+    :param other: Build environment of the parallel reader.
+    """
+    data = get_env_data(env)
+    other_data = get_env_data(other)
+    for docname in docnames:
+        if docname in other_data["modules"]:
+            data["modules"][docname] = other_data["modules"][docname]
+    data["signatures"].update(other_data["signatures"])
+    data["aliases"].update(other_data["aliases"])
+
+
+def prune_indexes(app, env):
+    """Remove the indexes of the modules that are no longer documented.
+
+    :sig: (sphinx.application.Sphinx, BuildEnvironment) -> None
+    :param app: Sphinx application that is building the documentation.
+    :param env: Build environment to remove the indexes from.
+    """
+    data = get_env_data(env)
+    documented = set()
+    for modules in data["modules"].values():
+        documented |= modules
+    for indexes in (data["signatures"], data["aliases"]):
+        for module_name in set(indexes) - documented:
+            del indexes[module_name]
+
+
+def process_docstring(app, what, name, obj, options, lines):
+    """Modify the docstring before generating documentation.
+
+    This will insert type declarations for parameters and return type
+    into the docstring, and remove the signature field so that it will
+    be excluded from the generated document.
+    """
+    import inspect
+    import textwrap
+
+    data = get_env_data(app.env)
+    docname = app.env.docname
+
+    sig_marker = ":" + SIG_FIELD + ":"
+    is_class = what in ("class", "exception")
+
+    # the signature of a property is in the docstring of its getter
+    if isinstance(obj, property):
+        obj = obj.fget
+
+    module_name = getattr(obj, "__module__", None)
+    qualname = getattr(obj, "__qualname__", None)
+    signatures = None
+    if (module_name is not None) and (qualname is not None):
+        signatures = get_signature_index(module_name, data["signatures"])
+        data["modules"].setdefault(docname, set()).add(module_name)
+    signature = None
+    if signatures is not None:
+        signature = signatures.get(qualname)
+    if signature is None:
+        # the module might not define the object, like a re-exported one
+        signature = extract_signature("\n".join(lines))
+
+    if is_class:
+        init_method = getattr(obj, "__init__")
+
+    if signature is None:
+        if not is_class:
+            return
+
+        if signatures is not None:
+            signature = signatures.get(qualname + ".__init__")
+
+        # the docstring of the class might already contain the one of the method
+        if not any(line.startswith(sig_marker) for line in lines):
+            init_doc = init_method.__doc__
+            if (init_doc is None) or (sig_marker not in init_doc):
+                return
+            init_lines = init_doc.splitlines()[1:]
+            if len(init_lines) > 1:
+                init_doc = textwrap.dedent("\n".join(init_lines[1:]))
+                init_lines = init_doc.splitlines()
+
+            sig_started = False
+            for line in init_lines:
+                if line.lstrip().startswith(sig_marker):
+                    sig_started = True
+                if sig_started:
+                    lines.append(line)
+
+        if signature is None:
+            signature = extract_signature("\n".join(lines))
+            if signature is None:
+                return
+
+    if is_class:
+        obj = init_method
+
+    param_types, rtype, _, _ = parse_signature(signature)
+    param_names = [p for p in inspect.signature(obj).parameters]
+
+    if is_class and (param_names[0] == "self"):
+        del param_names[0]
+
+    # if something goes wrong, don't insert parameter types
+    if len(param_names) == len(param_types):
+        aliases = None
+        if module_name is not None:
+            aliases = get_alias_index(module_name, data["aliases"])
+        if aliases is None:
+            aliases = {}
+        for name, type_ in zip(param_names, param_types):
+            find = ":param %(name)s:" % {"name": name}
+            alias = aliases.get(type_)
+            if alias is not None:
+                type_ = "*%(type)s* :sup:`%(alias)s`" % {"type": type_, "alias": alias}
+            for i, line in enumerate(lines):
+                if line.startswith(find):
+                    lines.insert(i, ":type %(name)s: %(type)s" % {"name": name, "type": type_})
+                    break
+
+    if not is_class:
+        for i, line in enumerate(lines):
+            if line.startswith((":return:", ":returns:")):
+                lines.insert(i, ":rtype: " + rtype)
+                break
+
+    # remove the signature field
+    sig_start = 0
+    while sig_start < len(lines):
+        if lines[sig_start].startswith(sig_marker):
+            break
+        sig_start += 1
+    sig_end = sig_start + 1
+    while sig_end < len(lines):
+        if (not lines[sig_end]) or (lines[sig_end][0] != " "):
+            break
+        sig_end += 1
+    for i in reversed(range(sig_start, sig_end)):
+        del lines[i]
+
+
+def setup(app):
+    """Register the Sphinx extension.
+
+    The extension can read and write the documents in parallel.
+
+    :sig: (sphinx.application.Sphinx) -> Dict[str, Any]
+    :param app: Sphinx application to register this extension with.
+    :return: Information about this extension.
+    """
+    app.connect("autodoc-process-docstring", process_docstring)
+    app.connect("env-purge-doc", purge_doc)
+    app.connect("env-merge-info", merge_info)
+    app.connect("env-updated", prune_indexes)
+    return {"version": __version__, "parallel_read_safe": True, "parallel_write_safe": True}
+
+
+def _run(arguments, cache):
+    """Generate the stubs as requested on the command line.
+
+    :sig: (argparse.Namespace, Optional[StubCache]) -> None
+    :param arguments: Parsed command line arguments.
+    :param cache: Cache to get the stubs from, or to store them in.
+    """
+    failed = False
+    results = generate_stubs(
+        arguments.source,
+        output_dir=arguments.output_dir,
+        jobs=arguments.jobs,
+        manifest_path=arguments.manifest,
+        force=arguments.force,
+        cache=cache,
+        engine=arguments.engine,
+    )
+    for source_path, _, error in results:
+        if error is not None:
+            print("%(s)s: %(e)s" % {"s": source_path, "e": error}, file=sys.stderr)
+            failed = True
+
+    if arguments.watch:
+        results = watch_stubs(
+            arguments.source,
+            output_dir=arguments.output_dir,
+            manifest_path=arguments.manifest,
+            cache=cache,
+            engine=arguments.engine,
+        )
+        try:
+            for source_path, _, error in results:
+                if error is not None:
+                    print("%(s)s: %(e)s" % {"s": source_path, "e": error}, file=sys.stderr)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if failed:
+        sys.exit(1)
+
+
+def main(argv=None):
+    """Entry point of the command-line utility.
+
+    :sig: (Optional[List[str]]) -> None
+    :param argv: Command line arguments.
+    """
+    from argparse import ArgumentParser
+
+    argv = argv if argv is not None else sys.argv
+    parser = ArgumentParser(prog="pygenstub")
+    parser.add_argument("--version", action="version", version="%(prog)s " + __version__)
+
+    parser.add_argument("source", nargs="*", help="source file or package directory")
+    parser.add_argument("-o", "--output-dir", help="write the stub files under this directory")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of worker processes (0 for the number of CPUs, default: 1)",
+    )
+    parser.add_argument(
+        "--manifest",
+        metavar="FILE",
+        help="record the state of the sources in this file and skip the unchanged ones",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="regenerate all stubs, ignoring the manifest"
+    )
+    parser.add_argument(
+        "--cache-dir", metavar="DIR", help="reuse stubs from this shared cache directory"
+    )
+    parser.add_argument(
+        "--cache-max-size",
+        metavar="MB",
+        type=int,
+        help="remove least recently used cache entries above this size",
+    )
+    parser.add_argument(
+        "--cache-stats", action="store_true", help="print statistics about the cache and exit"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="ast",
+        help="engine for processing the sources (default: ast); the tokens engine uses"
+        " less memory on very large sources",
+    )
+    parser.add_argument(
+        "--watch", action="store_true", help="keep regenerating stubs when sources change"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="report the time spent in every stage for every file (implies --jobs 1)",
+    )
+    parser.add_argument(
+        "--profile-limit",
+        metavar="N",
+        type=int,
+        default=PROFILE_LIMIT,
+        help="number of slowest docstrings to report (default: %d)" % PROFILE_LIMIT,
+    )
+    parser.add_argument(
+        "--profile-output", metavar="FILE", help="also write cProfile statistics to this file"
+    )
+    parser.add_argument("--debug", action="store_true", help="enable debug messages")
+    arguments = parser.parse_args(argv[1:])
+    if arguments.jobs < 0:
+        parser.error("number of jobs can't be negative")
+
+    cache = None
+    if arguments.cache_dir is not None:
+        max_size = arguments.cache_max_size
+        if max_size is not None:
+            max_size *= 1024 * 1024
+        cache = StubCache(arguments.cache_dir, max_size=max_size)
+
+    if arguments.cache_stats:
+        if cache is None:
+            parser.error("the following arguments are required: --cache-dir")
+        for name, value in sorted(cache.stats().items()):
+            if name not in {"hits", "misses"}:
+                print("%(n)s: %(v)s" % {"n": name, "v": value})
+        return
+
+    if len(arguments.source) == 0:
+        parser.error("the following arguments are required: source")
+
+    # set debug mode
+    if arguments.debug:
+        logging.basicConfig(level=logging.DEBUG)
+        _logger.debug("running in debug mode")
+
+    profiling = arguments.profile or (arguments.profile_output is not None)
+    if not profiling:
+        _run(arguments, cache)
+        return
+
+    # the statistics are collected in this process
+    arguments.jobs = 1
+    profile = start_profile()
+    profiler = None
+    if arguments.profile_output is not None:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        _run(arguments, cache)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(arguments.profile_output)
+        stop_profile()
+        print(profile.report(limit=arguments.profile_limit), file=sys.stderr)
 
 
 if __name__ == "__main__":
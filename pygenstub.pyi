@@ -1,45 +1,185 @@
 # THIS FILE IS AUTOMATICALLY GENERATED, DO NOT EDIT MANUALLY.
 
-from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
 from collections import OrderedDict
 
+import argparse
 import ast
 import docutils.nodes
+import docutils.parsers.rst
+import docutils.readers.standalone
+import docutils.writers.null
+import optparse
 import sphinx.application
+import sphinx.environment
 
 Document = docutils.nodes.document
+StubResult = Tuple[str, Optional[str], Optional[str]]
+FileState = Dict[str, Any]
+Token = Tuple[int, str, Tuple[int, int], Tuple[int, int], str]
+TypeToken = Tuple[str, str, int, int]
+ModuleIndex = Tuple[Tuple[str, float], Optional[Dict[str, str]]]
+BuildEnvironment = sphinx.environment.BuildEnvironment
 
 __version__ = ...  # type: str
 SIG_FIELD = ...  # type: str
 SIG_COMMENT = ...  # type: str
 SIG_ALIAS = ...  # type: str
 DECORATORS = ...  # type: Set[str]
+TYPING_ADDITIONS = ...  # type: Dict[str, Tuple[int, int]]
+KNOWN_MODULES = ...  # type: Tuple[str, ...]
+CACHE_SIZE = ...  # type: int
+ENGINES = ...  # type: Tuple[str, str]
+WATCH_INTERVAL = ...  # type: float
+WATCH_DELAY = ...  # type: float
+PROFILE_STAGES = ...  # type: Tuple[str, ...]
+PROFILE_LIMIT = ...  # type: int
+_MISSING = ...  # type: object
+docstring_cache = ...  # type: LRUCache
+signature_cache = ...  # type: LRUCache
+type_cache = ...  # type: LRUCache
+_profile = ...  # type: Optional[Profile]
+_docstring_parser = ...  # type: Optional[DocstringParser]
+_NO_NAMES = ...  # type: FrozenSet[str]
+_type_resolver = ...  # type: Optional[TypeResolver]
 
+def _intern(string: str) -> str: ...
+
+class LRUCache:
+    maxsize = ...  # type: Optional[int]
+    hits = ...  # type: int
+    misses = ...  # type: int
+    _items = ...  # type: OrderedDict[Hashable, Any]
+    def __init__(self, maxsize: Optional[int] = ...) -> None: ...
+    def __len__(self) -> int: ...
+    def fetch(self, key: Hashable, compute: Callable[[Hashable], Any]) -> Any: ...
+    def resize(self, maxsize: Optional[int]) -> None: ...
+    def clear(self) -> None: ...
+
+def set_cache_size(maxsize: Optional[int]) -> None: ...
+def clear_caches() -> None: ...
+
+class Profile:
+    files = ...  # type: OrderedDict[str, Dict[str, float]]
+    docstrings = ...  # type: List[Tuple[float, str, str]]
+    _path = ...  # type: str
+    _times = ...  # type: Optional[Dict[str, float]]
+    _nested = ...  # type: float
+    def __init__(self) -> None: ...
+    def start_file(self, path: str) -> None: ...
+    def add_time(self, stage: str, seconds: float) -> None: ...
+    def add_processing_time(self, seconds: float) -> None: ...
+    def add_docstring(self, qualname: str, seconds: float) -> None: ...
+    def iter_timed(self, stage: str, items: Iterator[str]) -> Iterator[str]: ...
+    def get_slowest_docstrings(
+        self, limit: int = ...
+    ) -> List[Tuple[float, str, str]]: ...
+    def report(self, limit: int = ...) -> str: ...
+
+def start_profile() -> Profile: ...
+def stop_profile() -> Optional[Profile]: ...
+
+class DocstringParser:
+    reader = ...  # type: docutils.readers.standalone.Reader
+    parser = ...  # type: docutils.parsers.rst.Parser
+    writer = ...  # type: docutils.writers.null.Writer
+    settings = ...  # type: optparse.Values
+    def __init__(self) -> None: ...
+    def parse(self, text: str) -> Document: ...
+
+def get_docstring_parser() -> DocstringParser: ...
 def get_fields(
     node: Document, fields_tag: Optional[str] = ...
 ) -> Dict[str, str]: ...
+def scan_fields(docstring: str) -> Optional[Dict[str, str]]: ...
 def extract_signature(docstring: str) -> Optional[str]: ...
+def _extract_signature(docstring: str) -> Optional[str]: ...
 def get_signature(
     node: Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef]
 ) -> Optional[str]: ...
+
+class TypeExpression(tuple):
+    def __new__(
+        cls,
+        text: str,
+        name: Optional[str] = ...,
+        args: Sequence[TypeExpression] = ...,
+    ) -> TypeExpression: ...
+    @property
+    def text(self) -> str: ...
+    @property
+    def name(self) -> Optional[str]: ...
+    @property
+    def args(self) -> Tuple[TypeExpression, ...]: ...
+    @property
+    def requires(self) -> FrozenSet[str]: ...
+    @property
+    def namespaces(self) -> FrozenSet[str]: ...
+    def __repr__(self) -> str: ...
+
+def tokenize_type(text: str) -> List[TypeToken]: ...
+def get_values_start(name: str) -> Optional[int]: ...
+def _parse_type_tokens(
+    text: str, tokens: List[TypeToken], i: int, literal: bool = ...
+) -> Tuple[TypeExpression, int]: ...
+def _parse_type_operand(
+    text: str, tokens: List[TypeToken], i: int, literal: bool = ...
+) -> Tuple[TypeExpression, int]: ...
+def _parse_string_tokens(
+    text: str, tokens: List[TypeToken], i: int, literal: bool
+) -> Tuple[TypeExpression, int]: ...
+def _parse_type_list(
+    text: str,
+    tokens: List[TypeToken],
+    i: int,
+    closing: str,
+    values_start: Optional[int] = ...,
+) -> Tuple[List[TypeExpression], int]: ...
+def parse_type(expression: str) -> TypeExpression: ...
+def _parse_type(expression: str) -> TypeExpression: ...
+def _parse_plain_type(expression: str) -> Optional[TypeExpression]: ...
+def _parse_type_text(
+    expression: str, literal: bool = ...
+) -> TypeExpression: ...
+def _parse_opaque_type(expression: str) -> Optional[TypeExpression]: ...
 def split_parameter_types(parameters: str) -> List[str]: ...
-def parse_signature(signature: str) -> Tuple[List[str], str, Set[str]]: ...
+def parse_signature(
+    signature: str
+) -> Tuple[Optional[Tuple[str, ...]], str, FrozenSet[str], FrozenSet[str]]: ...
+def _parse_signature(
+    signature: str
+) -> Tuple[Optional[Tuple[str, ...]], str, FrozenSet[str], FrozenSet[str]]: ...
 
-class StubNode:
-    variables = ...  # type: List[VariableNode]
-    children = ...  # type: List[Union[FunctionNode, ClassNode]]
+class StubNode(object):
+    variables = ...  # type: Sequence[VariableNode]
+    children = ...  # type: Sequence[Union[FunctionNode, ClassNode]]
     parent = ...  # type: Optional[StubNode]
     def __init__(self) -> None: ...
     def add_variable(self, node: VariableNode) -> None: ...
     def add_child(self, node: Union[FunctionNode, ClassNode]) -> None: ...
     def get_code(self) -> List[str]: ...
+    def iter_code(self, indent: str = ...) -> Iterator[str]: ...
 
 class VariableNode(StubNode):
     name = ...  # type: str
     type_ = ...  # type: str
     def __init__(self, name: str, type_: str) -> None: ...
-    def get_code(self) -> List[str]: ...
+    def iter_code(self, indent: str = ...) -> Iterator[str]: ...
 
 class FunctionNode(StubNode):
     name = ...  # type: str
@@ -54,7 +194,7 @@ class FunctionNode(StubNode):
         rtype: str,
         decorators: Optional[Sequence[str]] = ...,
     ) -> None: ...
-    def get_code(self) -> List[str]: ...
+    def iter_code(self, indent: str = ...) -> Iterator[str]: ...
 
 class ClassNode(StubNode):
     name = ...  # type: str
@@ -63,32 +203,304 @@ class ClassNode(StubNode):
     def __init__(
         self, name: str, bases: Sequence[str], signature: Optional[str] = ...
     ) -> None: ...
-    def get_code(self) -> List[str]: ...
+    def iter_code(self, indent: str = ...) -> Iterator[str]: ...
+
+class CommentIndex:
+    signatures = ...  # type: Dict[int, str]
+    aliases = ...  # type: OrderedDict[str, str]
+    def __init__(self, source: str) -> None: ...
+    def add_comment(self, token: Token) -> None: ...
+    def find_signature(self, first_line: int, last_line: int) -> Optional[str]: ...
 
 def get_aliases(lines: Sequence[str]) -> Dict[str, str]: ...
 
+class StubObserver:
+    def file_started(self, path: str, size: int) -> None: ...
+    def file_finished(self, path: str, seconds: float, size: int) -> None: ...
+    def docstring_parsed(
+        self, qualname: str, seconds: float, size: int
+    ) -> None: ...
+    def cache_hit(self, key: str, seconds: float, size: int) -> None: ...
+    def cache_miss(self, key: str, seconds: float, size: int) -> None: ...
+    def unknown_type(self, name: str) -> None: ...
+    def stub_written(self, path: str, seconds: float, size: int) -> None: ...
+
+class TypeResolver:
+    target_version = ...  # type: Tuple[int, int]
+    builtins = ...  # type: FrozenSet[str]
+    _modules = ...  # type: Dict[str, str]
+    _registered = ...  # type: Dict[str, str]
+    def __init__(
+        self, target_version: Optional[Tuple[int, int]] = ...
+    ) -> None: ...
+    def register_module(
+        self, module_: str, names: Optional[Iterable[str]] = ...
+    ) -> None: ...
+    def copy(self) -> TypeResolver: ...
+    def get_module_names(self, module_: str) -> List[str]: ...
+    def get_module(self, name: str) -> Optional[str]: ...
+    def get_registered_names(self, source: str) -> Dict[str, str]: ...
+    def get_changed_names(self, other: TypeResolver) -> Set[str]: ...
+
+def get_type_resolver() -> TypeResolver: ...
+
 class StubGenerator(ast.NodeVisitor):
     root = ...  # type: StubNode
+    observer = ...  # type: Optional[StubObserver]
+    resolver = ...  # type: TypeResolver
     imported_names = ...  # type: OrderedDict[str, str]
     defined_types = ...  # type: Set[str]
     required_types = ...  # type: Set[str]
+    required_namespaces = ...  # type: Set[str]
     aliases = ...  # type: OrderedDict[str, str]
+    comments = ...  # type: CommentIndex
     _parents = ...  # type: List[StubNode]
     _code_lines = ...  # type: List[str]
-    def __init__(self, source: str) -> None: ...
+    _declaration_lines = ...  # type: List[int]
+    def __init__(
+        self,
+        source: str,
+        observer: Optional[StubObserver] = ...,
+        resolver: Optional[TypeResolver] = ...,
+    ) -> None: ...
+    def process(self, source: str) -> None: ...
+    def process_tree(self, ast_tree: ast.Module, source: str) -> None: ...
     def collect_aliases(self) -> None: ...
+    def visit_body(self, node: ast.AST) -> None: ...
     def visit_ImportFrom(self, node: ast.ImportFrom) -> None: ...
     def visit_Assign(self, node: ast.Assign) -> None: ...
+    def get_node_signature(
+        self, node: Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef]
+    ) -> Optional[str]: ...
     def get_function_node(
         self, node: Union[ast.FunctionDef, ast.AsyncFunctionDef]
-    ) -> FunctionNode: ...
+    ) -> Optional[FunctionNode]: ...
     def visit_FunctionDef(self, node: ast.FunctionDef) -> None: ...
     def visit_AsyncFunctionDef(self, node: ast.AsyncFunctionDef) -> None: ...
+    def get_class_node(self, node: ast.ClassDef) -> ClassNode: ...
     def visit_ClassDef(self, node: ast.ClassDef) -> None: ...
     @staticmethod
     def generate_import(module_: str, names: Set[str]) -> str: ...
     def generate_stub(self) -> str: ...
+    def iter_stub(self) -> Iterator[str]: ...
+
+def may_have_stub(source: Union[str, bytes]) -> bool: ...
+
+class UnsupportedSourceError(ValueError): ...
+
+class TokenStubGenerator(StubGenerator):
+    _blocks = ...  # type: List[str]
+    _header = ...  # type: Optional[Tuple[int, int, int]]
+    _decorator_line = ...  # type: Optional[int]
+    def process(self, source: str) -> None: ...
+    @staticmethod
+    def generate_tokens(read_line: Callable[[], str]) -> Iterator[Token]: ...
+    def start_block(self) -> None: ...
+    def end_block(self) -> None: ...
+    def parse_statement(
+        self, first_line: int, last_line: int, extra: str = ...
+    ) -> ast.stmt: ...
+    def process_header(self, docstring_line: Optional[int] = ...) -> None: ...
+    def process_line(self, tokens: List[Token], last_line: int) -> None: ...
+
+def iter_stub(
+    source: str,
+    engine: str = ...,
+    observer: Optional[StubObserver] = ...,
+    resolver: Optional[TypeResolver] = ...,
+) -> Iterator[str]: ...
+def get_stub(
+    source: str,
+    engine: str = ...,
+    observer: Optional[StubObserver] = ...,
+    resolver: Optional[TypeResolver] = ...,
+) -> str: ...
+def walk_directory(path: str) -> Iterator[Tuple[str, List[str]]]: ...
+def find_sources(
+    paths: Sequence[str], output_dir: Optional[str] = ...
+) -> List[Tuple[str, str]]: ...
+def make_dirs(path: str) -> None: ...
+def generate_stub_file(
+    source_path: str,
+    stub_path: str,
+    cache: Optional[StubCache] = ...,
+    engine: str = ...,
+    observer: Optional[StubObserver] = ...,
+    resolver: Optional[TypeResolver] = ...,
+) -> bool: ...
+def _iter_stub(
+    source: str,
+    cache: Optional[StubCache],
+    engine: str,
+    observer: Optional[StubObserver],
+    resolver: Optional[TypeResolver],
+) -> Iterator[str]: ...
+def write_atomic(path: str, text: str) -> None: ...
+def get_file_hash(path: str) -> str: ...
+def get_module_name(source_path: str) -> str: ...
+def read_source(path: str) -> str: ...
+def collect_symbols(source: str) -> List[str]: ...
+def get_dependencies(
+    source_path: str, resolver: TypeResolver
+) -> Dict[str, Any]: ...
+def get_package_resolver(
+    sources: List[Tuple[str, str]], manifest: Optional[Manifest] = ...
+) -> TypeResolver: ...
+
+class Manifest:
+    path = ...  # type: str
+    entries = ...  # type: Dict[str, FileState]
+    _base_dir = ...  # type: str
+    def __init__(self, path: str) -> None: ...
+    def get_key(self, source_path: str) -> str: ...
+    def check(
+        self, source_path: str, stub_path: str
+    ) -> Tuple[bool, FileState]: ...
+    def check_dependencies(
+        self, source_path: str, resolver: TypeResolver
+    ) -> bool: ...
+    def get_symbols(self, source_path: str) -> Optional[List[str]]: ...
+    def update(self, source_path: str, state: FileState) -> None: ...
+    def discard(self, source_path: str) -> None: ...
+    def save(self) -> None: ...
+
+class StubCache:
+    directory = ...  # type: str
+    max_size = ...  # type: Optional[int]
+    hits = ...  # type: int
+    misses = ...  # type: int
+    _size = ...  # type: Optional[int]
+    def __init__(self, directory: str, max_size: Optional[int] = ...) -> None: ...
+    def get_key(
+        self, source: str, settings: Optional[Dict[str, Any]] = ...
+    ) -> str: ...
+    def get_path(self, key: str) -> str: ...
+    def get(self, key: str) -> Optional[str]: ...
+    def put(self, key: str, stub: str) -> None: ...
+    def get_stub_key(
+        self, source: str, resolver: Optional[TypeResolver] = ..., **settings
+    ) -> str: ...
+    def get_stub(
+        self,
+        source: str,
+        observer: Optional[StubObserver] = ...,
+        resolver: Optional[TypeResolver] = ...,
+        **settings,
+    ) -> str: ...
+    def _get_entries(self) -> List[Tuple[float, int, str]]: ...
+    def evict(self) -> None: ...
+    def clear(self) -> None: ...
+    def stats(self) -> Dict[str, Optional[int]]: ...
+
+def _generate_stub_result(
+    task: Tuple[str, str, Optional[StubCache], str, Optional[StubObserver],
+Optional[TypeResolver]],
+) -> StubResult: ...
+def _init_worker(resolver: Optional[TypeResolver] = ...) -> None: ...
+def generate_stubs(
+    paths: Sequence[str],
+    output_dir: Optional[str] = ...,
+    jobs: int = ...,
+    manifest_path: Optional[str] = ...,
+    force: bool = ...,
+    cache: Optional[StubCache] = ...,
+    engine: str = ...,
+    observer: Optional[StubObserver] = ...,
+) -> Iterator[StubResult]: ...
+def _generate_stubs(
+    sources: List[Tuple[str, str]],
+    jobs: int,
+    manifest_path: Optional[str],
+    force: bool,
+    cache: Optional[StubCache],
+    engine: str,
+    observer: Optional[StubObserver],
+    resolver: Optional[TypeResolver] = ...,
+) -> Iterator[StubResult]: ...
+def _generate_stub_results(
+    sources: List[Tuple[str, str]],
+    jobs: int,
+    cache: Optional[StubCache],
+    engine: str,
+    observer: Optional[StubObserver],
+    resolver: Optional[TypeResolver],
+) -> Iterator[StubResult]: ...
+
+class PollingMonitor:
+    interval = ...  # type: float
+    def __init__(self, interval: float = ...) -> None: ...
+    def watch(self, directories: Iterable[str]) -> None: ...
+    def wait(self, timeout: Optional[float] = ...) -> bool: ...
+    def close(self) -> None: ...
+
+class INotifyMonitor:
+    _watched = ...  # type: Set[str]
+    def __init__(self) -> None: ...
+    def watch(self, directories: Iterable[str]) -> None: ...
+    def wait(self, timeout: Optional[float] = ...) -> bool: ...
+    def close(self) -> None: ...
+
+def get_monitor() -> Union[INotifyMonitor, PollingMonitor]: ...
+def get_watched_directories(paths: Sequence[str]) -> List[str]: ...
+def get_source_states(
+    sources: List[Tuple[str, str]]
+) -> Dict[str, Tuple[float, int]]: ...
+def find_dependents(
+    sources: List[Tuple[str, str]],
+    changed: List[Tuple[str, str]],
+    names: Set[str],
+) -> List[Tuple[str, str]]: ...
+def watch_stubs(
+    paths: Sequence[str],
+    output_dir: Optional[str] = ...,
+    manifest_path: Optional[str] = ...,
+    cache: Optional[StubCache] = ...,
+    monitor: Optional[Union[INotifyMonitor, PollingMonitor]] = ...,
+    delay: float = ...,
+    engine: str = ...,
+    observer: Optional[StubObserver] = ...,
+) -> Iterator[StubResult]: ...
+
+class SignatureIndex(StubGenerator):
+    signatures = ...  # type: Dict[str, str]
+    def __init__(self, source: str) -> None: ...
+    def get_qualname(
+        self, node: Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef]
+    ) -> str: ...
+    def visit_Assign(self, node: ast.Assign) -> None: ...
+    def get_function_node(
+        self, node: Union[ast.FunctionDef, ast.AsyncFunctionDef]
+    ) -> None: ...
+    def get_class_node(self, node: ast.ClassDef) -> ClassNode: ...
 
-def get_stub(source: str) -> str: ...
-def setup(app: sphinx.application.Sphinx) -> Dict[str, str]: ...
+def get_module_index(
+    module_name: str,
+    indexes: Dict[str, ModuleIndex],
+    collect: Callable[[str], Dict],
+) -> Optional[Dict[str, str]]: ...
+def collect_signatures(source: str) -> Dict[str, str]: ...
+def collect_aliases(source: str) -> Dict[str, str]: ...
+def get_signature_index(
+    module_name: str, indexes: Dict[str, ModuleIndex]
+) -> Optional[Dict[str, str]]: ...
+def get_alias_index(
+    module_name: str, indexes: Dict[str, ModuleIndex]
+) -> Optional[Dict[str, str]]: ...
+def get_env_data(env: BuildEnvironment) -> Dict[str, Dict[str, Any]]: ...
+def purge_doc(
+    app: sphinx.application.Sphinx, env: BuildEnvironment, docname: str
+) -> None: ...
+def merge_info(
+    app: sphinx.application.Sphinx,
+    env: BuildEnvironment,
+    docnames: Set[str],
+    other: BuildEnvironment,
+) -> None: ...
+def prune_indexes(
+    app: sphinx.application.Sphinx, env: BuildEnvironment
+) -> None: ...
+def setup(app: sphinx.application.Sphinx) -> Dict[str, Any]: ...
+def _run(
+    arguments: argparse.Namespace, cache: Optional[StubCache]
+) -> None: ...
 def main(argv: Optional[List[str]] = ...) -> None: ...
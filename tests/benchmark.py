@@ -0,0 +1,455 @@
+"""Benchmarks for the stages of stub generation.
+
+The fixtures are synthetic modules of different shapes, and a frozen copy
+of the source of pygenstub 1.2.4, which doesn't change with the code
+being measured. Every stage is timed separately, taking the best
+of a number of runs. The times are stored relative to the time of a fixed
+calibration workload, so that a baseline recorded on one machine can be
+compared against the times on another one. This only roughly normalizes
+the times: the stages don't scale like the calibration workload
+across machines and Python versions, so only large slowdowns
+are reported as regressions.
+
+Run ``python tests/benchmark.py`` to print the stage times and compare them
+against the baseline, and ``python tests/benchmark.py --update-baseline``
+to store the current times as the new baseline.
+"""
+
+from __future__ import division, print_function
+
+import ast
+import gc
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import pygenstub
+
+
+timer = getattr(time, "perf_counter", time.time)
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BASE_DIR, "benchmark_baseline.json")
+MODULE_PATH = os.path.join(BASE_DIR, "benchmark_pygenstub.py")
+
+STAGES = ["read", "parse", "extract_signature", "parse_signature", "visit", "generate_stub"]
+
+REPEATS = 5
+
+# allowed slowdown relative to the baseline, stage times vary up to 3x between machines
+THRESHOLD = 2.0
+
+# slowdowns smaller than this many seconds are considered noise
+MIN_DIFFERENCE = 0.002
+
+# allowed growth of the stub tree size relative to the baseline
+MEMORY_THRESHOLD = 0.1
+
+TYPES = [
+    "int",
+    "str",
+    "bytes",
+    "float",
+    "bool",
+    "None",
+    "List[int]",
+    "Dict[str, int]",
+    "Optional[str]",
+    "Tuple[int, str]",
+    "Callable[[int], str]",
+]
+
+FILLER = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor"
+    " incididunt ut labore et dolore magna aliqua ut enim ad minim veniam quis nostrud"
+).split()
+
+CALIBRATION_SOURCE = "\n".join(
+    "def f%d(a, b=%d):\n    return [x * b for x in range(a) if x %% 2]\n" % (i, i)
+    for i in range(200)
+)
+
+
+def generate_docstring(rng, summary, lines, indent, signature=None, sections=False):
+    text = [summary, ""]
+    for _ in range(lines):
+        text.append(" ".join(rng.choice(FILLER) for _ in range(8)))
+    if signature is not None:
+        text.extend(["", ":sig: " + signature])
+    if sections:
+        # section titles can't be handled without docutils
+        text.extend(["", "Examples", "--------", "", ">>> pass"])
+    text.append('"""')
+    body = [(indent + line) if line else "" for line in text[1:]]
+    return "\n".join([indent + '"""' + text[0]] + body)
+
+
+def generate_function(rng, name, indent, types, docstring_lines, signed, sections, method):
+    params = ["a%d" % i for i in range(rng.randint(0, 4))]
+    signature = None
+    if signed:
+        param_types = ", ".join(rng.choice(types) for _ in params)
+        signature = "(%s) -> %s" % (param_types, rng.choice(types))
+    if method:
+        params.insert(0, "self")
+    lines = ["%sdef %s(%s):" % (indent, name, ", ".join(params))]
+    body = indent + "    "
+    summary = "Do %s." % name.replace("_", " ")
+    lines.append(generate_docstring(rng, summary, docstring_lines, body, signature, sections))
+    lines.append("%sresult = %d" % (body, rng.randint(0, 100)))
+    lines.append("%sfor i in range(10):" % body)
+    lines.append("%s    if i %% 3 == 0:" % body)
+    lines.append("%s        result += i" % body)
+    lines.append("%sreturn result" % body)
+    return "\n".join(lines)
+
+
+def generate_module(
+    functions=50,
+    classes=10,
+    methods=5,
+    docstring_lines=3,
+    signature_ratio=1.0,
+    aliases=0,
+    sections=False,
+    seed=0,
+):
+    """Generate the source code of a synthetic module.
+
+    :param functions: Number of module level functions.
+    :param classes: Number of classes.
+    :param methods: Number of methods in every class.
+    :param docstring_lines: Number of description lines in every docstring.
+    :param signature_ratio: Ratio of the functions and attributes that have signatures.
+    :param aliases: Number of type aliases.
+    :param sections: Whether the docstrings contain section titles.
+    :param seed: Seed for the random choices.
+    :return: Generated source code.
+    """
+    rng = random.Random(seed)
+    types = TYPES + ["Alias%d" % i for i in range(aliases)]
+
+    def signed():
+        return rng.random() < signature_ratio
+
+    chunks = ['"""Synthetic module for benchmarks."""']
+    chunks.append("from typing import Callable, Dict, List, Optional, Tuple")
+    if aliases > 0:
+        chunks.append(
+            "\n".join(
+                "# sigalias: Alias%d = %s" % (i, rng.choice(TYPES[6:])) for i in range(aliases)
+            )
+        )
+
+    constants = []
+    for i in range(functions // 5):
+        comment = ("  # sig: " + rng.choice(TYPES[:4])) if signed() else ""
+        constants.append("CONSTANT_%d = %d%s" % (i, i, comment))
+    chunks.append("\n".join(constants))
+
+    for i in range(functions):
+        chunks.append(
+            generate_function(
+                rng, "function_%d" % i, "", types, docstring_lines, signed(), sections, False
+            )
+        )
+
+    for i in range(classes):
+        lines = ["class Class%d(object):" % i]
+        summary = "A synthetic class."
+        lines.append(generate_docstring(rng, summary, docstring_lines, "    "))
+        lines.append("")
+        comment = ("  # sig: " + rng.choice(types)) if signed() else ""
+        lines.append("    attribute = None%s" % comment)
+        for j in range(methods):
+            lines.append("")
+            name = "method_%d" % j
+            lines.append(
+                generate_function(
+                    rng, name, "    ", types, docstring_lines, signed(), sections, True
+                )
+            )
+        chunks.append("\n".join(lines))
+
+    return "\n\n\n".join(chunks) + "\n"
+
+
+def get_module_source():
+    with open(MODULE_PATH, "rb") as f:
+        return f.read().decode("utf-8")
+
+
+FIXTURES = {
+    "small": lambda: generate_module(functions=20, classes=2),
+    "large": lambda: generate_module(functions=1000, classes=100, methods=10),
+    "sparse": lambda: generate_module(functions=500, classes=50, signature_ratio=0.1),
+    "long_docstrings": lambda: generate_module(
+        functions=200, classes=10, docstring_lines=40, sections=True
+    ),
+    "aliases": lambda: generate_module(functions=200, classes=20, aliases=50),
+    "pygenstub": get_module_source,
+}
+
+
+def get_best_time(func, repeats=REPEATS, setup=None):
+    """Get the best time of a number of runs of a function, in seconds.
+
+    Like in :mod:`timeit`, garbage collection is disabled during the runs.
+    """
+    best = None
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeats):
+            if setup is not None:
+                setup()
+            start = timer()
+            func()
+            elapsed = timer() - start
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        if enabled:
+            gc.enable()
+    return best
+
+
+def calibrate(repeats=REPEATS):
+    """Get the time of the calibration workload, in seconds."""
+    return get_best_time(lambda: list(ast.walk(ast.parse(CALIBRATION_SOURCE))), 4 * repeats)
+
+
+def collect_signatures(ast_tree, source):
+    """Collect the docstrings and the signatures in a source."""
+    docstrings = []
+    for node in ast.walk(ast_tree):
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            docstring = ast.get_docstring(node)
+            if docstring is not None:
+                docstrings.append(docstring)
+    signatures = [pygenstub.extract_signature(d) for d in docstrings]
+    signatures = [s for s in signatures if s is not None]
+    comments = pygenstub.CommentIndex(source)
+    signatures.extend(comments.signatures.values())
+    signatures.extend(comments.aliases.values())
+    return docstrings, signatures
+
+
+def measure(path, repeats=REPEATS):
+    """Measure the time of every stage of generating the stub of a source file.
+
+    :param path: Path of the source file.
+    :param repeats: Number of runs for every stage.
+    :return: Best time of every stage, in seconds.
+    """
+
+    def read():
+        with open(path, "rb") as f:
+            return f.read().decode("utf-8")
+
+    times = {}
+    source = read()
+    times["read"] = get_best_time(read, repeats)
+
+    ast_tree = ast.parse(source)
+    times["parse"] = get_best_time(lambda: ast.parse(source), repeats)
+
+    # creating the docutils parser is a one-time cost
+    pygenstub.get_docstring_parser()
+    pygenstub.set_cache_size(None)
+    try:
+        docstrings, signatures = collect_signatures(ast_tree, source)
+
+        def extract():
+            for docstring in docstrings:
+                pygenstub.extract_signature(docstring)
+
+        def parse():
+            for signature in signatures:
+                pygenstub.parse_signature(signature)
+
+        times["extract_signature"] = get_best_time(extract, repeats, pygenstub.clear_caches)
+        times["parse_signature"] = get_best_time(parse, repeats, pygenstub.clear_caches)
+
+        # with warm caches, visiting doesn't include extracting and parsing the signatures
+        extract()
+        parse()
+
+        def visit():
+            generator = pygenstub.StubGenerator("")
+            generator.process_tree(ast_tree, source)
+            return generator
+
+        times["visit"] = get_best_time(visit, repeats)
+        times["generate_stub"] = get_best_time(visit().generate_stub, repeats)
+    finally:
+        pygenstub.set_cache_size(pygenstub.CACHE_SIZE)
+        pygenstub.clear_caches()
+    return times
+
+
+def get_deep_size(obj, seen=None):
+    """Get the size of an object and everything reachable from it, in bytes.
+
+    Objects are reached through their attributes, whether they are stored
+    in a dictionary or in slots, and through the items of lists and tuples.
+    Shared objects, like interned strings, are only counted once.
+    """
+    seen = set() if seen is None else seen
+    if (obj is None) or (id(obj) in seen):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple)):
+        size += sum(get_deep_size(item, seen) for item in obj)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+        size += sum(get_deep_size(value, seen) for value in vars(obj).values())
+    for cls in type(obj).__mro__:
+        for slot in getattr(cls, "__slots__", ()):
+            size += get_deep_size(getattr(obj, slot, None), seen)
+    return size
+
+
+def measure_memory(path):
+    """Measure the memory used by the stub tree of a source file.
+
+    :param path: Path of the source file.
+    :return: Size of the stub tree in bytes, and the number of nodes in it.
+    """
+    with open(path, "rb") as f:
+        source = f.read().decode("utf-8")
+    root = pygenstub.StubGenerator(source).root
+    nodes = 0
+    pending = [root]
+    while len(pending) > 0:
+        node = pending.pop()
+        nodes += 1
+        pending.extend(node.variables)
+        pending.extend(node.children)
+    return {"tree_size": get_deep_size(root), "nodes": nodes}
+
+
+def run_benchmarks(names=None, repeats=REPEATS):
+    """Measure the stage times and the stub tree sizes of the fixtures.
+
+    The calibration workload is timed right before every fixture,
+    so that the relative times are not affected by changes in the load
+    of the machine during the run.
+
+    :param names: Names of the fixtures to run, all fixtures if not given.
+    :param repeats: Number of runs for every stage.
+    :return: Calibration time and stage times in seconds, and the tree size
+        for every fixture.
+    """
+    names = sorted(FIXTURES) if names is None else names
+    results = {}
+    directory = tempfile.mkdtemp()
+    try:
+        for name in names:
+            path = os.path.join(directory, name + ".py")
+            with open(path, "wb") as f:
+                f.write(FIXTURES[name]().encode("utf-8"))
+            calibration = calibrate(repeats)
+            results[name] = measure(path, repeats)
+            results[name]["calibration"] = calibration
+            results[name].update(measure_memory(path))
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def get_relative_times(times):
+    return {stage: times[stage] / times["calibration"] for stage in STAGES}
+
+
+def load_baseline(path=BASELINE_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    fixtures = {}
+    for name, result in results.items():
+        fixtures[name] = get_relative_times(result)
+        fixtures[name]["tree_size"] = result["tree_size"]
+    baseline = {"python": "%d.%d" % sys.version_info[:2], "fixtures": fixtures}
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def find_regressions(results, baseline, threshold=THRESHOLD):
+    """Find the stages that got slower than the baseline by more than the threshold.
+
+    The stub tree sizes don't depend on the machine, so they are checked
+    against the baseline with the stricter :data:`MEMORY_THRESHOLD`.
+
+    :param results: Calibration time and stage times in seconds, and the tree size
+        for every fixture.
+    :param baseline: Baseline stage times for every fixture, relative to the calibration time,
+        and the baseline tree sizes.
+    :param threshold: Allowed slowdown, as a ratio of the baseline time.
+    :return: Fixture name, stage name, and slowdown ratio of every regression.
+    """
+    regressions = []
+    for name, times in sorted(results.items()):
+        expected = baseline["fixtures"].get(name, {})
+        actual = get_relative_times(times)
+        for stage in STAGES:
+            if stage not in expected:
+                continue
+            difference = (actual[stage] - expected[stage]) * times["calibration"]
+            ratio = actual[stage] / expected[stage]
+            if (ratio > 1 + threshold) and (difference > MIN_DIFFERENCE):
+                regressions.append((name, stage, ratio))
+        if ("tree_size" in expected) and ("tree_size" in times):
+            ratio = times["tree_size"] / expected["tree_size"]
+            if ratio > 1 + MEMORY_THRESHOLD:
+                regressions.append((name, "tree_size", ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("fixtures", nargs="*", help="fixtures to run (default: all)")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--update-baseline", action="store_true")
+    arguments = parser.parse_args(argv[1:] if argv is not None else sys.argv[1:])
+    unknown = set(arguments.fixtures) - set(FIXTURES)
+    if len(unknown) > 0:
+        parser.error("unknown fixtures: " + ", ".join(sorted(unknown)))
+
+    results = run_benchmarks(arguments.fixtures or None, arguments.repeats)
+    columns = ["calibration"] + STAGES
+    line_format = "%-16s" + " %17s" * len(columns)
+    print(line_format % tuple(["fixture"] + columns))
+    for name, times in sorted(results.items()):
+        row = ["%.2fms" % (times[column] * 1000) for column in columns]
+        print(line_format % tuple([name] + row))
+
+    print()
+    print("%-16s %17s %17s %17s" % ("fixture", "nodes", "tree_size", "per_node"))
+    for name, result in sorted(results.items()):
+        nodes, size = result["nodes"], result["tree_size"]
+        row = (name, nodes, "%.1fKB" % (size / 1024), "%dB" % (size // nodes))
+        print("%-16s %17s %17s %17s" % row)
+
+    if arguments.update_baseline:
+        save_baseline(results)
+        return 0
+
+    regressions = find_regressions(results, load_baseline(), arguments.threshold)
+    for name, stage, ratio in regressions:
+        print("regression: %s %s %.2fx" % (name, stage, ratio), file=sys.stderr)
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
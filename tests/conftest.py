@@ -0,0 +1,19 @@
+from pytest import fixture
+
+
+FUNCTION_CODE = 'def f(a):\n    """Do foo.\n\n    :sig: (int) -> None\n    """\n'
+
+
+@fixture
+def package(tmpdir):
+    """Package directory with some modules for testing."""
+    pkg = tmpdir.mkdir("pkg")
+    pkg.join("__init__.py").write("")
+    pkg.join("a.py").write(FUNCTION_CODE)
+    pkg.join("notes.txt").write(FUNCTION_CODE)
+    sub = pkg.mkdir("sub")
+    sub.join("__init__.py").write("")
+    sub.join("b.py").write(FUNCTION_CODE)
+    pkg.mkdir(".hidden").join("c.py").write(FUNCTION_CODE)
+    pkg.mkdir("__pycache__").join("d.py").write(FUNCTION_CODE)
+    yield pkg
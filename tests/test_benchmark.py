@@ -0,0 +1,103 @@
+from pytest import mark
+
+import ast
+import os
+import sys
+
+import benchmark
+import pygenstub
+from benchmark import FIXTURES, STAGES, find_regressions, generate_module
+
+
+# the benchmarks are slow and depend on the load of the machine
+run_benchmarks = mark.skipif(
+    os.environ.get("PYGENSTUB_BENCHMARK") is None,
+    reason="set PYGENSTUB_BENCHMARK to run the benchmarks",
+)
+
+
+def count_functions(code):
+    tree = ast.parse(code)
+    return len([n for n in ast.walk(tree) if isinstance(n, ast.FunctionDef)])
+
+
+def test_generated_module_should_have_requested_declarations():
+    code = generate_module(functions=7, classes=3, methods=2)
+    assert count_functions(code) == 13
+    assert count_functions(pygenstub.get_stub(code)) == 13
+
+
+def test_generated_module_should_have_requested_signature_ratio():
+    code = generate_module(functions=20, classes=0, signature_ratio=0.5)
+    assert 0 < count_functions(pygenstub.get_stub(code)) < 20
+
+
+def test_generated_module_should_have_requested_aliases():
+    stub = pygenstub.get_stub(generate_module(functions=5, aliases=3))
+    assert "Alias2 = " in stub
+
+
+def test_generated_module_with_sections_should_need_docutils():
+    tree = ast.parse(generate_module(functions=1, classes=0, sections=True))
+    docstring = ast.get_docstring(tree.body[-1])
+    assert pygenstub.scan_fields(docstring) is None
+    assert pygenstub.extract_signature(docstring) is not None
+
+
+def test_measure_should_time_all_stages(tmpdir):
+    path = tmpdir.join("mod.py")
+    path.write(generate_module(functions=5, classes=1))
+    times = benchmark.measure(str(path), repeats=1)
+    assert sorted(times) == sorted(STAGES)
+    assert all(t >= 0 for t in times.values())
+
+
+def test_find_regressions_should_report_slow_stages():
+    results = {"small": {"calibration": 0.01, "parse": 0.02, "visit": 0.05}}
+    baseline = {"fixtures": {"small": {"parse": 2.0, "visit": 2.0}}}
+    results["small"].update({s: 0.0 for s in STAGES if s not in results["small"]})
+    assert find_regressions(results, baseline, threshold=0.5) == [("small", "visit", 2.5)]
+
+
+def test_find_regressions_should_ignore_small_differences():
+    results = {"small": {s: 0.0002 for s in STAGES}}
+    results["small"]["calibration"] = 0.0001
+    baseline = {"fixtures": {"small": {s: 1.0 for s in STAGES}}}
+    assert find_regressions(results, baseline) == []
+
+
+def test_find_regressions_should_report_larger_stub_tree():
+    results = {"small": {s: 0.0 for s in STAGES}}
+    results["small"].update({"calibration": 0.01, "tree_size": 1200})
+    baseline = {"fixtures": {"small": {"tree_size": 1000}}}
+    assert find_regressions(results, baseline) == [("small", "tree_size", 1.2)]
+
+
+def test_deep_size_should_count_shared_objects_once():
+    item = "x" * 100
+    other = "y" * 100
+    shared = benchmark.get_deep_size([item, item])
+    separate = benchmark.get_deep_size([item, other])
+    assert separate - shared == sys.getsizeof(other)
+
+
+def test_deep_size_should_follow_slots():
+    node = pygenstub.VariableNode("x", "int")
+    assert benchmark.get_deep_size(node) > sys.getsizeof(node) + sys.getsizeof("int")
+
+
+def test_measure_memory_should_count_nodes(tmpdir):
+    path = tmpdir.join("mod.py")
+    path.write(generate_module(functions=5, classes=2, methods=3))
+    result = benchmark.measure_memory(str(path))
+    # root, constant, functions, and classes with an attribute and methods
+    assert result["nodes"] == 1 + 1 + 5 + 2 * (1 + 1 + 3)
+    assert result["tree_size"] > 0
+
+
+@run_benchmarks
+@mark.parametrize("name", sorted(FIXTURES))
+def test_stage_times_should_not_regress(name):
+    threshold = float(os.environ.get("PYGENSTUB_BENCHMARK_THRESHOLD", benchmark.THRESHOLD))
+    results = benchmark.run_benchmarks([name])
+    assert find_regressions(results, benchmark.load_baseline(), threshold) == []
@@ -0,0 +1,298 @@
+from __future__ import unicode_literals
+
+from pytest import fixture, raises
+
+import os
+
+import pygenstub
+from pygenstub import (
+    LRUCache,
+    StubCache,
+    TypeResolver,
+    extract_signature,
+    get_stub,
+    parse_signature,
+)
+
+
+@fixture
+def caches():
+    pygenstub.clear_caches()
+    yield pygenstub.docstring_cache, pygenstub.signature_cache
+    pygenstub.set_cache_size(pygenstub.CACHE_SIZE)
+    pygenstub.clear_caches()
+
+
+def test_cache_should_compute_missing_value():
+    cache = LRUCache(maxsize=2)
+    assert cache.fetch("a", str.upper) == "A"
+    assert (cache.hits, cache.misses, len(cache)) == (0, 1, 1)
+
+
+def test_cache_should_not_compute_stored_value():
+    cache = LRUCache(maxsize=2)
+    cache.fetch("a", str.upper)
+    assert cache.fetch("a", lambda k: "X") == "A"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_cache_should_evict_least_recently_used_value():
+    cache = LRUCache(maxsize=2)
+    cache.fetch("a", str.upper)
+    cache.fetch("b", str.upper)
+    cache.fetch("a", str.upper)
+    cache.fetch("c", str.upper)
+    assert len(cache) == 2
+    assert cache.fetch("a", lambda k: "X") == "A"
+    assert cache.fetch("b", lambda k: "X") == "X"
+
+
+def test_cache_with_zero_size_should_not_store_values():
+    cache = LRUCache(maxsize=0)
+    cache.fetch("a", str.upper)
+    assert cache.fetch("a", lambda k: "X") == "X"
+    assert len(cache) == 0
+
+
+def test_cache_without_limit_should_not_evict_values():
+    cache = LRUCache(maxsize=None)
+    for key in "abcdef":
+        cache.fetch(key, str.upper)
+    assert len(cache) == 6
+
+
+def test_cache_resize_should_evict_least_recently_used_values():
+    cache = LRUCache(maxsize=3)
+    for key in "abc":
+        cache.fetch(key, str.upper)
+    cache.resize(1)
+    assert len(cache) == 1
+    assert cache.fetch("c", lambda k: "X") == "C"
+
+
+def test_cache_clear_should_reset_counters():
+    cache = LRUCache()
+    cache.fetch("a", str.upper)
+    cache.fetch("a", str.upper)
+    cache.clear()
+    assert (cache.hits, cache.misses, len(cache)) == (0, 0, 0)
+
+
+def test_cache_should_not_store_failures():
+    cache = LRUCache()
+
+    def fail(key):
+        raise ValueError(key)
+
+    with raises(ValueError):
+        cache.fetch("a", fail)
+    assert len(cache) == 0
+
+
+def test_extract_signature_should_count_hits_and_misses(caches):
+    docstring_cache, _ = caches
+    extract_signature("Do foo.\n\n:sig: () -> None")
+    extract_signature("Do foo.\n\n:sig: () -> None")
+    assert (docstring_cache.hits, docstring_cache.misses) == (1, 1)
+
+
+def test_extract_signature_should_not_cache_docstrings_without_signature(caches):
+    docstring_cache, _ = caches
+    assert extract_signature("Do foo.") is None
+    assert len(docstring_cache) == 0
+
+
+def test_parse_signature_should_count_hits_and_misses(caches):
+    _, signature_cache = caches
+    parse_signature("(int) -> None")
+    parse_signature("(int) -> None")
+    parse_signature("(str) -> None")
+    assert (signature_cache.hits, signature_cache.misses) == (1, 2)
+
+
+def test_parse_signature_results_should_be_immutable(caches):
+    param_types, _, requires, _ = parse_signature("(int, str) -> None")
+    assert param_types == ("int", "str")
+    assert requires == frozenset({"int", "str", "None"})
+    with raises(AttributeError):
+        param_types.append("")
+    with raises(AttributeError):
+        requires.add("")
+
+
+def test_set_cache_size_should_limit_caches(caches):
+    docstring_cache, signature_cache = caches
+    pygenstub.set_cache_size(1)
+    parse_signature("(int) -> None")
+    parse_signature("(str) -> None")
+    assert len(signature_cache) == 1
+    assert docstring_cache.maxsize == 1
+
+
+def test_methods_with_same_signature_should_share_cached_types(caches):
+    method = "    def m(self, i):\n"
+    method += '        """Do foo.\n\n        :sig: (int) -> None\n        """\n'
+    code = "class A:\n" + method + "\n\nclass B:\n" + method
+    expected = (
+        "class A:\n    def m(self, i: int) -> None: ...\n\n"
+        "class B:\n    def m(self, i: int) -> None: ...\n"
+    )
+    assert get_stub(code) == expected
+    assert get_stub(code) == expected
+
+
+_SOURCE = 'def f(a):\n    """Do foo.\n\n    :sig: (int) -> None\n    """\n'
+
+_EMPTY_STUB_SOURCE = 'x = """\nclass\n"""\n'
+
+
+@fixture
+def stub_cache(tmpdir):
+    yield StubCache(str(tmpdir.join("cache")))
+
+
+def set_mtime(path, mtime):
+    os.utime(path, (mtime, mtime))
+
+
+def test_stub_cache_should_generate_missing_stub(stub_cache):
+    assert stub_cache.get_stub(_SOURCE) == get_stub(_SOURCE)
+    assert (stub_cache.hits, stub_cache.misses) == (0, 1)
+
+
+def test_stub_cache_should_reuse_stored_stub(stub_cache):
+    stub_cache.get_stub(_SOURCE)
+    assert stub_cache.get_stub(_SOURCE) == get_stub(_SOURCE)
+    assert (stub_cache.hits, stub_cache.misses) == (1, 1)
+
+
+def test_stub_cache_should_be_shared_between_instances(stub_cache):
+    stub_cache.get_stub(_SOURCE)
+    other = StubCache(stub_cache.directory)
+    other.get_stub(_SOURCE)
+    assert other.hits == 1
+
+
+def test_stub_cache_should_store_empty_stub(stub_cache):
+    assert stub_cache.get_stub(_EMPTY_STUB_SOURCE) == ""
+    assert stub_cache.get_stub(_EMPTY_STUB_SOURCE) == ""
+    assert stub_cache.hits == 1
+
+
+def test_stub_cache_should_skip_source_without_signatures(stub_cache):
+    assert stub_cache.get_stub("x = 1\n") == ""
+    assert (stub_cache.hits, stub_cache.misses) == (0, 0)
+    assert stub_cache.stats()["entries"] == 0
+
+
+def test_stub_cache_should_not_store_failures(stub_cache):
+    with raises(SyntaxError):
+        stub_cache.get_stub("class A(:\n")
+    assert stub_cache.stats()["entries"] == 0
+
+
+def test_stub_cache_key_should_depend_on_source(stub_cache):
+    assert stub_cache.get_key(_SOURCE) != stub_cache.get_key(_SOURCE + "\n")
+
+
+def test_stub_cache_key_should_depend_on_settings(stub_cache):
+    assert stub_cache.get_key(_SOURCE) != stub_cache.get_key(_SOURCE, {"engine": "ast"})
+
+
+def test_stub_cache_key_should_depend_on_version(stub_cache, monkeypatch):
+    key = stub_cache.get_key(_SOURCE)
+    monkeypatch.setattr(pygenstub, "__version__", "0.0")
+    assert stub_cache.get_key(_SOURCE) != key
+
+
+def test_stub_cache_key_should_depend_on_target_version(stub_cache):
+    key = stub_cache.get_stub_key(_SOURCE, resolver=TypeResolver(target_version=(3, 7)))
+    assert key != stub_cache.get_stub_key(_SOURCE, resolver=TypeResolver(target_version=(3, 8)))
+
+
+def test_stub_cache_should_not_share_stubs_between_target_versions(stub_cache):
+    source = 'def f(a):\n    """Do foo.\n\n    :sig: (Literal["a"]) -> None\n    """\n'
+    stub = stub_cache.get_stub(source, resolver=TypeResolver(target_version=(3, 8)))
+    assert "Literal" in stub
+    with raises(ValueError):
+        stub_cache.get_stub(source, resolver=TypeResolver(target_version=(3, 7)))
+
+
+def test_stub_cache_should_not_leave_temporary_files(stub_cache):
+    stub_cache.get_stub(_SOURCE)
+    path = stub_cache.get_path(stub_cache.get_stub_key(_SOURCE))
+    assert os.listdir(os.path.dirname(path)) == [os.path.basename(path)]
+
+
+def test_stub_cache_hit_should_mark_entry_as_recently_used(stub_cache):
+    stub_cache.get_stub(_SOURCE)
+    path = stub_cache.get_path(stub_cache.get_stub_key(_SOURCE))
+    set_mtime(path, 1000000000)
+    stub_cache.get_stub(_SOURCE)
+    assert os.stat(path).st_mtime > 1000000000
+
+
+def test_stub_cache_should_evict_least_recently_used_entries(stub_cache):
+    sources = [_SOURCE.replace("f(", name + "(") for name in ("f", "g", "h")]
+    for i, source in enumerate(sources[:2]):
+        stub_cache.get_stub(source)
+        set_mtime(stub_cache.get_path(stub_cache.get_stub_key(source)), 1000000000 + i)
+    entry_size = stub_cache.stats()["size"] // 2
+    stub_cache.max_size = 2 * entry_size
+    stub_cache.get_stub(sources[2])
+    assert stub_cache.stats()["entries"] == 2
+    assert stub_cache.get(stub_cache.get_stub_key(sources[0])) is None
+    assert stub_cache.get(stub_cache.get_stub_key(sources[1])) is not None
+
+
+def test_stub_cache_stats_should_count_entries(stub_cache):
+    stub_cache.get_stub(_SOURCE)
+    stub_cache.get_stub(_EMPTY_STUB_SOURCE)
+    stats = stub_cache.stats()
+    assert stats["entries"] == 2
+    assert stats["size"] == len(get_stub(_SOURCE))
+
+
+def test_stub_cache_clear_should_remove_entries(stub_cache):
+    stub_cache.get_stub(_SOURCE)
+    stub_cache.clear()
+    assert stub_cache.stats()["entries"] == 0
+
+
+def test_generate_stubs_should_reuse_cache_across_checkouts(package, tmpdir, stub_cache):
+    list(pygenstub.generate_stubs([str(package)], cache=stub_cache))
+    copy = tmpdir.join("copy")
+    package.copy(copy)
+    for stub in copy.visit("*.pyi"):
+        stub.remove()
+    cache = StubCache(stub_cache.directory)
+    list(pygenstub.generate_stubs([str(copy)], cache=cache))
+    assert (cache.hits, cache.misses) == (2, 0)
+    assert copy.join("a.pyi").read() == package.join("a.pyi").read()
+
+
+def test_generate_stubs_parallel_should_fill_cache(package, stub_cache):
+    list(pygenstub.generate_stubs([str(package)], jobs=2, cache=stub_cache))
+    assert stub_cache.stats()["entries"] == 1
+
+
+def test_cli_cache_dir_should_store_stubs(package, stub_cache):
+    pygenstub.main(argv=["pygenstub", "--cache-dir", stub_cache.directory, str(package)])
+    assert stub_cache.stats()["entries"] == 1
+    assert package.join("a.pyi").check()
+
+
+def test_cli_cache_stats_should_print_statistics(package, stub_cache, capsys):
+    pygenstub.main(argv=["pygenstub", "--cache-dir", stub_cache.directory, str(package)])
+    pygenstub.main(argv=["pygenstub", "--cache-dir", stub_cache.directory, "--cache-stats"])
+    out, err = capsys.readouterr()
+    assert "entries: 1\n" in out
+    assert "max_size: None\n" in out
+
+
+def test_cli_cache_stats_without_cache_dir_should_print_usage_and_exit(capsys):
+    with raises(SystemExit):
+        pygenstub.main(argv=["pygenstub", "--cache-stats"])
+    out, err = capsys.readouterr()
+    assert err.startswith("usage: ")
+    assert "--cache-dir" in err
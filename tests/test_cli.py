@@ -71,3 +71,109 @@ def test_cli_original_module_should_generate_original_stub(source):
     with open(source[1] + "i") as dst:
         dst_stub = dst.read()
     assert dst_stub == src_stub
+
+
+_UNKNOWN_CODE = 'def f(a):\n    """Do foo.\n\n    :sig: (Foo) -> None\n    """\n'
+
+
+def test_cli_multiple_files_should_generate_multiple_stubs(package):
+    paths = [str(package.join("a.py")), str(package.join("sub", "b.py"))]
+    pygenstub.main(argv=["pygenstub"] + paths)
+    assert package.join("a.pyi").check()
+    assert package.join("sub", "b.pyi").check()
+
+
+def test_cli_directory_should_generate_stubs_recursively(package):
+    pygenstub.main(argv=["pygenstub", str(package)])
+    stubs = sorted(p.relto(package) for p in package.visit("*.pyi"))
+    assert stubs == ["a.pyi", os.path.join("sub", "b.pyi")]
+
+
+def test_cli_directory_stub_should_have_generated_content(package):
+    pygenstub.main(argv=["pygenstub", str(package)])
+    stub = package.join("a.pyi").read()
+    assert stub == "# " + pygenstub.EDIT_WARNING + "\n\ndef f(a: int) -> None: ...\n"
+
+
+def test_cli_output_dir_should_mirror_directory(package, tmpdir):
+    out = tmpdir.join("out")
+    pygenstub.main(argv=["pygenstub", "-o", str(out), str(package)])
+    stubs = sorted(p.relto(out) for p in out.visit("*.pyi"))
+    assert stubs == [os.path.join("pkg", "a.pyi"), os.path.join("pkg", "sub", "b.pyi")]
+    assert not package.join("a.pyi").check()
+
+
+def test_cli_output_dir_should_place_file_stub_directly(package, tmpdir):
+    out = tmpdir.join("out")
+    pygenstub.main(argv=["pygenstub", "--output-dir", str(out), str(package.join("a.py"))])
+    assert out.join("a.pyi").check()
+
+
+def test_cli_bad_file_should_not_stop_others(package, capsys):
+    package.join("bad.py").write(_UNKNOWN_CODE)
+    package.join("broken.py").write("class A(:\n")
+    with raises(SystemExit) as e:
+        pygenstub.main(argv=["pygenstub", str(package)])
+    assert e.value.code == 1
+    out, err = capsys.readouterr()
+    assert "bad.py: ValueError: Unknown types: Foo" in err
+    assert "broken.py: SyntaxError: " in err
+    assert package.join("a.pyi").check()
+    assert package.join("sub", "b.pyi").check()
+
+
+def test_cli_source_without_markers_should_not_be_parsed(package, monkeypatch):
+    monkeypatch.setattr(pygenstub, "StubGenerator", None)
+    package.join("a.py").write("def f(a):\n    pass\n")
+    package.join("sub", "b.py").write("def f(:\n")
+    pygenstub.main(argv=["pygenstub", str(package)])
+    assert package.join("a.pyi").check(exists=False)
+
+
+def test_cli_missing_file_should_not_stop_others(package, capsys):
+    paths = [str(package.join("missing.py")), str(package.join("a.py"))]
+    with raises(SystemExit):
+        pygenstub.main(argv=["pygenstub"] + paths)
+    out, err = capsys.readouterr()
+    assert "missing.py: " in err
+    assert package.join("a.pyi").check()
+
+
+def test_generate_stubs_should_report_results_in_order(package):
+    package.join("bad.py").write(_UNKNOWN_CODE)
+    results = list(pygenstub.generate_stubs([str(package)]))
+    sources = [os.path.relpath(s, str(package)) for s, _, _ in results]
+    assert sources == [
+        "__init__.py",
+        "a.py",
+        "bad.py",
+        os.path.join("sub", "__init__.py"),
+        os.path.join("sub", "b.py"),
+    ]
+    assert [r[1] is not None for r in results] == [False, True, False, False, True]
+    assert [r[2] is not None for r in results] == [False, False, True, False, False]
+
+
+def test_cli_jobs_should_generate_stubs_in_parallel(package):
+    pygenstub.main(argv=["pygenstub", "--jobs", "2", str(package)])
+    stubs = sorted(p.relto(package) for p in package.visit("*.pyi"))
+    assert stubs == ["a.pyi", os.path.join("sub", "b.pyi")]
+
+
+def test_cli_negative_jobs_should_print_usage_and_exit(package, capsys):
+    with raises(SystemExit):
+        pygenstub.main(argv=["pygenstub", "-j", "-1", str(package)])
+    out, err = capsys.readouterr()
+    assert err.startswith("usage: ")
+
+
+def test_generate_stubs_parallel_should_report_same_results_as_serial(package):
+    package.join("bad.py").write(_UNKNOWN_CODE)
+    serial = list(pygenstub.generate_stubs([str(package)]))
+    parallel = list(pygenstub.generate_stubs([str(package)], jobs=3))
+    assert parallel == serial
+
+
+def test_generate_stubs_all_cpus_should_report_all_results(package):
+    results = list(pygenstub.generate_stubs([str(package)], jobs=0))
+    assert len(results) == 4
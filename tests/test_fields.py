@@ -0,0 +1,176 @@
+from __future__ import unicode_literals
+
+from pytest import mark, raises
+
+import ast
+import itertools
+import os
+
+from docutils.core import publish_doctree
+
+from pygenstub import extract_signature, get_docstring_parser, get_fields, scan_fields
+
+
+def get_docutils_fields(docstring):
+    root = publish_doctree(docstring, settings_overrides={"report_level": 5})
+    return get_fields(root)
+
+
+_DOCSTRINGS = [
+    "",
+    "Do foo.",
+    "Do foo.\n\n:sig: () -> None",
+    "Do foo.\n\n:sig: (int, str) -> None\n:param a: An int.\n:param b: A str.",
+    "Do foo.\n\n:param a: An int.\n:sig: (int) -> None\n:return: Nothing.",
+    "Do foo.\n\n:sig: (int,\n    str) -> None",
+    "Do foo.\n\n:sig: (int,\n        str) -> None\n:param a: An int.",
+    "Do foo.\n\n:sig:\n    (int) -> None",
+    "Do foo.\n\n:sig:    (int) -> None   ",
+    "Do foo.\n\n:sig: (int) -> None\n\n    More of the signature.\n\nText.",
+    "Do foo.\n\n:sig: (int) -> None\n\n:param a: An int.\n\n:return: Nothing.",
+    "Do foo.\n\n:sig: (int) -> None\nText right after the field list.",
+    "Do foo.\n:sig: (int) -> None",
+    "Do foo.\n    Indented.\n:sig: (int) -> None",
+    "Do foo.\n\n    Quoted.\n:sig: (int) -> None",
+    "Do foo.\n\n    :sig: (int) -> None",
+    ":sig: (int) -> None",
+    ":sig: (int) -> None\n\nDo foo.",
+    "\n\n:sig: (int) -> None",
+    "Foo\n===\n\n:sig: (int) -> None",
+    "Foo\n===\n\nDo foo.\n\n:sig: (int) -> None",
+    "Do foo.\n\nBar\n---\n\n:sig: (int) -> None",
+    "Do foo::\n\n:sig: (int) -> None",
+    "Do foo::\n\n    :sig: (int) -> None\n\n:sig: (str) -> None",
+    ".. note:: Foo.\n\n:sig: (int) -> None",
+    "Do foo.\n\n.. comment\n\n:sig: (int) -> None",
+    "Do foo.\n\n:a: 1\n\nText.\n\n:sig: (int) -> None",
+    "Do foo.\n\n:sig: (int) -> None\n:sig: (str) -> None",
+    "Do foo.\n\n:sig:(int) -> None",
+    "Do foo.\n\n:sig : (int) -> None",
+    "Do foo.\n\n:si\\g: (int) -> None",
+    "Do foo.\n\n:a:b: c\n:sig: (int) -> None",
+    "Do foo.\n\n:sig:x: (int) -> None",
+    "Do foo.\n\n:: (int) -> None\n:sig: (int) -> None",
+    "Do foo.\n\n- item\n\n:sig: (int) -> None",
+    "Do foo.\n\n- item\n:sig: (int) -> None",
+    "Do foo.\n\n1. item\n\n:sig: (int) -> None",
+    "Do foo.\n\nterm\n    definition\n\n:sig: (int) -> None",
+    "Do foo.\n\n=====  =====\na      b\n\n:sig:  c\n=====  =====",
+    "Do foo.\n\n+---+\n| a |\n+---+\n\n:sig: (int) -> None",
+    "Do foo.\n\n| line\n| block\n\n:sig: (int) -> None",
+    "Do foo.\n\n----\n\n:sig: (int) -> None",
+    "Do foo.\n\n:sig: (int)\n\t-> None",
+    "Do foo.\n\n:sig: (int) -> None\x0c",
+    "Do foo.\n\n:sig: Dict[str,\n  List[int]]\n:return: A dict.",
+    "Do *foo*.\n\n:sig: (`int`) -> None",
+    "Do foo.\n\n:param a: An int.\n\n    With a long description.\n:sig: (int) -> None",
+]
+
+_SUMMARIES = ["Do foo.", "Do foo\nover two lines."]
+
+_BLOCKS = [
+    "Do foo.",
+    ":sig: (int) -> None",
+    ":sig: (int,\n    str) -> None",
+    ":param a: An int.",
+    ":param a: An int.\n:return: Nothing.",
+    "    Quoted.",
+    "- item",
+    "Bar\n---",
+    "Example::",
+    ".. note:: Foo.",
+]
+
+_SEPARATORS = ["\n", "\n\n"]
+
+
+def _combine_blocks():
+    for n_blocks in (1, 2):
+        for summary in _SUMMARIES:
+            for blocks in itertools.product(_BLOCKS, repeat=n_blocks):
+                for seps in itertools.product(_SEPARATORS, repeat=n_blocks):
+                    parts = [summary]
+                    for sep, block in zip(seps, blocks):
+                        parts.extend([sep, block])
+                    yield "".join(parts)
+
+
+def _module_docstrings():
+    base_dir = os.path.dirname(__file__)
+    with open(os.path.join(base_dir, "..", "pygenstub.py")) as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            docstring = ast.get_docstring(node)
+            if docstring is not None:
+                yield docstring
+
+
+def assert_same_fields(docstring):
+    fields = scan_fields(docstring)
+    try:
+        expected = get_docutils_fields(docstring)
+    except AssertionError:
+        assert fields is None
+        with raises(AssertionError):
+            extract_signature(docstring)
+    else:
+        assert fields in (None, expected)
+        assert extract_signature(docstring) == expected.get("sig")
+
+
+@mark.parametrize("docstring", _DOCSTRINGS)
+def test_scan_should_agree_with_docutils(docstring):
+    assert_same_fields(docstring)
+
+
+def test_scan_should_agree_with_docutils_on_combined_blocks():
+    for docstring in _combine_blocks():
+        assert_same_fields(docstring)
+
+
+def test_scan_should_agree_with_docutils_on_module_docstrings():
+    for docstring in _module_docstrings():
+        assert_same_fields(docstring)
+
+
+@mark.parametrize("docstring", _DOCSTRINGS)
+def test_shared_parser_should_agree_with_docutils(docstring):
+    parser = get_docstring_parser()
+    try:
+        expected = get_docutils_fields(docstring)
+    except AssertionError:
+        with raises(AssertionError):
+            get_fields(parser.parse(docstring))
+    else:
+        assert get_fields(parser.parse(docstring)) == expected
+
+
+def test_docstring_parser_should_be_shared():
+    assert get_docstring_parser() is get_docstring_parser()
+
+
+def test_scan_should_classify_module_docstrings():
+    for docstring in _module_docstrings():
+        assert scan_fields(docstring) is not None
+
+
+def test_scan_should_classify_common_docstrings():
+    docstring = "Do foo.\n\n:sig: (int,\n    str) -> None\n:param a: An int.\n:param b: A str."
+    assert scan_fields(docstring) == {
+        "sig": "(int,\nstr) -> None",
+        "param a": "An int.",
+        "param b": "A str.",
+    }
+
+
+def test_scan_should_give_up_on_bibliographic_fields():
+    assert scan_fields(":sig: (int) -> None") is None
+
+
+def test_scan_should_give_up_on_section_titles():
+    assert scan_fields("Do foo.\n\nBar\n---\n\n:sig: (int) -> None") is None
+
+
+def test_extract_should_not_parse_docstring_without_sig_field():
+    assert extract_signature("Foo\n===\n\nDo foo::\n\n    spam") is None
@@ -0,0 +1,169 @@
+from pytest import fixture, raises
+
+import json
+import os
+
+import pygenstub
+from pygenstub import Manifest, generate_stubs
+
+
+@fixture
+def manifest_path(tmpdir):
+    yield str(tmpdir.join("manifest.json"))
+
+
+def generate(package, manifest_path, **kwargs):
+    results = generate_stubs([str(package)], manifest_path=manifest_path, **kwargs)
+    return [os.path.relpath(source_path, str(package)) for source_path, _, _ in results]
+
+
+def touch(path, delta=10):
+    stat = os.stat(str(path))
+    os.utime(str(path), (stat.st_atime, stat.st_mtime + delta))
+
+
+def test_first_run_should_process_all_sources(package, manifest_path):
+    assert len(generate(package, manifest_path)) == 4
+
+
+def test_first_run_should_write_manifest(package, manifest_path):
+    generate(package, manifest_path)
+    with open(manifest_path) as f:
+        content = json.load(f)
+    assert content["version"] == pygenstub.__version__
+    entry = content["files"][os.path.join("pkg", "a.py")]
+    assert entry["stub"] == str(package.join("a.pyi"))
+    assert entry["written"]
+    assert entry["size"] == package.join("a.py").size()
+    assert entry["version"] == pygenstub.__version__
+
+
+def test_unchanged_sources_should_be_skipped(package, manifest_path):
+    generate(package, manifest_path)
+    assert generate(package, manifest_path) == []
+
+
+def test_changed_source_should_be_regenerated(package, manifest_path):
+    generate(package, manifest_path)
+    package.join("a.py").write("\n" + package.join("a.py").read())
+    touch(package.join("a.py"))
+    assert generate(package, manifest_path) == ["a.py"]
+
+
+def test_touched_source_with_same_content_should_be_skipped(package, manifest_path):
+    generate(package, manifest_path)
+    touch(package.join("a.py"))
+    assert generate(package, manifest_path) == []
+    entry = Manifest(manifest_path).entries[os.path.join("pkg", "a.py")]
+    assert entry["mtime"] == os.stat(str(package.join("a.py"))).st_mtime
+
+
+def test_deleted_stub_should_be_regenerated(package, manifest_path):
+    generate(package, manifest_path)
+    package.join("a.pyi").remove()
+    assert generate(package, manifest_path) == ["a.py"]
+    assert package.join("a.pyi").check()
+
+
+def test_changed_output_dir_should_regenerate_stubs(package, manifest_path, tmpdir):
+    generate(package, manifest_path)
+    assert len(generate(package, manifest_path, output_dir=str(tmpdir.join("out")))) == 4
+
+
+def test_new_version_should_regenerate_stubs(package, manifest_path, monkeypatch):
+    generate(package, manifest_path)
+    monkeypatch.setattr(pygenstub, "__version__", "0.0")
+    assert len(generate(package, manifest_path)) == 4
+
+
+def test_force_should_regenerate_stubs(package, manifest_path):
+    generate(package, manifest_path)
+    assert len(generate(package, manifest_path, force=True)) == 4
+
+
+def test_failed_source_should_be_retried(package, manifest_path):
+    package.join("bad.py").write("class A(:\n")
+    generate(package, manifest_path)
+    assert generate(package, manifest_path) == ["bad.py"]
+
+
+def test_invalid_manifest_should_be_ignored(package, manifest_path):
+    with open(manifest_path, "w") as f:
+        f.write("{")
+    assert len(generate(package, manifest_path)) == 4
+    assert len(Manifest(manifest_path).entries) == 4
+
+
+def test_manifest_should_be_saved_when_stopped_early(package, manifest_path):
+    results = generate_stubs([str(package)], manifest_path=manifest_path)
+    next(results)
+    results.close()
+    assert len(Manifest(manifest_path).entries) == 1
+
+
+def test_manifest_should_work_with_parallel_jobs(package, manifest_path):
+    assert len(generate(package, manifest_path, jobs=2)) == 4
+    assert generate(package, manifest_path, jobs=2) == []
+
+
+def test_cli_manifest_should_skip_unchanged_sources(package, manifest_path):
+    pygenstub.main(argv=["pygenstub", "--manifest", manifest_path, str(package)])
+    package.join("a.pyi").write("")
+    pygenstub.main(argv=["pygenstub", "--manifest", manifest_path, str(package)])
+    assert package.join("a.pyi").read() == ""
+
+
+def test_cli_force_should_regenerate_stubs(package, manifest_path):
+    pygenstub.main(argv=["pygenstub", "--manifest", manifest_path, str(package)])
+    package.join("a.pyi").write("")
+    pygenstub.main(argv=["pygenstub", "--manifest", manifest_path, "--force", str(package)])
+    assert package.join("a.pyi").read() != ""
+
+
+def test_cli_failed_source_should_not_be_recorded(package, manifest_path):
+    package.join("bad.py").write("class A(:\n")
+    with raises(SystemExit):
+        pygenstub.main(argv=["pygenstub", "--manifest", manifest_path, str(package)])
+    assert os.path.join("pkg", "bad.py") not in Manifest(manifest_path).entries
+
+
+USING_CODE = 'def f(a):\n    """Do foo.\n\n    :sig: (B) -> Alias\n    """\n'
+
+DEFINING_CODE = "# sigalias: Alias = int\n\nclass B:\n    pass\n"
+
+
+@fixture
+def dependent(package, manifest_path):
+    package.join("a.py").write(USING_CODE)
+    package.join("sub", "b.py").write(DEFINING_CODE)
+    generate(package, manifest_path)
+    yield package
+
+
+def test_manifest_should_record_dependencies(dependent, manifest_path):
+    entries = Manifest(manifest_path).entries
+    uses = entries[os.path.join("pkg", "a.py")]["uses"]
+    assert uses == {"B": "pkg.sub.b", "Alias": "pkg.sub.b"}
+    assert entries[os.path.join("pkg", "sub", "b.py")]["symbols"] == ["Alias", "B"]
+
+
+def test_moved_dependency_should_regenerate_dependent_stub(dependent, manifest_path):
+    dependent.join("sub", "b.py").write("# sigalias: Alias = int\n")
+    touch(dependent.join("sub", "b.py"))
+    dependent.join("c.py").write("class B:\n    pass\n")
+    assert generate(dependent, manifest_path) == ["a.py", "c.py", os.path.join("sub", "b.py")]
+    assert "from pkg.c import B" in dependent.join("a.pyi").read()
+
+
+def test_changed_alias_definition_should_not_regenerate_dependents(dependent, manifest_path):
+    dependent.join("sub", "b.py").write(DEFINING_CODE.replace("int", "str"))
+    touch(dependent.join("sub", "b.py"))
+    assert generate(dependent, manifest_path) == [os.path.join("sub", "b.py")]
+
+
+def test_unchanged_sources_should_not_be_read(dependent, manifest_path, monkeypatch):
+    read = []
+    original = pygenstub.read_source
+    monkeypatch.setattr(pygenstub, "read_source", lambda p: read.append(p) or original(p))
+    assert generate(dependent, manifest_path) == []
+    assert read == []
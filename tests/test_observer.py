@@ -0,0 +1,135 @@
+from pytest import raises
+
+import pygenstub
+from pygenstub import StubCache, StubObserver, generate_stub_file, get_stub
+
+
+_CLASS_CODE = '''
+class A:
+    """A foo."""
+
+    def m(self, a):
+        """Do foo.
+
+        :sig: (int) -> None
+        """
+
+        def n(b):
+            """Do bar.
+
+            :sig: (str) -> None
+            """
+'''
+
+
+class RecordingObserver(StubObserver):
+    def __init__(self):
+        self.events = []
+
+    def file_started(self, path, size):
+        self.events.append(("file_started", path, size))
+
+    def file_finished(self, path, seconds, size):
+        assert seconds >= 0
+        self.events.append(("file_finished", path, size))
+
+    def docstring_parsed(self, qualname, seconds, size):
+        assert seconds >= 0
+        self.events.append(("docstring_parsed", qualname, size))
+
+    def cache_hit(self, key, seconds, size):
+        assert seconds >= 0
+        self.events.append(("cache_hit", key, size))
+
+    def cache_miss(self, key, seconds, size):
+        assert seconds >= 0
+        self.events.append(("cache_miss", key, size))
+
+    def unknown_type(self, name):
+        self.events.append(("unknown_type", name))
+
+    def stub_written(self, path, seconds, size):
+        assert seconds >= 0
+        self.events.append(("stub_written", path, size))
+
+    def names(self):
+        return [event[0] for event in self.events]
+
+
+def test_observer_should_receive_docstring_events_by_qualified_name():
+    observer = RecordingObserver()
+    get_stub(_CLASS_CODE, observer=observer)
+    assert observer.events == [
+        ("docstring_parsed", "A", len("A foo.")),
+        ("docstring_parsed", "A.m", len("Do foo.\n\n:sig: (int) -> None")),
+        ("docstring_parsed", "A.m.n", len("Do bar.\n\n:sig: (str) -> None")),
+    ]
+
+
+def test_observer_should_receive_docstring_events_from_tokens_engine():
+    observer = RecordingObserver()
+    get_stub(_CLASS_CODE, engine="tokens", observer=observer)
+    assert [e[1] for e in observer.events] == ["A", "A.m", "A.m.n"]
+
+
+def test_observer_should_receive_unknown_types_before_error():
+    observer = RecordingObserver()
+    with raises(ValueError):
+        get_stub("x = 1  # sig: Foo\ny = 1  # sig: Bar\n", observer=observer)
+    assert observer.events == [("unknown_type", "Bar"), ("unknown_type", "Foo")]
+
+
+def test_default_observer_should_ignore_events():
+    observer = StubObserver()
+    stub = get_stub(_CLASS_CODE, observer=observer)
+    assert stub == get_stub(_CLASS_CODE)
+
+
+def test_observer_should_receive_cache_events(tmpdir):
+    cache = StubCache(str(tmpdir.join("cache")))
+    observer = RecordingObserver()
+    stub = cache.get_stub(_CLASS_CODE, observer=observer)
+    cache.get_stub(_CLASS_CODE, observer=observer)
+    key = cache.get_stub_key(_CLASS_CODE)
+    assert observer.names() == ["docstring_parsed"] * 3 + ["cache_miss", "cache_hit"]
+    assert observer.events[-2:] == [
+        ("cache_miss", key, len(stub)),
+        ("cache_hit", key, len(stub)),
+    ]
+
+
+def test_observer_should_receive_file_events(tmpdir):
+    source, stub = tmpdir.join("a.py"), tmpdir.join("a.pyi")
+    source.write(_CLASS_CODE)
+    observer = RecordingObserver()
+    assert generate_stub_file(str(source), str(stub), observer=observer)
+    size = len(get_stub(_CLASS_CODE))
+    assert observer.events[0] == ("file_started", str(source), len(_CLASS_CODE))
+    assert observer.events[-2:] == [
+        ("stub_written", str(stub), size),
+        ("file_finished", str(source), size),
+    ]
+
+
+def test_observer_should_receive_file_events_for_source_without_signatures(tmpdir):
+    source = tmpdir.join("a.py")
+    source.write("x = 1\n")
+    observer = RecordingObserver()
+    generate_stub_file(str(source), str(tmpdir.join("a.pyi")), observer=observer)
+    assert observer.events == [
+        ("file_started", str(source), 6),
+        ("file_finished", str(source), 0),
+    ]
+
+
+def test_generate_stubs_should_pass_observer(package):
+    observer = RecordingObserver()
+    list(pygenstub.generate_stubs([str(package)], observer=observer))
+    started = [e[1] for e in observer.events if e[0] == "file_started"]
+    expected = ["__init__.py", "a.py", "sub/__init__.py", "sub/b.py"]
+    assert started == [str(package.join(*p.split("/"))) for p in expected]
+
+
+def test_generate_stubs_should_reject_observer_for_multiple_jobs(package):
+    with raises(ValueError):
+        pygenstub.generate_stubs([str(package)], jobs=2, observer=StubObserver())
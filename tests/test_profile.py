@@ -0,0 +1,103 @@
+from pytest import fixture
+
+import pstats
+
+import pygenstub
+from pygenstub import PROFILE_STAGES, get_stub, start_profile, stop_profile
+
+
+_CLASS_CODE = '''
+class A:
+    """A foo."""
+
+    def m(self, a):
+        """Do foo.
+
+        :sig: (int) -> None
+        """
+
+    def n(self, a):
+        """Do bar.
+
+        Title
+        -----
+
+        :sig: (str) -> None
+        """
+'''
+
+
+@fixture
+def profile():
+    pygenstub.clear_caches()
+    yield start_profile()
+    stop_profile()
+    pygenstub.clear_caches()
+
+
+def test_profile_should_collect_stage_times(profile):
+    profile.start_file("a.py")
+    get_stub(_CLASS_CODE)
+    times = profile.files["a.py"]
+    assert sorted(times) == sorted(PROFILE_STAGES)
+    assert all(times[stage] > 0 for stage in PROFILE_STAGES)
+    assert profile._nested == 0.0
+
+
+def test_profile_should_collect_stage_times_for_tokens_engine(profile):
+    profile.start_file("a.py")
+    get_stub(_CLASS_CODE, engine="tokens")
+    assert profile.files["a.py"]["parsing"] > 0
+
+
+def test_profile_should_record_docstrings_by_qualified_name(profile):
+    profile.start_file("a.py")
+    get_stub(_CLASS_CODE)
+    assert sorted(q for _, p, q in profile.docstrings if p == "a.py") == ["A", "A.m", "A.n"]
+
+
+def test_profile_slowest_docstrings_should_be_sorted(profile):
+    profile.start_file("a.py")
+    get_stub(_CLASS_CODE)
+    slowest = profile.get_slowest_docstrings(limit=2)
+    assert len(slowest) == 2
+    assert slowest[0][0] >= slowest[1][0]
+    assert slowest[0][2] == "A.n"
+
+
+def test_stop_profile_should_stop_collecting():
+    profile = start_profile()
+    assert stop_profile() is profile
+    get_stub(_CLASS_CODE)
+    assert profile.files == {}
+
+
+def test_generate_stubs_should_profile_every_file(package, profile):
+    list(pygenstub.generate_stubs([str(package)]))
+    expected = [str(package.join("a.py")), str(package.join("sub", "b.py"))]
+    assert sorted(profile.files) == expected
+
+
+def test_cli_profile_should_print_report(package, capsys):
+    pygenstub.main(argv=["pygenstub", "--profile", "-j", "2", str(package)])
+    out, err = capsys.readouterr()
+    lines = err.splitlines()
+    assert lines[0].split() == ["file"] + list(PROFILE_STAGES)
+    assert lines[1].startswith(str(package.join("a.py")))
+    assert lines[3].startswith("total ")
+    assert lines[5] == "slowest docstrings:"
+    assert lines[6].endswith(":f")
+    assert pygenstub._profile is None
+
+
+def test_cli_profile_limit_should_limit_docstrings(package, capsys):
+    pygenstub.main(argv=["pygenstub", "--profile", "--profile-limit", "1", str(package)])
+    out, err = capsys.readouterr()
+    assert len(err.splitlines()) == 7
+
+
+def test_cli_profile_output_should_write_statistics(package, tmpdir, capsys):
+    path = str(tmpdir.join("stats"))
+    pygenstub.main(argv=["pygenstub", "--profile-output", path, str(package)])
+    stats = pstats.Stats(path)
+    assert any(name == "iter_stub" for _, _, name in stats.stats)
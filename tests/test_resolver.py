@@ -0,0 +1,199 @@
+from __future__ import unicode_literals
+
+from pytest import fixture, mark, raises
+
+import os
+
+import pygenstub
+from pygenstub import (
+    StubCache,
+    StubGenerator,
+    TypeResolver,
+    collect_symbols,
+    generate_stubs,
+    get_module_name,
+    get_package_resolver,
+    get_type_resolver,
+)
+
+
+SOURCE = 'def f(a):\n    """Do foo.\n\n    :sig: (%s) -> None\n    """\n'
+
+
+def generate_stub(type_, resolver=None):
+    return StubGenerator(SOURCE % type_, resolver=resolver).generate_stub()
+
+
+def test_resolver_should_know_builtins():
+    resolver = TypeResolver()
+    assert {"int", "str", "None"} <= resolver.builtins
+    assert resolver.get_module("int") is None
+
+
+def test_resolver_should_know_typing_names():
+    assert TypeResolver().get_module("Optional") == "typing"
+
+
+def test_resolver_should_prefer_typing_to_collections_abc():
+    assert TypeResolver().get_module("Iterable") == "typing"
+
+
+def test_resolver_should_not_know_private_or_unknown_names():
+    resolver = TypeResolver()
+    assert resolver.get_module("_GenericAlias") is None
+    assert resolver.get_module("Foo") is None
+
+
+def test_resolver_should_exclude_typing_names_newer_than_target_version():
+    resolver = TypeResolver(target_version=(3, 7))
+    assert resolver.get_module("Protocol") is None
+    assert resolver.get_module("OrderedDict") == "typing"
+
+
+def test_resolver_should_include_older_typing_names_for_old_target_version():
+    resolver = TypeResolver(target_version=(2, 7))
+    assert resolver.get_module("List") == "typing"
+    assert resolver.get_module("Optional") == "typing"
+    assert resolver.get_module("ClassVar") is None
+
+
+def test_resolver_should_register_public_names_of_module():
+    resolver = TypeResolver()
+    resolver.register_module("decimal")
+    assert resolver.get_module("Decimal") == "decimal"
+
+
+def test_resolver_should_register_given_names():
+    resolver = TypeResolver()
+    resolver.register_module("foo", ["Foo", "Optional"])
+    assert resolver.get_module("Foo") == "foo"
+    assert resolver.get_module("Optional") == "typing"
+
+
+def test_resolver_should_skip_missing_module():
+    resolver = TypeResolver()
+    resolver.register_module("pygenstub_missing_module")
+    assert resolver.get_module("pygenstub_missing_module") is None
+
+
+def test_shared_resolver_should_be_created_once():
+    assert get_type_resolver() is get_type_resolver()
+
+
+def test_generator_should_use_shared_resolver():
+    assert StubGenerator("").resolver is get_type_resolver()
+
+
+def test_stub_should_import_registered_names():
+    resolver = TypeResolver()
+    resolver.register_module("decimal", ["Decimal"])
+    stub = generate_stub("Optional[Decimal]", resolver=resolver)
+    assert stub.startswith("from decimal import Decimal\nfrom typing import Optional\n\n")
+
+
+def test_stub_should_reject_typing_names_newer_than_target_version():
+    resolver = TypeResolver(target_version=(3, 7))
+    with raises(ValueError) as e:
+        generate_stub("Literal['a']", resolver=resolver)
+    assert "Unknown types: Literal" in str(e.value)
+
+
+def test_resolver_should_find_registered_names_in_source():
+    resolver = TypeResolver()
+    resolver.register_module("pkg.b", ["B", "C"])
+    assert resolver.get_registered_names("x = 1  # sig: List[B]\n") == {"B": "pkg.b"}
+
+
+def test_resolver_should_not_report_known_modules_as_registered():
+    assert TypeResolver().get_registered_names("x = 1  # sig: List[int]\n") == {}
+
+
+def test_module_name_should_include_packages(package):
+    assert get_module_name(str(package.join("a.py"))) == "pkg.a"
+    assert get_module_name(str(package.join("sub", "b.py"))) == "pkg.sub.b"
+    assert get_module_name(str(package.join("sub", "__init__.py"))) == "pkg.sub"
+
+
+def test_module_name_outside_package_should_be_file_name(tmpdir):
+    assert get_module_name(str(tmpdir.join("a.py"))) == "a"
+
+
+def test_symbols_should_be_top_level_classes_and_aliases():
+    source = "# sigalias: A = int\n\nclass B:\n    class C: pass\n\nclass D(B): pass\n"
+    assert collect_symbols(source) == ["A", "B", "D"]
+
+
+def test_package_resolver_should_register_modules(package):
+    package.join("sub", "b.py").write("class B:\n    pass\n")
+    resolver = get_package_resolver([(str(package.join("sub", "b.py")), "")])
+    assert resolver.get_module("B") == "pkg.sub.b"
+
+
+@fixture
+def shared_resolver(monkeypatch):
+    """Shared resolver that is discarded after the test."""
+    monkeypatch.setattr(pygenstub, "_type_resolver", None)
+    yield get_type_resolver()
+
+
+def test_resolver_copy_should_not_change_original():
+    resolver = TypeResolver()
+    copied = resolver.copy()
+    copied.register_module("decimal", ["Decimal"])
+    assert (copied.get_module("Decimal"), resolver.get_module("Decimal")) == ("decimal", None)
+
+
+def test_package_resolver_should_know_names_registered_on_shared_resolver(
+    package, shared_resolver
+):
+    shared_resolver.register_module("pathlib", ["Path"])
+    resolver = get_package_resolver([(str(package.join("a.py")), "")])
+    assert resolver.get_module("Path") == "pathlib"
+    assert shared_resolver.get_registered_names("class A: pass") == {}
+
+
+def test_package_resolver_should_prefer_known_modules(package):
+    package.join("a.py").write("class Optional:\n    pass\n")
+    resolver = get_package_resolver([(str(package.join("a.py")), "")])
+    assert resolver.get_module("Optional") == "typing"
+
+
+CROSS_MODULE_CODE = 'def f(a):\n    """Do foo.\n\n    :sig: (B) -> Alias\n    """\n'
+
+
+@mark.parametrize("jobs", [1, 2])
+def test_generate_stubs_should_import_types_from_other_modules(package, jobs):
+    package.join("a.py").write(CROSS_MODULE_CODE)
+    package.join("sub", "b.py").write("# sigalias: Alias = int\n\nclass B:\n    pass\n")
+    results = list(generate_stubs([str(package)], jobs=jobs))
+    assert all(error is None for _, _, error in results)
+    stub = package.join("a.pyi").read()
+    assert "from pkg.sub.b import Alias, B\n\ndef f(a: B) -> Alias: ..." in stub
+
+
+@mark.parametrize("jobs", [1, 2])
+def test_generate_stubs_should_import_types_registered_on_shared_resolver(
+    package, shared_resolver, jobs
+):
+    package.join("a.py").write(CROSS_MODULE_CODE.replace("(B) -> Alias", "(Path) -> None"))
+    shared_resolver.register_module("pathlib", ["Path"])
+    results = list(generate_stubs([str(package)], jobs=jobs))
+    assert all(error is None for _, _, error in results)
+    assert "from pathlib import Path\n" in package.join("a.pyi").read()
+
+
+def test_generate_stubs_should_report_types_not_defined_in_package(package):
+    package.join("a.py").write(CROSS_MODULE_CODE)
+    results = {os.path.basename(s): e for s, _, e in generate_stubs([str(package)])}
+    assert results["a.py"].startswith("ValueError: Unknown types: ")
+
+
+def test_stub_cache_key_should_depend_on_used_package_names(tmpdir):
+    cache = StubCache(str(tmpdir.join("cache")))
+    source = CROSS_MODULE_CODE.replace("Alias", "None")
+    first, second = TypeResolver(), TypeResolver()
+    first.register_module("x", ["B"])
+    second.register_module("y", ["B"])
+    assert "from x import B" in cache.get_stub(source, resolver=first)
+    assert "from y import B" in cache.get_stub(source, resolver=second)
+    assert cache.misses == 2
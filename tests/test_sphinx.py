@@ -0,0 +1,362 @@
+from __future__ import unicode_literals
+
+from pytest import fixture
+
+import importlib
+import inspect
+import sys
+
+import pygenstub
+from pygenstub import (
+    SignatureIndex,
+    get_env_data,
+    get_signature_index,
+    merge_info,
+    process_docstring,
+    collect_aliases,
+    get_alias_index,
+    prune_indexes,
+    purge_doc,
+    setup,
+)
+
+
+MODULE_CODE = '''
+import sys
+
+# sigalias: Number = int
+
+
+class C:
+    """A class.
+
+    :sig: (int) -> None
+    :param a: First.
+    """
+
+    def __init__(self, a):
+        self.a = a
+
+    def m(self, b):
+        """Do bar.
+
+        :sig: (str) -> bool
+        :param b: Second.
+        :return: Result.
+        """
+        return True
+
+    @property
+    def p(self):
+        """Get baz.
+
+        :sig: () -> float
+        :return: Value.
+        """
+        return 0.0
+
+    @p.setter
+    def p(self, value):
+        """Set baz.
+
+        :sig: (float) -> None
+        """
+
+
+class D:
+    """Another class."""
+
+    def __init__(self, a):
+        """Initialize this object.
+
+        :sig: (int) -> None
+        :param a: First.
+        """
+
+
+def f(a, b):
+    """Do foo.
+
+    :sig: (int, str) -> bool
+    :param a: First.
+    :param b: Second.
+    :return: Result.
+    """
+    def g(c):
+        """Do nested.
+
+        :sig: (int) -> None
+        """
+    return True
+
+
+def h():
+    """Do nothing."""
+
+
+if sys.version_info >= (3, 0):
+    def e():
+        """Do first.
+
+        :sig: () -> int
+        """
+else:
+    def e():
+        """Do second.
+
+        :sig: () -> str
+        """
+
+
+def k(n):
+    """Do qux.
+
+    :sig: (Number) -> None
+    :param n: Number.
+    """
+'''
+
+
+class Env:
+    def __init__(self, docname="api"):
+        self.docname = docname
+
+
+class App:
+    def __init__(self, env=None):
+        self.env = env if env is not None else Env()
+        self.handlers = {}
+
+    def connect(self, event, handler):
+        self.handlers[event] = handler
+
+
+@fixture
+def documented(tmpdir, monkeypatch):
+    """Module with some signatures in its docstrings."""
+    tmpdir.join("documented.py").write(MODULE_CODE)
+    monkeypatch.syspath_prepend(str(tmpdir))
+    yield importlib.import_module("documented")
+    del sys.modules["documented"]
+
+
+@fixture
+def redefined(tmpdir, monkeypatch):
+    """Module with a different definition for an alias."""
+    code = MODULE_CODE.replace("Number = int", "Number = float")
+    tmpdir.join("redefined.py").write(code)
+    monkeypatch.syspath_prepend(str(tmpdir))
+    yield importlib.import_module("redefined")
+    del sys.modules["redefined"]
+
+
+def get_lines(obj):
+    return inspect.getdoc(obj).splitlines()
+
+
+def test_index_should_map_qualified_names_to_signatures():
+    signatures = SignatureIndex(MODULE_CODE).signatures
+    assert signatures == {
+        "C": "(int) -> None",
+        "C.m": "(str) -> bool",
+        "C.p": "() -> float",
+        "D.__init__": "(int) -> None",
+        "f": "(int, str) -> bool",
+        "e": "() -> int",
+        "k": "(Number) -> None",
+    }
+
+
+def test_index_should_not_resolve_class_bases():
+    source = (
+        "from collections import namedtuple\n"
+        "from typing import Dict\n\n"
+        "class A(Dict[str, int]):\n"
+        '    def m(self):\n        """Do foo.\n\n        :sig: () -> int\n        """\n\n'
+        "class P(namedtuple('P', 'x y')):\n"
+        '    """A point.\n\n    :sig: (int, int) -> None\n    """\n'
+    )
+    signatures = SignatureIndex(source).signatures
+    assert signatures == {"A.m": "() -> int", "P": "(int, int) -> None"}
+
+
+def fail(*args, **kwargs):
+    raise AssertionError("should not be called")
+
+
+def test_index_should_be_built_once_per_module(documented, monkeypatch):
+    indexes = {}
+    get_signature_index("documented", indexes)
+    monkeypatch.setattr(pygenstub, "SignatureIndex", fail)
+    assert get_signature_index("documented", indexes)["f"] == "(int, str) -> bool"
+
+
+def test_index_should_be_rebuilt_when_module_changes(documented, tmpdir):
+    indexes = {}
+    get_signature_index("documented", indexes)
+    source = tmpdir.join("documented.py")
+    source.write(MODULE_CODE.replace("(int, str) -> bool", "(int, str) -> int"))
+    source.setmtime(source.mtime() + 10)
+    assert get_signature_index("documented", indexes)["f"] == "(int, str) -> int"
+
+
+def test_index_should_not_be_available_for_module_without_source():
+    assert get_signature_index("sys", {}) is None
+
+
+def test_function_docstring_should_get_types(documented):
+    lines = get_lines(documented.f)
+    process_docstring(App(), "function", "documented.f", documented.f, None, lines)
+    assert lines == [
+        "Do foo.",
+        "",
+        ":type a: int",
+        ":param a: First.",
+        ":type b: str",
+        ":param b: Second.",
+        ":rtype: bool",
+        ":return: Result.",
+    ]
+
+
+def test_function_docstring_should_not_be_parsed(documented, monkeypatch):
+    app = App()
+    process_docstring(app, "function", "documented.h", documented.h, None, [])
+    monkeypatch.setattr(pygenstub, "extract_signature", fail)
+    lines = get_lines(documented.f)
+    process_docstring(app, "function", "documented.f", documented.f, None, lines)
+    assert ":type a: int" in lines
+
+
+def reexported(a):
+    """Do foo.
+
+    :sig: (int) -> str
+    :param a: First.
+    """
+
+
+def test_docstring_of_object_not_in_index_should_be_parsed(documented, monkeypatch):
+    monkeypatch.setattr(reexported, "__module__", "documented")
+    lines = get_lines(reexported)
+    process_docstring(App(), "function", "documented.reexported", reexported, None, lines)
+    assert lines == ["Do foo.", "", ":type a: int", ":param a: First."]
+
+
+def test_docstring_without_signature_should_not_change(documented):
+    lines = get_lines(documented.h)
+    process_docstring(App(), "function", "documented.h", documented.h, None, lines)
+    assert lines == ["Do nothing."]
+
+
+def test_class_docstring_should_get_types(documented):
+    lines = get_lines(documented.C)
+    process_docstring(App(), "class", "documented.C", documented.C, None, lines)
+    assert lines == ["A class.", "", ":type a: int", ":param a: First."]
+
+
+def test_class_docstring_should_get_types_from_init(documented):
+    lines = get_lines(documented.D)
+    process_docstring(App(), "class", "documented.D", documented.D, None, lines)
+    assert lines == ["Another class.", ":type a: int", ":param a: First."]
+
+
+def test_property_docstring_should_get_return_type(documented):
+    lines = get_lines(documented.C.p)
+    process_docstring(App(), "property", "documented.C.p", documented.C.p, None, lines)
+    assert lines == ["Get baz.", "", ":rtype: float", ":return: Value."]
+
+
+def test_extension_should_be_parallel_safe():
+    app = App()
+    metadata = setup(app)
+    assert metadata["parallel_read_safe"] and metadata["parallel_write_safe"]
+    assert app.handlers["env-merge-info"] is merge_info
+    assert app.handlers["env-purge-doc"] is purge_doc
+
+
+def test_env_should_store_signatures_and_documented_modules(documented):
+    app = App()
+    process_docstring(app, "function", "documented.h", documented.h, None, [])
+    data = get_env_data(app.env)
+    assert data["modules"] == {"api": {"documented"}}
+    assert data["signatures"]["documented"][1]["f"] == "(int, str) -> bool"
+
+
+def test_env_should_reuse_signatures_in_later_builds(documented, monkeypatch):
+    env = Env()
+    process_docstring(App(env), "function", "documented.h", documented.h, None, [])
+    purge_doc(App(env), env, "api")
+    monkeypatch.setattr(pygenstub, "SignatureIndex", fail)
+    lines = get_lines(documented.f)
+    process_docstring(App(env), "function", "documented.f", documented.f, None, lines)
+    assert ":type a: int" in lines
+
+
+def test_purge_should_remove_data_of_document(documented):
+    app = App()
+    process_docstring(app, "function", "documented.h", documented.h, None, [])
+    purge_doc(app, app.env, "api")
+    data = get_env_data(app.env)
+    assert (data["modules"] == {}) and ("documented" in data["signatures"])
+
+
+def test_prune_should_remove_indexes_of_undocumented_modules(documented):
+    app = App()
+    lines = get_lines(documented.f)
+    process_docstring(app, "function", "documented.f", documented.f, None, lines)
+    purge_doc(app, app.env, "api")
+    prune_indexes(app, app.env)
+    data = get_env_data(app.env)
+    assert (data["signatures"] == {}) and (data["aliases"] == {})
+
+
+def test_merge_should_add_data_of_read_documents(documented):
+    app = App()
+    other = Env(docname="other")
+    lines = get_lines(documented.f)
+    process_docstring(App(other), "function", "documented.f", documented.f, None, lines)
+    merge_info(app, app.env, {"other"}, other)
+    data = get_env_data(app.env)
+    assert data["modules"] == {"other": {"documented"}}
+    assert "documented" in data["aliases"]
+    assert "documented" in data["signatures"]
+
+
+def test_aliases_should_be_collected_from_alias_lines():
+    source = "# sigalias: A = int\n  # sigalias: B = List[str]  \nx = 1  # sigalias: C = str\n"
+    assert collect_aliases(source) == {"A": "int", "B": "List[str]"}
+
+
+def test_aliases_should_be_collected_from_source_with_crlf_line_ends(tmpdir, monkeypatch):
+    source = MODULE_CODE.replace("\n", "\r\n").encode("utf-8")
+    tmpdir.join("crlf.py").write_binary(source)
+    monkeypatch.syspath_prepend(str(tmpdir))
+    importlib.import_module("crlf")
+    try:
+        assert get_alias_index("crlf", {}) == {"Number": "int"}
+    finally:
+        del sys.modules["crlf"]
+
+
+def test_aliases_should_not_be_collected_from_source_without_aliases():
+    assert collect_aliases(MODULE_CODE.replace("# sigalias: Number = int", "")) == {}
+
+
+def test_parameter_type_should_get_alias_of_its_module(documented, redefined):
+    app = App()
+    lines = get_lines(documented.k)
+    process_docstring(app, "function", "documented.k", documented.k, None, lines)
+    assert lines[2] == ":type n: *Number* :sup:`int`"
+    lines = get_lines(redefined.k)
+    process_docstring(app, "function", "redefined.k", redefined.k, None, lines)
+    assert lines[2] == ":type n: *Number* :sup:`float`"
+
+
+def test_aliases_should_not_need_module_source_through_inspect(documented, monkeypatch):
+    monkeypatch.setattr(inspect, "getsource", fail)
+    app = App()
+    process_docstring(app, "module", "documented", documented, None, [])
+    lines = get_lines(documented.k)
+    process_docstring(app, "function", "documented.k", documented.k, None, lines)
+    assert lines[2] == ":type n: *Number* :sup:`int`"
@@ -0,0 +1,84 @@
+from pytest import mark
+
+import os
+import subprocess
+import sys
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["docutils", "inspect", "argparse", "multiprocessing", "tempfile"]
+
+# importing pygenstub should take less time than importing the docutils parser
+DOCUTILS_MODULES = ["docutils.frontend", "docutils.parsers.rst"]
+
+RUNS = 3
+
+pytestmark = mark.skipif(sys.version_info < (3, 7), reason="importtime option not supported")
+
+
+def run_python(args, tmpdir):
+    env = dict(os.environ, PYTHONPATH=BASE_DIR)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    args = [sys.executable, "-X", "pycache_prefix=" + str(tmpdir.join("pyc"))] + args
+    return subprocess.run(args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def get_loaded_modules(code, tmpdir):
+    code += "\nimport sys; print(' '.join(sys.modules))"
+    process = run_python(["-c", code], tmpdir)
+    return set(process.stdout.decode("utf-8").split())
+
+
+def get_import_time(modules, tmpdir):
+    """Get the best cumulative import time of some modules, in microseconds."""
+    code = "import " + ", ".join(modules)
+    run_python(["-c", code], tmpdir)  # warm up the bytecode cache
+    best = None
+    for _ in range(RUNS):
+        process = run_python(["-X", "importtime", "-c", code], tmpdir)
+        total = 0
+        for line in process.stderr.decode("utf-8").splitlines():
+            _, cumulative, name = line.split("|")
+            if name.strip() in modules:
+                total += int(cumulative)
+        best = total if best is None else min(best, total)
+    return best
+
+
+def is_loaded(name, modules):
+    return any((m == name) or m.startswith(name + ".") for m in modules)
+
+
+@mark.parametrize("name", HEAVY_MODULES)
+def test_import_should_not_load_heavy_modules(tmpdir, name):
+    assert not is_loaded(name, get_loaded_modules("import pygenstub", tmpdir))
+
+
+def test_version_should_not_load_docutils(tmpdir):
+    code = "import pygenstub\ntry:\n    pygenstub.main(['pygenstub', '--version'])\n"
+    code += "except SystemExit:\n    pass"
+    assert not is_loaded("docutils", get_loaded_modules(code, tmpdir))
+
+
+def test_source_without_signatures_should_not_load_docutils(tmpdir):
+    code = "import pygenstub\npygenstub.get_stub(%r)" % "def f(a):\n    return a\n"
+    assert not is_loaded("docutils", get_loaded_modules(code, tmpdir))
+
+
+def test_common_docstring_should_not_load_docutils(tmpdir):
+    source = 'def f(a):\n    """Foo.\n\n    :sig: (int) -> None\n    """\n'
+    code = "import pygenstub\npygenstub.get_stub(%r)" % source
+    assert not is_loaded("docutils", get_loaded_modules(code, tmpdir))
+
+
+def test_docstring_needing_parser_should_load_docutils(tmpdir):
+    source = 'def f(a):\n    """Foo.\n\n    Bar\n    ---\n\n    :sig: (int) -> None\n    """\n'
+    code = "import pygenstub\npygenstub.get_stub(%r)" % source
+    assert is_loaded("docutils", get_loaded_modules(code, tmpdir))
+
+
+def test_import_time_should_stay_below_docutils_import_time(tmpdir):
+    pygenstub_time = get_import_time(["pygenstub"], tmpdir)
+    docutils_time = get_import_time(DOCUTILS_MODULES, tmpdir)
+    assert 0 < pygenstub_time < docutils_time
@@ -5,7 +5,8 @@ from pytest import mark, raises
 import sys
 from io import StringIO
 
-from pygenstub import get_stub
+import pygenstub
+from pygenstub import CommentIndex, get_aliases, get_stub, may_have_stub
 
 
 _INDENT = " " * 4
@@ -340,6 +341,12 @@ def test_class_sig_should_not_overwrite_existing_init_sig():
     assert get_stub(code) == "class C:\n    def __init__(self, x: int) -> None: ...\n"
 
 
+def test_new_method_cls_parameter_should_not_have_type():
+    method = get_function("__new__", params=["cls", "x"], ptypes=["int"], rtype="C")
+    code = get_class("C", methods=[method])
+    assert get_stub(code) == "class C:\n    def __new__(cls, x: int) -> C: ...\n"
+
+
 def test_if_method_decorated_unknown_then_stub_should_ignore():
     method = get_function("m", params=["self"], rtype="None", decorators=["@foo"])
     code = get_class("C", methods=[method])
@@ -401,6 +408,57 @@ def test_module_variable_type_comment_unimported_qualified_should_include_import
     assert get_stub(code) == "import x.y\n\nn = ...  # type: x.y.A\n"
 
 
+def test_module_variable_sig_in_string_should_be_ignored():
+    code = 's = "# sig: int"\n'
+    assert get_stub(code) == ""
+
+
+def test_module_variable_sig_in_string_followed_by_comment_should_use_comment():
+    code = 's = "# sig: int"  # sig: str\n'
+    assert get_stub(code) == "s = ...  # type: str\n"
+
+
+def test_module_variable_sig_in_multiline_string_should_be_ignored():
+    code = 's = """\n# sig: int\n"""\nn = 42\n'
+    assert get_stub(code) == ""
+
+
+def test_module_variable_multiline_assignment_comment_on_first_line():
+    code = "n = [  # sig: List[int]\n    42,\n]\n"
+    assert get_stub(code) == "from typing import List\n\nn = ...  # type: List[int]\n"
+
+
+@mark.skipif(sys.version_info < (3, 8), reason="statement end lines not available")
+def test_module_variable_multiline_assignment_comment_on_last_line():
+    code = "n = [\n    42,\n]  # sig: List[int]\n"
+    assert get_stub(code) == "from typing import List\n\nn = ...  # type: List[int]\n"
+
+
+def test_comment_index_should_ignore_alias_after_code():
+    code = "n = 42  # sigalias: B = int\n"
+    assert CommentIndex(code).aliases == {}
+
+
+def test_comment_index_should_ignore_alias_in_string():
+    code = 'doc = """\n# sigalias: B = int\n"""\n'
+    assert CommentIndex(code).aliases == {}
+
+
+def test_comment_index_should_collect_aliases_in_order():
+    code = "# sigalias: B = int\n\nif True:\n    # sigalias: A = str\n    pass\n"
+    assert list(CommentIndex(code).aliases.items()) == [("B", "int"), ("A", "str")]
+
+
+def test_comment_index_should_collect_signatures_by_line():
+    code = "a = 1  # sig: int\nb = 2\nc = ''  # sig: str\n"
+    assert CommentIndex(code).signatures == {1: "int", 3: "str"}
+
+
+def test_get_aliases_should_use_comment_lines():
+    lines = ["# sigalias: B = int", 's = "# sigalias: A = str"']
+    assert get_aliases(lines) == {"B": "int"}
+
+
 def test_get_stub_comment_instance_variable():
     method = get_function("m", params=["self"], rtype="None", body="self.a = 42  # sig: int")
     code = get_class("C", methods=[method])
@@ -427,3 +485,237 @@ def test_get_stub_typing_import_should_come_first():
         get_stub(code)
         == "from typing import List\n\nfrom x import A\n\ndef f(a: A, l: List) -> None: ...\n"
     )
+
+
+@mark.parametrize(
+    "code",
+    [
+        get_function("f", rtype="None"),
+        "n = 42  # sig: int\n",
+        "# sigalias: B = int\n",
+        "class C:\n    pass\n",
+        "if True:\n    class C:\n        pass\n",
+    ],
+)
+def test_may_have_stub_should_accept_sources_with_markers(code):
+    assert may_have_stub(code)
+    assert may_have_stub(code.encode("utf-8"))
+
+
+@mark.parametrize(
+    "code",
+    ["", "import sys\n", get_function("f", desc=""), "classes = []\n", "n = 42  # int\n"],
+)
+def test_may_have_stub_should_reject_sources_without_markers(code):
+    assert not may_have_stub(code)
+    assert not may_have_stub(code.encode("utf-8"))
+
+
+def test_get_stub_should_not_parse_source_without_markers(monkeypatch):
+    monkeypatch.setattr(pygenstub, "StubGenerator", None)
+    assert get_stub("import sys\n\n\ndef f():\n    pass\n") == ""
+
+
+def test_get_stub_should_skip_invalid_source_without_markers():
+    assert get_stub("def f(:\n") == ""
+
+
+_NESTED_CODE = '''
+import sys
+
+if sys.version_info >= (3, 0):
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+n = [i for i in range(10)]  # sig: List[int]
+
+
+def f(a):
+    """Do foo.
+
+    :sig: (int) -> None
+    """
+    try:
+        from x import A
+    except ImportError:
+        A = None  # sig: Optional[str]
+    for i in range(a):
+        if i > 0:
+            b = i  # sig: int
+
+    class C:
+        """A foo."""
+
+        c = 0  # sig: int
+
+    def g(b):
+        """Do bar.
+
+        :sig: (str) -> A
+        """
+        with open(b) as f:
+            return f.read()
+
+    return C
+
+
+class D:
+    """A bar.
+
+    :sig: (int) -> None
+    """
+
+    def __init__(self, a):
+        if a:
+            self.a = a  # sig: int
+        else:
+            self.a = len(str(a))
+
+    def m(self):
+        """Do baz.
+
+        :sig: () -> StringIO
+        """
+        while True:
+            x = {k: v for k, v in globals().items()}  # not a sig: comment
+        return StringIO()
+'''
+
+
+def get_unpruned_stub(code, monkeypatch):
+    with monkeypatch.context() as m:
+        m.setattr(pygenstub.StubGenerator, "visit_body", pygenstub.StubGenerator.generic_visit)
+        return get_stub(code)
+
+
+@mark.skipif(sys.version_info < (3, 8), reason="statement end lines not available")
+def test_pruned_traversal_should_generate_same_stub_as_full_traversal(monkeypatch):
+    stub = get_stub(_NESTED_CODE)
+    assert "from x import A" in stub
+    assert stub == get_unpruned_stub(_NESTED_CODE, monkeypatch)
+
+
+@mark.skipif(sys.version_info < (3, 8), reason="statement end lines not available")
+def test_pruned_traversal_should_generate_same_stub_for_module_source(monkeypatch):
+    with open(pygenstub.__file__.replace(".pyc", ".py")) as f:
+        code = f.read()
+    assert get_stub(code) == get_unpruned_stub(code, monkeypatch)
+
+
+@mark.skipif(sys.version_info < (3, 8), reason="statement end lines not available")
+def test_pruned_traversal_should_only_visit_declarations():
+    visited = set()
+
+    class Generator(pygenstub.StubGenerator):
+        def visit(self, node):
+            visited.add(node.__class__.__name__)
+            return super(Generator, self).visit(node)
+
+    Generator(_NESTED_CODE)
+    assert visited == {"ImportFrom", "Assign", "FunctionDef", "ClassDef"}
+
+
+@mark.skipif(sys.version_info < (3, 8), reason="statement end lines not available")
+def test_pruned_traversal_should_skip_statements_without_declaration_lines():
+    visited = []
+
+    class Generator(pygenstub.StubGenerator):
+        def visit_body(self, node):
+            visited.append(node.__class__.__name__)
+            return super(Generator, self).visit_body(node)
+
+    Generator(_NESTED_CODE)
+    assert "While" not in visited
+    assert visited.count("If") == 3
+
+
+_MATCH_CODE = """
+import sys
+
+match sys.platform:
+    case "linux":
+        x = 1  # sig: int
+
+        def f(a):
+            \"\"\"Do foo.
+
+            :sig: (int) -> None
+            \"\"\"
+    case _:
+        global y
+"""
+
+
+@mark.skipif(sys.version_info < (3, 10), reason="syntax introduced in py3.10")
+def test_pruned_traversal_should_visit_declarations_in_match_cases(monkeypatch):
+    stub = get_stub(_MATCH_CODE)
+    assert "x = ...  # type: int" in stub
+    assert "def f(a: int) -> None: ..." in stub
+    assert stub == get_unpruned_stub(_MATCH_CODE, monkeypatch)
+    assert stub == get_stub(_MATCH_CODE, engine="tokens")
+
+
+def test_iter_stub_should_write_to_text_stream():
+    out = StringIO()
+    out.writelines(pygenstub.iter_stub(_NESTED_CODE))
+    assert out.getvalue() == get_stub(_NESTED_CODE)
+
+
+def test_iter_stub_should_produce_lines():
+    lines = list(pygenstub.iter_stub(_NESTED_CODE))
+    assert len(lines) > 1
+    assert all(line.endswith("\n") and ("\n" not in line[:-1]) for line in lines)
+
+
+def test_iter_stub_should_process_source_before_producing_lines():
+    with raises(SyntaxError):
+        pygenstub.iter_stub("class A(:\n")
+
+
+def test_iter_stub_should_raise_unknown_types_before_first_line():
+    lines = pygenstub.iter_stub("class A:\n    x = 1  # sig: Foo\n")
+    with raises(ValueError):
+        next(lines)
+
+
+def test_node_code_should_be_indented_as_it_is_generated():
+    method = pygenstub.FunctionNode("m", parameters=[("self", "", False)], rtype="None")
+    inner = pygenstub.ClassNode("B", bases=[])
+    inner.add_child(method)
+    outer = pygenstub.ClassNode("A", bases=[])
+    outer.add_child(inner)
+    assert outer.get_code() == ["class A:", "    class B:", "        def m(self) -> None: ..."]
+
+
+def test_stub_file_should_not_be_created_on_unknown_types(tmpdir):
+    source = tmpdir.join("a.py")
+    source.write("class A:\n    x = 1  # sig: Foo\n")
+    with raises(ValueError):
+        pygenstub.generate_stub_file(str(source), str(tmpdir.join("a.pyi")))
+    assert not tmpdir.join("a.pyi").check()
+
+
+def test_stub_nodes_should_not_have_instance_dictionaries():
+    nodes = [
+        pygenstub.StubNode(),
+        pygenstub.VariableNode("x", "int"),
+        pygenstub.FunctionNode("f", parameters=[], rtype="None"),
+        pygenstub.ClassNode("A", bases=[]),
+    ]
+    assert not any(hasattr(node, "__dict__") for node in nodes)
+
+
+def test_stub_nodes_should_create_containers_lazily():
+    node = pygenstub.FunctionNode("f", parameters=[], rtype="None")
+    assert node.variables == node.children == node.decorators == ()
+    node.add_variable(pygenstub.VariableNode("x", "int"))
+    assert [v.name for v in node.variables] == ["x"]
+
+
+def test_stub_node_names_should_be_interned():
+    if sys.version_info < (3, 0):
+        return
+    names = ["".join(["my", "_name"]) for _ in range(2)]
+    nodes = [pygenstub.VariableNode(name, "int") for name in names]
+    assert nodes[0].name is nodes[1].name
@@ -0,0 +1,169 @@
+from pytest import mark, raises
+
+import logging
+
+import pygenstub
+from pygenstub import UnsupportedSourceError, get_stub
+
+
+def tokens_stub(code):
+    return get_stub(code, engine="tokens")
+
+
+_DECLARATIONS_CODE = '''
+import sys
+from typing import List
+
+if sys.version_info >= (3, 0):
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+n = [i for i in range(10)]  # sig: List[int]
+m = [
+    i for i in range(10)
+]  # sig: List[int]
+
+
+def deco(f):
+    return f
+
+
+@deco
+@deco
+def f(a,
+      b):
+    """Do foo.
+
+    :sig: (int, str) -> None
+    """
+    try:
+        from x import A
+    except ImportError:
+        A = None  # sig: Optional[str]
+    for i in range(a):
+        if i > 0:
+            b = i  # sig: int
+
+    class C:
+        """A foo."""
+
+        c = 0  # sig: int
+
+    def g(b):
+        """Do bar.
+
+        :sig: (str) -> A
+        """
+        with open(b) as f:
+            return f.read()
+
+    return C
+
+
+async def h(a):
+    """Do baz.
+
+    :sig: (int) -> None
+    """
+
+
+def skipped(a):
+    """Not in the stub."""
+    x = 1  # sig: int
+
+    def inner(b):
+        """Do inner.
+
+        :sig: (int) -> None
+        """
+
+
+class D(object):
+    """A bar."""
+
+    d = 1  # sig: int
+
+    class E:
+        """A baz."""
+
+        def m(self, x):
+            (
+                """Do qux.
+
+                :sig: (int) -> int
+                """
+            )
+
+    def one(self): return 1  # sig: ignored
+
+
+class F: pass
+'''
+
+
+@mark.parametrize(
+    "code",
+    [
+        _DECLARATIONS_CODE,
+        "def f(a):\n\t'''Do foo.\n\n\t:sig: (int) -> None\n\t'''\n\tx = 1  # sig: int\n",
+        "x = 1; y = 2\nz = 3  # sig: int\n",
+        "def f(a): '''Do foo.\n\n:sig: (int) -> None\n'''\n",
+        "class A:\n    x = 1  # sig: int\nclass B(A): pass\n",
+    ],
+)
+def test_tokens_engine_should_generate_same_stub_as_ast_engine(code):
+    assert tokens_stub(code) == get_stub(code)
+
+
+def test_tokens_engine_should_generate_same_stub_for_module_source():
+    with open(pygenstub.__file__.replace(".pyc", ".py")) as f:
+        code = f.read()
+    assert tokens_stub(code) == get_stub(code)
+
+
+@mark.parametrize(
+    "code",
+    [
+        "if x: from a import b\nc = 1  # sig: b\n",
+        "if x: y = 1  # sig: int\n",
+        'def f(a):\n    """Do foo.\n\n    :sig: (int) -> None\n    """; x = 1\n',
+    ],
+)
+def test_tokens_engine_should_reject_unsupported_source(code):
+    with raises(UnsupportedSourceError):
+        tokens_stub(code)
+
+
+def test_tokens_engine_should_report_syntax_errors_in_declarations():
+    with raises(SyntaxError):
+        tokens_stub("class A(:\n")
+
+
+def test_get_stub_should_reject_unknown_engine():
+    with raises(ValueError) as e:
+        get_stub("x = 1  # sig: int\n", engine="cst")
+    assert "Unknown engine: cst" in str(e.value)
+
+
+def test_generate_stubs_should_fall_back_to_ast_engine(package, caplog):
+    package.join("a.py").write("import sys\nif sys: from os import sep\nx = 1  # sig: sep\n")
+    with caplog.at_level(logging.WARNING):
+        results = list(pygenstub.generate_stubs([str(package)], engine="tokens"))
+    assert all(error is None for _, _, error in results)
+    assert "from os import sep" in package.join("a.pyi").read()
+    assert "falling back to the ast engine" in caplog.text
+
+
+def test_cli_engine_should_select_engine(package, monkeypatch):
+    engines = []
+    original = pygenstub.iter_stub
+
+    def iter_stub_spy(source, engine="ast", observer=None, resolver=None):
+        engines.append(engine)
+        return original(source, engine=engine, resolver=resolver)
+
+    monkeypatch.setattr(pygenstub, "iter_stub", iter_stub_spy)
+    pygenstub.main(argv=["pygenstub", "--engine", "tokens", str(package)])
+    assert engines == ["tokens", "tokens"]
+    assert package.join("a.pyi").read().endswith(get_stub(package.join("a.py").read()))
@@ -0,0 +1,207 @@
+from __future__ import unicode_literals
+
+from pytest import fixture, mark, raises
+
+import pygenstub
+from pygenstub import get_stub, parse_signature, parse_type, split_parameter_types
+
+
+@fixture
+def type_cache():
+    pygenstub.clear_caches()
+    yield pygenstub.type_cache
+    pygenstub.clear_caches()
+
+
+def test_type_should_parse_name():
+    parsed = parse_type("int")
+    assert (parsed.name, parsed.args, parsed.requires) == ("int", (), {"int"})
+
+
+def test_type_should_parse_arguments():
+    parsed = parse_type("Dict[str, List[int]]")
+    assert parsed.name == "Dict"
+    assert [a.text for a in parsed.args] == ["str", "List[int]"]
+    assert parsed.requires == {"Dict", "str", "List", "int"}
+
+
+def test_type_should_parse_list_of_types():
+    parsed = parse_type("Callable[[int, str], None]")
+    assert parsed.args[0].name is None
+    assert [a.text for a in parsed.args[0].args] == ["int", "str"]
+    assert parse_type("Callable[[], None]").args[0].args == ()
+
+
+def test_type_should_not_require_ellipsis_and_literals():
+    assert parse_type("Tuple[int, ...]").requires == {"Tuple", "int"}
+    assert parse_type("Literal['a', 1]").requires == {"Literal"}
+
+
+def test_type_should_collect_namespaces():
+    parsed = parse_type("Optional[x.y.A]")
+    assert parsed.requires == {"Optional", "x.y.A"}
+    assert parsed.namespaces == {"x.y"}
+
+
+def test_type_should_parse_forward_reference():
+    parsed = parse_type('Optional["x.A"]')
+    assert parsed.args[0].args[0].name == "x.A"
+    assert (parsed.requires, parsed.namespaces) == ({"Optional", "x.A"}, {"x"})
+
+
+def test_type_should_parse_nested_forward_reference():
+    assert parse_type("'List[\"A\"]'").requires == {"List", "A"}
+
+
+def test_type_should_not_parse_literal_values_as_references():
+    assert parse_type("Literal['A', \"B\"]").requires == {"Literal"}
+    assert parse_type("Annotated['A', 'B']").requires == {"Annotated", "A"}
+    assert parse_type("Annotated[int, f(x), 'B']").requires == {"Annotated", "int", "f", "x"}
+
+
+def test_type_should_parse_union_operator():
+    parsed = parse_type("List[int] | x.A | None")
+    assert parsed.name is None
+    assert [a.text for a in parsed.args] == ["List[int]", "x.A", "None"]
+    assert parsed.requires == {"List", "int", "x.A", "None"}
+
+
+def test_type_should_parse_empty_tuple():
+    parsed = parse_type("Tuple[()]")
+    assert parsed.args[0].text == "()"
+    assert parsed.requires == {"Tuple"}
+
+
+@mark.parametrize(
+    "value",
+    ['b"x"', "B'x'", "br'x'", "1.5", "-.5e3", "2j", r"r'\d'", r"'\''", "'it' 's'", "b'a' b'b'"],
+)
+def test_type_should_parse_string_and_number_literals(value):
+    assert parse_type("Literal[%s]" % value).requires == {"Literal"}
+
+
+def test_type_should_parse_float_annotation_metadata():
+    assert parse_type("Annotated[int, 1.5]").requires == {"Annotated", "int"}
+
+
+def test_type_should_keep_metadata_that_is_not_a_type():
+    parsed = parse_type('Annotated[int, Field(gt=0, title="a, b")]')
+    assert parsed.args[1].text == 'Field(gt=0, title="a, b")'
+    assert parsed.requires == {"Annotated", "int", "Field"}
+
+
+def test_stub_should_keep_valid_type_syntax():
+    signature = '(int | None, Tuple[()]) -> Literal[b"x"]'
+    source = 'def f(a, b):\n    """Do foo.\n\n    :sig: %s\n    """\n' % signature
+    assert "def f(a: int | None, b: Tuple[()]) -> Literal[b\"x\"]: ..." in get_stub(source)
+
+
+def test_stub_should_import_forward_references():
+    source = (
+        "from x import A\n\n\n"
+        'def f():\n    """Do foo.\n\n    :sig: () -> Optional["A"]\n    """\n'
+    )
+    assert get_stub(source).startswith("from typing import Optional\n\nfrom x import A\n")
+
+
+def test_stub_should_fail_on_unknown_forward_reference():
+    source = 'def f():\n    """Do foo.\n\n    :sig: () -> Optional["A"]\n    """\n'
+    with raises(ValueError) as e:
+        get_stub(source)
+    assert "Unknown types: A" in str(e.value)
+
+
+def test_type_should_keep_source_text():
+    assert parse_type("  Dict[str,int]  ").text == "Dict[str,int]"
+
+
+def test_type_should_be_immutable():
+    parsed = parse_type("List[int]")
+    with raises(AttributeError):
+        parsed.name = "Set"
+
+
+@mark.parametrize(
+    "expression",
+    [
+        "",
+        "List[",
+        "List[int",
+        "List[]",
+        "List[int]]",
+        "List[int str]",
+        "int str",
+        "int,",
+        "a.",
+        "(int)",
+        "int?",
+        "int |",
+        "| int",
+        "Annotated[int, f(]",
+        "Optional[b'A']",
+        "Optional['int str']",
+        "Literal['a' b'b']",
+    ],
+)
+def test_type_should_reject_invalid_expression(expression):
+    with raises(ValueError):
+        parse_type(expression)
+
+
+def test_type_should_be_cached(type_cache):
+    assert parse_type("List[int]") is parse_type("List[int]")
+    assert (type_cache.hits, type_cache.misses) == (1, 2)
+
+
+def test_types_should_share_arguments(type_cache):
+    assert parse_type("List[int]").args[0] is parse_type("int")
+
+
+def test_signatures_should_share_parameter_types(type_cache):
+    parse_signature("(Dict[str, int]) -> None")
+    parse_signature("(Dict[str, int], int) -> None")
+    assert type_cache.hits == 3
+
+
+def test_split_parameter_types_should_split_top_level_commas():
+    assert split_parameter_types("int, Dict[str, int] , Callable[[int], str]") == [
+        "int",
+        "Dict[str, int]",
+        "Callable[[int], str]",
+    ]
+
+
+def test_split_parameter_types_should_not_split_literals():
+    assert split_parameter_types("Literal[',', '['], int") == ["Literal[',', '[']", "int"]
+
+
+def test_signature_should_require_names_only():
+    _, _, requires, _ = parse_signature("(Literal['a'], x.A) -> Tuple[int, ...]")
+    assert requires == {"Literal", "x.A", "Tuple", "int"}
+
+
+def test_signature_should_collect_namespaces():
+    _, _, _, namespaces = parse_signature("(x.A, 'y.z.B') -> Optional[x.C]")
+    assert namespaces == {"x", "y.z"}
+
+
+@mark.parametrize(
+    "signature",
+    [
+        "int -> None",
+        "(int) ->",
+        "(int) -> None -> None",
+        "(int, ) str -> None",
+        "(int,) -> None",
+    ],
+)
+def test_signature_should_reject_invalid_structure(signature):
+    with raises(ValueError):
+        parse_signature(signature)
+
+
+def test_stub_should_fail_early_on_invalid_signature():
+    source = 'def f(a):\n    """Do foo.\n\n    :sig: (List[int) -> None\n    """\n'
+    with raises(ValueError) as e:
+        get_stub(source)
+    assert "Invalid type expression" in str(e.value)
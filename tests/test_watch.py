@@ -0,0 +1,202 @@
+from pytest import fixture, importorskip, raises
+
+import os
+import sys
+
+import pygenstub
+from pygenstub import Manifest, PollingMonitor, get_monitor, watch_stubs
+
+
+FUNCTION_CODE = 'def f(a):\n    """Do foo.\n\n    :sig: (int) -> None\n    """\n'
+
+
+class StopWatching(KeyboardInterrupt):
+    pass
+
+
+class FakeMonitor:
+    """Monitor that makes a change at every wait and stops when there are no more."""
+
+    def __init__(self, *changes):
+        self.changes = list(changes)
+        self.watched = set()
+        self.timeouts = []
+        self.closed = False
+
+    def watch(self, directories):
+        self.watched.update(directories)
+
+    def wait(self, timeout=None):
+        self.timeouts.append(timeout)
+        if len(self.changes) == 0:
+            if timeout is None:
+                raise StopWatching()
+            return False
+        change = self.changes.pop(0)
+        if change is None:
+            return False
+        change()
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+@fixture
+def generated(package):
+    list(pygenstub.generate_stubs([str(package)]))
+    yield package
+
+
+def watch(package, monitor, **kwargs):
+    results = []
+    with raises(StopWatching):
+        for result in watch_stubs([str(package)], monitor=monitor, **kwargs):
+            results.append(result)
+    return [os.path.relpath(source_path, str(package)) for source_path, _, _ in results]
+
+
+def modify(path, code=FUNCTION_CODE.replace("int", "str")):
+    def change():
+        path.write(code)
+        stat = os.stat(str(path))
+        os.utime(str(path), (stat.st_atime, stat.st_mtime + 10))
+
+    return change
+
+
+def test_watch_should_regenerate_changed_source(generated):
+    monitor = FakeMonitor(modify(generated.join("a.py")))
+    assert watch(generated, monitor) == ["a.py"]
+    assert "a: str" in generated.join("a.pyi").read()
+    assert "a: int" in generated.join("sub", "b.pyi").read()
+
+
+def test_watch_should_ignore_unrelated_changes(generated):
+    monitor = FakeMonitor(modify(generated.join("notes.txt")))
+    assert watch(generated, monitor) == []
+
+
+def test_watch_should_regenerate_once_for_burst_of_changes(generated):
+    a, b = generated.join("a.py"), generated.join("sub", "b.py")
+    monitor = FakeMonitor(modify(a), modify(a, FUNCTION_CODE), modify(b))
+    assert watch(generated, monitor) == ["a.py", os.path.join("sub", "b.py")]
+    assert "a: int" in generated.join("a.pyi").read()
+
+
+def test_watch_should_wait_for_changes_to_settle(generated):
+    a = generated.join("a.py")
+    monitor = FakeMonitor(modify(a), modify(a, FUNCTION_CODE), None)
+    watch(generated, monitor, delay=0.5)
+    assert monitor.timeouts == [None, 0.5, 0.5, None]
+
+
+def test_watch_should_generate_new_source(generated):
+    monitor = FakeMonitor(modify(generated.join("new.py")))
+    assert watch(generated, monitor) == ["new.py"]
+    assert generated.join("new.pyi").check()
+
+
+def test_watch_should_ignore_deleted_source(generated):
+    monitor = FakeMonitor(generated.join("a.py").remove)
+    assert watch(generated, monitor) == []
+
+
+def test_watch_should_report_errors(generated):
+    monitor = FakeMonitor(modify(generated.join("a.py"), "class A(:\n"))
+    results = []
+    with raises(StopWatching):
+        for result in watch_stubs([str(generated)], monitor=monitor):
+            results.append(result)
+    assert results[0][2].startswith("SyntaxError: ")
+
+
+def test_watch_should_watch_new_directories(generated):
+    new_dir = generated.join("new")
+    monitor = FakeMonitor(new_dir.mkdir, modify(new_dir.join("c.py")))
+    assert watch(generated, monitor) == [os.path.join("new", "c.py")]
+    assert str(new_dir) in monitor.watched
+
+
+def test_watch_should_not_watch_hidden_directories(generated):
+    monitor = FakeMonitor()
+    watch(generated, monitor)
+    assert monitor.watched == {str(generated), str(generated.join("sub"))}
+
+
+def test_watch_should_watch_directory_of_source_file(generated):
+    monitor = FakeMonitor(modify(generated.join("a.py")))
+    results = []
+    with raises(StopWatching):
+        for result in watch_stubs([str(generated.join("a.py"))], monitor=monitor):
+            results.append(result)
+    assert len(results) == 1
+    assert monitor.watched == {str(generated)}
+
+
+def test_watch_should_close_monitor(generated):
+    monitor = FakeMonitor()
+    watch(generated, monitor)
+    assert monitor.closed
+
+
+def test_watch_should_update_manifest(generated, tmpdir):
+    manifest_path = str(tmpdir.join("manifest.json"))
+    monitor = FakeMonitor(modify(generated.join("a.py")))
+    watch(generated, monitor, manifest_path=manifest_path)
+    entry = Manifest(manifest_path).entries[os.path.join("pkg", "a.py")]
+    assert entry["mtime"] == os.stat(str(generated.join("a.py"))).st_mtime
+
+
+def test_polling_monitor_should_report_possible_changes_after_interval():
+    monitor = PollingMonitor(interval=0.01)
+    assert monitor.wait()
+    assert not monitor.wait(0.01)
+
+
+def test_get_monitor_should_fall_back_to_polling(monkeypatch):
+    monkeypatch.setitem(sys.modules, "inotify_simple", None)
+    assert isinstance(get_monitor(), PollingMonitor)
+
+
+def test_inotify_monitor_should_report_changes(tmpdir):
+    importorskip("inotify_simple")
+    monitor = pygenstub.INotifyMonitor()
+    try:
+        monitor.watch([str(tmpdir)])
+        assert not monitor.wait(0.01)
+        tmpdir.join("a.py").write("")
+        assert monitor.wait(0.01)
+    finally:
+        monitor.close()
+
+
+def test_cli_watch_should_regenerate_changed_source(package, monkeypatch):
+    monitor = FakeMonitor(modify(package.join("a.py")))
+    monkeypatch.setattr(pygenstub, "get_monitor", lambda: monitor)
+    pygenstub.main(argv=["pygenstub", "--watch", str(package)])
+    assert "a: str" in package.join("a.pyi").read()
+
+
+def test_cli_watch_should_print_errors_and_continue(package, monkeypatch, capsys):
+    a = package.join("a.py")
+    monitor = FakeMonitor(modify(a, "class A(:\n"), None, modify(a))
+    monkeypatch.setattr(pygenstub, "get_monitor", lambda: monitor)
+    pygenstub.main(argv=["pygenstub", "--watch", str(package)])
+    out, err = capsys.readouterr()
+    assert err.startswith(str(a) + ": SyntaxError: ")
+    assert "a: str" in package.join("a.pyi").read()
+
+
+def test_watch_should_regenerate_source_using_moved_name(package):
+    package.join("a.py").write(FUNCTION_CODE.replace("int", "B"))
+    package.join("sub", "b.py").write("class B:\n    pass\n")
+    list(pygenstub.generate_stubs([str(package)]))
+
+    def move():
+        modify(package.join("sub", "b.py"), "class C:\n    pass\n")()
+        modify(package.join("c.py"), "class B:\n    pass\n")()
+
+    monitor = FakeMonitor(move)
+    assert watch(package, monitor) == ["a.py", "c.py", os.path.join("sub", "b.py")]
+    assert "from pkg.c import B" in package.join("a.pyi").read()